@@ -245,6 +245,8 @@ class ColaApplication(object):
         monitor = fsmonitor.current()
         monitor.files_changed.connect(
             cmds.run(cmds.Refresh), type=Qt.QueuedConnection)
+        monitor.paths_changed.connect(
+            cmds.run(cmds.RefreshPaths), type=Qt.QueuedConnection)
         monitor.config_changed.connect(
             cmds.run(cmds.RefreshConfig), type=Qt.QueuedConnection)
         # Start the filesystem monitor thread
@@ -472,11 +474,7 @@ def async_update(context):
     git-cola should startup as quickly as possible.
 
     """
-    def update_status():
-        context.model.update_status(update_index=True)
-
-    task = qtutils.SimpleTask(context.view, update_status)
-    context.runtask.start(task)
+    context.model.refresher.refresh(update_index=True)
 
 
 def startup_message():
@@ -533,6 +531,14 @@ class ApplicationContext(object):
     def set_view(self, view):
         self.view = view
         self.runtask = qtutils.RunTask(parent=view)
+        if self.model is not None:
+            self.model.refresher.set_runner(self.run_in_background)
+            self.model.diff_loader.set_runner(self.run_in_background)
+
+    def run_in_background(self, fn, callback):
+        """Call fn() in a thread and pass its result to callback()"""
+        task = qtutils.SimpleTask(self.view, fn)
+        self.runtask.start(task, result=callback)
 
 
 def winmain(main, *argv):
@@ -1,4 +1,5 @@
 from __future__ import division, absolute_import, unicode_literals
+import functools
 import os
 import re
 import sys
@@ -124,15 +125,23 @@ class EditModel(ModelCommand):
         self.old_diff_type = self.model.diff_type
 
         self.new_diff_text = self.old_diff_text
+        self.new_parsed_diff = None
         self.new_filename = self.old_filename
         self.new_mode = self.old_mode
         self.new_diff_type = self.old_diff_type
 
     def do(self):
         """Perform the operation."""
+        # A diff that is still being computed is out of date
+        self.model.diff_loader.cancel()
+        self.apply()
+
+    def apply(self):
+        """Apply the new diff data to the model"""
         self.model.set_filename(self.new_filename)
         self.model.set_mode(self.new_mode)
-        self.model.set_diff_text(self.new_diff_text)
+        self.model.set_diff_text(self.new_diff_text,
+                                 parsed_diff=self.new_parsed_diff)
         self.model.set_diff_type(self.new_diff_type)
 
     def undo(self):
@@ -292,7 +301,8 @@ class ApplyDiffSelection(ModelCommand):
     def do(self):
         diff_text = self.model.diff_text
 
-        parser = DiffParser(self.model.filename, diff_text)
+        parser = DiffParser(self.model.filename, diff_text,
+                            parsed_diff=self.model.parsed_diff())
         if self.has_selection:
             patch = parser.generate_patch(self.first_line_idx,
                                           self.last_line_idx,
@@ -1117,17 +1127,42 @@ class DiffImage(EditModel):
 class Diff(EditModel):
     """Perform a diff and set the model's current text."""
 
-    def __init__(self, filename, cached=False, deleted=False):
+    def __init__(self, filename, cached=False, deleted=False, max_size=None):
         super(Diff, self).__init__()  # TODO context
-        opts = {}
-        if cached:
-            opts['ref'] = self.model.head
+        self.cached = cached
+        self.deleted = deleted
+        self.ref = cached and self.model.head or None
+        if max_size is None:
+            max_size = prefs.maxdiffsize()
+        self.max_size = max_size
         self.new_filename = filename
         self.new_mode = self.model.mode_worktree
-        self.new_diff_text = gitcmds.diff_helper(
-            filename=filename, cached=cached, deleted=deleted, **opts)
         self.new_diff_type = 'text'
 
+    def do(self):
+        """Show a cached diff now, otherwise compute it in the background"""
+        cache = gitcmds.diff_cache()
+        key = cache.key(self.new_filename, cached=self.cached,
+                        deleted=self.deleted, ref=self.ref,
+                        max_size=self.max_size)
+        parsed_diff = cache.get(key)
+        if parsed_diff is not None:
+            self.set_parsed_diff(parsed_diff)
+            EditModel.do(self)
+            return
+        diff = functools.partial(cache.diff, key, self.new_filename,
+                                 cached=self.cached, deleted=self.deleted,
+                                 ref=self.ref, max_size=self.max_size)
+        self.model.diff_loader.load(diff, self.apply_parsed_diff)
+
+    def set_parsed_diff(self, parsed_diff):
+        self.new_diff_text = parsed_diff.text
+        self.new_parsed_diff = parsed_diff
+
+    def apply_parsed_diff(self, parsed_diff):
+        self.set_parsed_diff(parsed_diff)
+        self.apply()
+
 
 class Diffstat(EditModel):
     """Perform a diffstat and set the model's diff text."""
@@ -1150,10 +1185,10 @@ class Diffstat(EditModel):
 class DiffStaged(Diff):
     """Perform a staged diff on a file."""
 
-    def __init__(self, filename, deleted=None):
+    def __init__(self, filename, deleted=None, max_size=None):
         # TODO context
         super(DiffStaged, self).__init__(
-            filename, cached=True, deleted=deleted)
+            filename, cached=True, deleted=deleted, max_size=max_size)
         self.new_mode = self.model.mode_index
 
 
@@ -1736,16 +1771,29 @@ class Refresh(ModelCommand):
         return N_('Refresh')
 
     def do(self):
-        self.model.update_status(update_index=True)
+        self.model.refresher.refresh(update_index=True)
         fsmonitor.current().refresh()
         gitcfg.current().update()
 
 
+class RefreshPaths(ModelCommand):
+    """Update the status of specific paths"""
+
+    def __init__(self, paths):
+        super(RefreshPaths, self).__init__()  # TODO context
+        self.paths = paths
+
+    def do(self):
+        self.model.refresher.refresh_paths(self.paths)
+
+
 class RefreshConfig(CommandMixin):
     """Refresh the git config cache"""
 
     def do(self):
-        gitcfg.current().update()
+        cfg = gitcfg.current()
+        cfg.invalidate()
+        cfg.update()
 
 
 class RevertEditsCommand(ConfirmAction):
@@ -2046,9 +2094,21 @@ def should_stage_conflicts(path):
                                default=False, cancel_text=cancel_text)
 
 
+def format_paths(paths, limit=100):
+    """Join paths for display, summarizing very long lists"""
+    paths = list(paths)
+    if len(paths) <= limit:
+        return ', '.join(paths)
+    return N_('%(paths)s and %(count)d more') % dict(
+        paths=', '.join(paths[:limit]), count=len(paths) - limit)
+
+
 class Stage(ModelCommand):
     """Stage a set of paths."""
 
+    #: Staging at least this many paths shows a progress dialog
+    PROGRESS_PATHS = 5000
+
     @staticmethod
     def name():
         return N_('Stage')
@@ -2058,7 +2118,7 @@ class Stage(ModelCommand):
         self.paths = paths
 
     def do(self):
-        msg = N_('Staging: %s') % (', '.join(self.paths))
+        msg = N_('Staging: %s') % format_paths(self.paths)
         Interaction.log(msg)
         return self.stage_paths()
 
@@ -2071,31 +2131,26 @@ class Stage(ModelCommand):
             else:
                 return self.stage_all()
 
-        add = []
-        remove = []
+        model = self.model
+        model.emit_about_to_update()
 
-        for path in set(paths):
-            if core.exists(path) or core.islink(path):
-                if path.endswith('/'):
-                    path = path.rstrip('/')
-                add.append(path)
-            else:
-                remove.append(path)
-
-        self.model.emit_about_to_update()
-
-        # `git add -u` doesn't work on untracked files
-        if add:
-            status, out, err = gitcmds.add(add)
-            Interaction.command(N_('Error'), 'git add', status, out, err)
-
-        # If a path doesn't exist then that means it should be removed
-        # from the index.   We use `git add -u` for that.
-        if remove:
-            status, out, err = gitcmds.add(remove, u=True)
-            Interaction.command(N_('Error'), 'git add -u', status, out, err)
+        # Files from the status are staged without being stat'ed again
+        files = set(model.modified)
+        files.update(model.untracked)
+        files.update(model.unmerged)
+        progress = None
+        if len(paths) >= self.PROGRESS_PATHS:
+            progress = Interaction.progress(N_('Stage'), N_('Staging'))
+        try:
+            status, out, err = gitcmds.stage_paths(
+                paths, files=files, deleted=model.unstaged_deleted,
+                progress=progress and progress.set_progress)
+        finally:
+            if progress is not None:
+                progress.hide()
+        Interaction.command(N_('Error'), 'git add', status, out, err)
 
-        self.model.update_files(emit=True)
+        model.update_files(emit=True)
         return status, out, err
 
     def stage_all(self):
@@ -2254,7 +2309,7 @@ class Unstage(ModelCommand):
         self.paths = paths
 
     def do(self):
-        msg = N_('Unstaging: %s') % (', '.join(self.paths))
+        msg = N_('Unstaging: %s') % format_paths(self.paths)
         Interaction.log(msg)
         self.unstage_paths()
 
@@ -57,7 +57,12 @@ class UStr(ustr):
     so that it can later be used when reconstructing the original
     byte sequences.
 
+    `truncated` is True for command output that was cut short by
+    run_command()'s `limit`.
+
     """
+    truncated = False
+
     def __new__(cls, string, encoding):
 
         if isinstance(string, UStr):
@@ -145,6 +150,12 @@ def xwrite(fh, content, encoding=None):
     return fh.write(encode(content, encoding=encoding))
 
 
+@interruptable
+def read_chunk(fh, size):
+    """Read up to "size" bytes without waiting for the buffer to fill"""
+    return os.read(fh.fileno(), size)
+
+
 @interruptable
 def wait(proc):
     """Wait on a subprocess and retry when interrupted"""
@@ -235,6 +246,39 @@ def communicate(proc):
     return proc.communicate()
 
 
+def communicate_limit(proc, limit, chunk_size=65536):
+    """Read up to "limit" bytes of output and stop the process after that
+
+    Returns (output, errors, truncated).  Truncated output ends with the
+    last complete line that fits within the limit.
+
+    """
+    chunks = []
+    size = 0
+    truncated = False
+    while True:
+        chunk = read_chunk(proc.stdout, chunk_size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            truncated = True
+            try:
+                proc.kill()
+            except OSError:
+                pass
+            break
+    output = b''.join(chunks)
+    if truncated:
+        output = output[:output.rfind(b'\n', 0, limit) + 1]
+    proc.stdout.close()
+    # stderr is small for the commands that are limited
+    errors = proc.stderr.read() if proc.stderr else b''
+    wait(proc)
+    return (output, errors, truncated)
+
+
 def run_command(cmd, encoding=None, *args, **kwargs):
     """Run the given command to completion, and return its results.
 
@@ -242,11 +286,21 @@ def run_command(cmd, encoding=None, *args, **kwargs):
     The results are formatted as a 3-tuple: (exit_code, output, errors)
     The other arguments are passed on to start_command().
 
+    A `limit` keyword stops reading the output after that many bytes,
+    kills the command and marks the output as truncated.
+
     """
+    limit = kwargs.pop('limit', None)
     process = start_command(cmd, *args, **kwargs)
-    (output, errors) = communicate(process)
+    if limit:
+        (output, errors, truncated) = communicate_limit(process, limit)
+    else:
+        (output, errors) = communicate(process)
+        truncated = False
     output = decode(output, encoding=encoding)
     errors = decode(errors, encoding=encoding)
+    if truncated:
+        output.truncated = True
     exit_code = process.returncode
     return (exit_code,
             output or UStr('', ENCODING),
@@ -410,3 +464,18 @@ relpath = wrap(mkpath, os.path.relpath, decorator=decode)
 stat = wrap(mkpath, os.stat)
 unlink = wrap(mkpath, os.unlink)
 walk = wrap(mkpath, os.walk)
+
+
+def stat_stamp(path):
+    """Return a stamp that changes when a file is written or replaced
+
+    None is returned for missing files.
+
+    """
+    if not path:
+        return None
+    try:
+        st = stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_ctime, st.st_size, st.st_ino)
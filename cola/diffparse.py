@@ -1,4 +1,5 @@
 from __future__ import division, absolute_import, unicode_literals
+import bisect
 import math
 import re
 from collections import defaultdict
@@ -7,19 +8,33 @@ from . import compat
 
 
 _HUNK_HEADER_RE = re.compile(r'^@@ -([0-9,]+) \+([0-9,]+) @@(.*)')
+_FILE_HEADER_RE = re.compile(r'diff --git a/.* b/.*')
+_ANY_HUNK_HEADER_RE = re.compile(r'(?:@@ -[0-9,]+ \+[0-9,]+ @@)|'
+                                 r'(?:@@@ (?:-[0-9,]+ ){2}\+[0-9,]+ @@@)')
 
 
 class _DiffHunk(object):
 
     def __init__(self, old_start, old_count, new_start, new_count, heading,
-                 first_line_idx, lines):
+                 first_line_idx, source, end_line_idx):
         self.old_start = old_start
         self.old_count = old_count
         self.new_start = new_start
         self.new_count = new_count
         self.heading = heading
         self.first_line_idx = first_line_idx
-        self.lines = lines
+        self.end_line_idx = end_line_idx
+        self._source = source
+        self._lines = None
+
+    @property
+    def lines(self):
+        """The non-empty lines of the hunk, including its header"""
+        lines = self._lines
+        if lines is None:
+            source = self._source[self.first_line_idx:self.end_line_idx]
+            lines = self._lines = [line + '\n' for line in source if line]
+        return lines
 
     @property
     def last_line_idx(self):
@@ -48,26 +63,6 @@ def _format_hunk_header(old_start, old_count, new_start, new_count,
                _format_range(new_start, new_count), heading))
 
 
-def _parse_diff(diff_text):
-    hunks = []
-    for line_idx, line in enumerate(diff_text.split('\n')):
-        match = _HUNK_HEADER_RE.match(line)
-        if match:
-            old_start, old_count = _parse_range_str(match.group(1))
-            new_start, new_count = _parse_range_str(match.group(2))
-            heading = match.group(3)
-            hunks.append(_DiffHunk(old_start, old_count,
-                                   new_start, new_count,
-                                   heading, line_idx, lines=[line + '\n']))
-        elif not hunks:
-            # first line of the diff is not a header line
-            errmsg = 'Malformed diff?: %s' % diff_text
-            raise AssertionError(errmsg)
-        elif line:
-            hunks[-1].lines.append(line + '\n')
-    return hunks
-
-
 def digits(number):
     """Return the number of digits needed to display a number"""
     if number >= 0:
@@ -125,6 +120,10 @@ class DiffLines(object):
                           self.ours.max_value, self.theirs.max_value))
 
     def parse(self, diff_text):
+        return self.parse_lines(diff_text.split('\n'))
+
+    def parse_lines(self, text_lines):
+        """Return the line numbers for a diff that has been split into lines"""
         lines = []
         INITIAL_STATE = 0
         DIFF_STATE = 1
@@ -137,7 +136,7 @@ class DiffLines(object):
         ours = self.ours.reset()
         theirs = self.theirs.reset()
 
-        for text in diff_text.split('\n'):
+        for text in text_lines:
             if text.startswith('@@ -'):
                 parts = text.split(' ', 4)
                 if parts[0] == '@@' and parts[3] == '@@':
@@ -238,6 +237,171 @@ class FormatDigits(object):
         return result
 
 
+class ParsedDiff(object):
+    """A diff that has been parsed once for display and for staging
+
+    The diff is split into lines, and every line is classified using the
+    same rules as the diff syntax highlighter.  The hunk table, the file
+    boundaries and the line numbers are computed in the same pass, so the
+    highlighter, the line number display and DiffParser can share them.
+
+    Parsing does not need Qt and can be done in a background thread.
+    `truncated` is True when the text is the start of a larger diff.
+
+    """
+
+    # Line kinds
+    TEXT = 0
+    HEADER = 1
+    DIFFSTAT = 2
+    HUNK = 3
+    CONTEXT = 4
+    ADDITION = 5
+    DELETION = 6
+
+    # Highlighter states
+    _INITIAL = -1
+    _DEFAULT = 0
+    _DIFFSTAT = 1
+    _FILE_HEADER = 2
+    _DIFF = 3
+    _SUBMODULE = 4
+
+    def __init__(self, text, is_commit=False):
+        self.text = text
+        self.is_commit = is_commit
+        self.truncated = getattr(text, 'truncated', False)
+        self.lines = lines = text.split('\n')
+        self.kinds = []
+        self.hunks = []
+        self.hunk_starts = []
+        self.file_starts = []
+        self._classify(lines)
+
+        numbers = DiffLines()
+        self.numbers = numbers.parse_lines(lines)
+        self.merge = numbers.merge
+        self.digits = numbers.digits()
+
+    def _classify(self, lines):
+        kinds = self.kinds
+        hunks = self.hunks
+        hunk_starts = self.hunk_starts
+        file_starts = self.file_starts
+        is_commit = self.is_commit
+        hunk = None
+        state = self._INITIAL
+
+        for idx, text in enumerate(lines):
+            if not text:
+                # Empty blocks are not highlighted and reset the state
+                kinds.append(self.TEXT)
+                state = self._INITIAL
+                continue
+
+            if state == self._INITIAL:
+                if text.startswith('Submodule '):
+                    state = self._SUBMODULE
+                elif text.startswith('diff --git '):
+                    state = self._DIFFSTAT
+                elif is_commit:
+                    state = self._DEFAULT
+                else:
+                    state = self._DIFFSTAT
+
+            first = text[0]
+            is_file = first == 'd' and _FILE_HEADER_RE.match(text)
+            is_hunk = first == '@' and _ANY_HUNK_HEADER_RE.match(text)
+
+            if is_file:
+                file_starts.append(idx)
+            if is_file or is_hunk:
+                if hunk is not None:
+                    hunk.end_line_idx = idx
+                    hunk = None
+                match = is_hunk and _HUNK_HEADER_RE.match(text)
+                if match:
+                    old_start, old_count = _parse_range_str(match.group(1))
+                    new_start, new_count = _parse_range_str(match.group(2))
+                    hunk = _DiffHunk(old_start, old_count,
+                                     new_start, new_count, match.group(3),
+                                     idx, lines, len(lines))
+                    hunks.append(hunk)
+                    hunk_starts.append(idx)
+
+            if state == self._DIFFSTAT:
+                if is_file:
+                    state = self._FILE_HEADER
+                    kind = self.HEADER
+                elif is_hunk:
+                    state = self._DIFF
+                    kind = self.HUNK
+                elif '|' in text:
+                    kind = self.DIFFSTAT
+                else:
+                    kind = self.HEADER
+            elif state == self._FILE_HEADER:
+                if is_hunk:
+                    state = self._DIFF
+                    kind = self.HUNK
+                else:
+                    kind = self.HEADER
+            elif state == self._DIFF:
+                if is_file:
+                    state = self._FILE_HEADER
+                    kind = self.HEADER
+                elif is_hunk:
+                    kind = self.HUNK
+                elif first == '-':
+                    kind = self.DELETION
+                elif first == '+':
+                    kind = self.ADDITION
+                else:
+                    kind = self.CONTEXT
+            else:
+                kind = self.TEXT
+            kinds.append(kind)
+
+    def hunk_index(self, line_idx):
+        """Return the index of the hunk that contains line_idx
+
+        Lines before the first hunk belong to the first hunk, and lines
+        after the last hunk belong to the last hunk.  Returns -1 when the
+        diff has no hunks.
+
+        """
+        if not self.hunks:
+            return -1
+        return max(0, bisect.bisect_right(self.hunk_starts, line_idx) - 1)
+
+    def hunk_at(self, line_idx):
+        """Return the hunk that contains line_idx, or None"""
+        idx = self.hunk_index(line_idx)
+        if idx < 0:
+            return None
+        return self.hunks[idx]
+
+    def chunk_end(self, start, size):
+        """Return where a chunk of about "size" lines from "start" ends
+
+        Chunks end at a hunk boundary when the hunk fits within the chunk,
+        so that whole hunks are displayed together.
+
+        """
+        end = start + size
+        count = len(self.lines)
+        if end >= count:
+            return count
+        idx = bisect.bisect_right(self.hunk_starts, end) - 1
+        if idx >= 0 and self.hunk_starts[idx] > start:
+            end = self.hunk_starts[idx]
+        return end
+
+    def file_index(self, line_idx):
+        """Return the index of the file that contains line_idx, or -1"""
+        return bisect.bisect_right(self.file_starts, line_idx) - 1
+
+
 class DiffParser(object):
     """Parse and rewrite diffs to produce edited patches
 
@@ -246,9 +410,17 @@ class DiffParser(object):
 
     """
 
-    def __init__(self, filename, diff_text):
+    def __init__(self, filename, diff_text, parsed_diff=None):
         self.filename = filename
-        self.hunks = _parse_diff(diff_text)
+        if parsed_diff is None:
+            parsed_diff = ParsedDiff(diff_text)
+        hunks = parsed_diff.hunks
+        if not hunks or hunks[0].first_line_idx != 0:
+            # first line of the diff is not a header line
+            errmsg = 'Malformed diff?: %s' % diff_text
+            raise AssertionError(errmsg)
+        self.diff = parsed_diff
+        self.hunks = hunks
 
     def generate_patch(self, first_line_idx, last_line_idx,
                        reverse=False):
@@ -263,10 +435,11 @@ class DiffParser(object):
                  '+++ b/%s\n' % self.filename]
 
         start_offset = 0
+        # skip hunks until we get to the one that contains the first
+        # selected line
+        start = self.diff.hunk_index(first_line_idx)
 
-        for hunk in self.hunks:
-            # skip hunks until we get to the one that contains the first
-            # selected line
+        for hunk in self.hunks[start:]:
             if hunk.last_line_idx < first_line_idx:
                 continue
             # once we have processed the hunk that contains the last selected
@@ -339,10 +512,8 @@ class DiffParser(object):
 
     def generate_hunk_patch(self, line_idx, reverse=False):
         """Return a patch containing the hunk for the specified line only"""
-        if not self.hunks:
+        hunk = self.diff.hunk_at(line_idx)
+        if hunk is None:
             return None
-        for hunk in self.hunks:
-            if line_idx <= hunk.last_line_idx:
-                break
         return self.generate_patch(hunk.first_line_idx, hunk.last_line_idx,
                                    reverse=reverse)
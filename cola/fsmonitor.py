@@ -1,17 +1,20 @@
 # Copyright (C) 2008-2017 David Aguilar
 # Copyright (C) 2015 Daniel Harding
-"""Provides a filesystem monitor for Linux (via inotify) and for Windows
-(via pywin32 and the ReadDirectoryChanges function)"""
+"""Provides a filesystem monitor for Linux (via inotify), for Windows
+(via pywin32 and the ReadDirectoryChanges function) and for any platform
+where git's "core.fsmonitor" hook is configured"""
 from __future__ import division, absolute_import, unicode_literals
 
+import collections
 import errno
+import functools
 import os
 import os.path
 import select
-from threading import Lock
+import time
+from threading import Event, Lock
 
 from . import utils
-from . import version
 from .decorators import memoize
 
 AVAILABLE = None
@@ -38,23 +41,30 @@ from qtpy import QtCore
 from qtpy.QtCore import Signal
 
 from . import core
+from . import fsmonitorhook
 from . import gitcfg
-from . import gitcmds
+from . import gitignore
 from .compat import bchr
 from .git import git
+from .git import GIT_COLA_TRACE
 from .i18n import N_
 from .interaction import Interaction
+from .models import main
+from .models import tracked
 
 
 class _Monitor(QtCore.QObject):
 
     files_changed = Signal()
+    paths_changed = Signal(object)
     config_changed = Signal()
 
     def __init__(self, thread_class):
         QtCore.QObject.__init__(self)
         self._thread_class = thread_class
         self._thread = None
+        # Worktree-relative directories that are open in the file browser
+        self.open_dirs = frozenset()
 
     def start(self):
         if self._thread_class is not None:
@@ -73,18 +83,184 @@ class _Monitor(QtCore.QObject):
         if self._thread is not None:
             self._thread.refresh()
 
+    def notification_history(self):
+        """Return (events, window, latency, cost) for recent notifications
+
+        The window is the quiet period that was waited for, the latency is
+        the time from the first event to the notification and the cost is
+        the expected refresh time, all in milliseconds.
+
+        """
+        if self._thread is None:
+            return []
+        return list(self._thread.coalescer.history)
+
+    def set_open_dirs(self, paths):
+        """Prefer watching the directories that are open in the browser"""
+        paths = frozenset(paths)
+        if paths != self.open_dirs:
+            self.open_dirs = paths
+            self.refresh()
+
+
+def _depth_key(path):
+    return (path.count('/'), path)
+
+
+def _choose_watches(dirs, hot, budget):
+    """Split dirs into the ones to watch and the ones to scan
+
+    The directories in "hot" are watched first, in order, and the
+    remaining budget goes to the shallowest directories.  A budget of
+    None watches everything.
+
+    """
+    if budget is None or len(dirs) <= budget:
+        return (set(dirs), set())
+    watched = set()
+    if budget > 0:
+        for path in hot:
+            if path in dirs:
+                watched.add(path)
+                if len(watched) >= budget:
+                    break
+    if len(watched) < budget:
+        for path in sorted(dirs.difference(watched), key=_depth_key):
+            watched.add(path)
+            if len(watched) >= budget:
+                break
+    return (watched, dirs.difference(watched))
+
+
+class _StatIndex(object):
+    """Cached stat() results for the paths that are scanned for changes
+
+    A directory's stamp changes when entries are added, removed or renamed
+    and a file's stamp changes when it is written, so scanning the
+    unwatched directories and their tracked files finds what inotify
+    would have reported, only later.
+
+    """
+
+    def __init__(self):
+        self._stamps = {}
+
+    def __len__(self):
+        return len(self._stamps)
+
+    def set_paths(self, paths):
+        """Scan paths from now on, keeping the stamps of known paths"""
+        old = self._stamps
+        stamps = {}
+        for path in paths:
+            try:
+                stamps[path] = old[path]
+            except KeyError:
+                stamps[path] = core.stat_stamp(path)
+        self._stamps = stamps
+
+    def scan(self):
+        """Return the paths whose stamps changed since the last scan"""
+        stamps = self._stamps
+        changed = []
+        for path, stamp in list(stamps.items()):
+            new_stamp = core.stat_stamp(path)
+            if new_stamp != stamp:
+                stamps[path] = new_stamp
+                changed.append(path)
+        return changed
+
+
+class _Coalescer(object):
+    """Choose how long to wait for more events before notifying
+
+    Each event restarts a quiet window.  Isolated edits get a short window
+    that grows with the cost of the refresh that will follow.  Bursts,
+    e.g. a checkout that writes thousands of files, wait at least
+    burst_delay, but no batch waits longer than max_latency after its
+    first event.  All times are in milliseconds.
+
+    """
+
+    def __init__(self, min_delay=150, burst_delay=888, max_latency=4000,
+                 burst_events=32, burst_rate=100):
+        self.min_delay = min_delay
+        self.burst_delay = burst_delay
+        self.max_latency = max_latency
+        self.burst_events = burst_events
+        # Events per second
+        self.burst_rate = burst_rate
+        self.first = None
+        self.last = None
+        self.events = 0
+        self.window = min_delay
+        self.cost = 0
+        self.history = collections.deque(maxlen=32)
+
+    def add_events(self, now, count=1):
+        """Record events that arrived at time "now" (in seconds)"""
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.events += count
+
+    def is_burst(self):
+        if self.events < self.burst_events:
+            return False
+        elapsed = (self.last - self.first) * 1000
+        return self.events * 1000 >= self.burst_rate * elapsed
+
+    def delay(self, now, cost):
+        """Return how long to wait before notifying, given the refresh cost
+
+        "now" and "cost" are in seconds.
+
+        """
+        if self.first is None:
+            self.add_events(now, 0)
+        self.cost = int(round(cost * 1000))
+        window = self.min_delay + 2 * self.cost
+        if self.is_burst():
+            window = max(window, self.burst_delay)
+        self.window = window = min(window, self.max_latency)
+        deadline = min(self.last * 1000 + window,
+                       self.first * 1000 + self.max_latency)
+        return max(0, int(round(deadline - now * 1000)))
+
+    def clear(self):
+        """Forget the events of the current batch"""
+        self.first = None
+        self.last = None
+        self.events = 0
+
+    def notified(self, now):
+        """Record a notification and start a new batch"""
+        if self.first is None:
+            latency = 0
+        else:
+            latency = int(round((now - self.first) * 1000))
+        entry = (self.events, self.window, latency, self.cost)
+        self.history.append(entry)
+        self.clear()
+        return entry
+
 
 class _BaseThread(QtCore.QThread):
-    #: The delay, in milliseconds, between detecting file system modification
-    #: and triggering the 'files_changed' signal, to coalesce multiple
-    #: modifications into a single signal.
+    #: The quiet period, in milliseconds, that bursts of file system
+    #: modifications wait for before triggering the 'files_changed' signal,
+    #: to coalesce multiple modifications into a single signal.
     _NOTIFICATION_DELAY = 888
 
+    #: Whether the paths in _file_paths are spelled exactly as git spells
+    #: them, so that only those paths need to be refreshed.
+    _EXACT_PATHS = True
+
     def __init__(self, monitor):
         QtCore.QThread.__init__(self)
         self._monitor = monitor
         self._running = True
-        self._use_check_ignore = version.check_git('check-ignore')
+        self._ignore_matcher = None
+        self.coalescer = _Coalescer(burst_delay=self._NOTIFICATION_DELAY)
         self._force_notify = False
         self._force_config = False
         self._file_paths = set()
@@ -97,44 +273,87 @@ class _BaseThread(QtCore.QThread):
         """Do any housekeeping necessary in response to repository changes."""
         pass
 
+    def _add_events(self, count=1):
+        self.coalescer.add_events(time.time(), count)
+
+    def _notify_delay(self):
+        """Return the milliseconds to wait before notifying"""
+        refresher = main.model().refresher
+        if self._force_notify:
+            cost = refresher.full_seconds
+        else:
+            cost = refresher.paths_seconds
+        return self.coalescer.delay(time.time(), cost)
+
+    def _maybe_notify(self):
+        """Notify once the quiet window has passed"""
+        if not self._pending:
+            # The events did not change anything that is reported
+            self.coalescer.clear()
+        elif self._notify_delay() == 0:
+            self.notify()
+
     def notify(self):
         """Notifies all observers"""
         do_notify = False
         do_config = False
+        paths = set()
         if self._force_config:
             do_config = True
         if self._force_notify:
             do_notify = True
         elif self._file_paths:
-            proc = core.start_command(['git', 'check-ignore', '--verbose',
-                                       '--non-matching', '-z', '--stdin'])
-            path_list = bchr(0).join(core.encode(path)
-                                     for path in self._file_paths)
-            out, err = proc.communicate(path_list)
-            if proc.returncode:
+            matcher = self._matcher()
+            if matcher is None or matcher.refresh():
+                # Changed ignore rules can affect any untracked file
                 do_notify = True
             else:
-                # Each output record is four fields separated by NULL
-                # characters (records are also separated by NULL characters):
-                # <source> <NULL> <linenum> <NULL> <pattern> <NULL> <pathname>
-                # For paths which are not ignored, all fields will be empty
-                # except for <pathname>.  So to see if we have any non-ignored
-                # files, we simply check every fourth field to see if any of
-                # them are empty.
-                source_fields = out.split(bchr(0))[0:-1:4]
-                do_notify = not all(source_fields)
+                # Like "git check-ignore", tracked files are never ignored.
+                # Directories, e.g. from scans, can contain tracked files.
+                tracked_files = tracked.current()
+                tracked_dirs = tracked_files.directories()
+                for path in self._file_paths:
+                    path = self._relative_path(path)
+                    if (tracked_files.contains(path) or path in tracked_dirs
+                            or not matcher.is_ignored(path)):
+                        paths.add(path)
+                if paths and not self._EXACT_PATHS:
+                    do_notify = True
         self._force_notify = False
         self._force_config = False
         self._file_paths = set()
 
-        # "files changed" is a bigger hammer than "config changed".
-        # and is a superset relative to what is done in response to the
-        # signal.  Thus, the "elif" below avoids repeated work that
-        # would be done if it were a simple "if" check instead.
+        events, window, latency, cost = self.coalescer.notified(time.time())
+        if GIT_COLA_TRACE:
+            core.stderr('fsmonitor: %d events, waited %dms for a %dms quiet'
+                        ' window, refresh cost %dms'
+                        % (events, latency, window, cost))
+
+        # "files changed" is a bigger hammer than "paths changed" and
+        # "config changed", and is a superset relative to what is done in
+        # response to those signals.  Thus, the "else" below avoids
+        # repeated work that would be done if they were all emitted.
         if do_notify:
             self._monitor.files_changed.emit()
-        elif do_config:
-            self._monitor.config_changed.emit()
+        else:
+            if paths:
+                self._monitor.paths_changed.emit(paths)
+            if do_config:
+                self._monitor.config_changed.emit()
+
+    def _matcher(self):
+        """Return the IgnoreMatcher for the worktree, if there is one"""
+        if self._ignore_matcher is None and self._worktree is not None:
+            self._ignore_matcher = gitignore.IgnoreMatcher(
+                self._worktree, self._git_dir, gitcfg.current())
+        return self._ignore_matcher
+
+    def _relative_path(self, path):
+        """Return a worktree-relative path for an absolute path"""
+        worktree = self._worktree
+        if worktree and path.startswith(worktree + '/'):
+            path = path[len(worktree) + 1:]
+        return path
 
     @staticmethod
     def _log_enabled_message():
@@ -145,6 +364,14 @@ class _BaseThread(QtCore.QThread):
 if AVAILABLE == 'inotify':
 
     class _InotifyThread(_BaseThread):
+        #: The delay, in milliseconds, between scans of the directories
+        #: that are not watched because of the watch budget
+        _SCAN_INTERVAL = 5000
+
+        #: The number of recently changed directories that are preferred
+        #: when choosing which directories to watch
+        _RECENT_DIRS = 128
+
         _TRIGGER_MASK = (
                 inotify.IN_ATTRIB |
                 inotify.IN_CLOSE_WRITE |
@@ -176,6 +403,19 @@ if AVAILABLE == 'inotify':
             self._git_dir_wd_to_path_map = {}
             self._git_dir_path_to_wd_map = {}
             self._git_dir_wd = None
+            budget = gitcfg.current().get('cola.inotifymaxwatches', 0)
+            if isinstance(budget, int) and budget > 0:
+                self._budget = budget
+            else:
+                self._budget = None
+            self._budget_logged = False
+            self._refresh_requested = False
+            self._rebalance = False
+            self._recent_dirs = collections.OrderedDict()
+            self._scanned_dirs = set()
+            self._stat_index = _StatIndex()
+            self._next_scan = None
+            self._tracked = (None, set())
 
         @staticmethod
         def _log_out_of_wds_message():
@@ -189,6 +429,23 @@ if AVAILABLE == 'inotify':
                      ' sudo sysctl -p\n')
             Interaction.log(msg)
 
+        def _log_budget_message(self, watched, scanned):
+            if self._budget_logged:
+                return
+            self._budget_logged = True
+            msg = N_('File system change monitoring: watching %(watched)d'
+                     ' directories, the %(scanned)d others are checked every'
+                     ' %(seconds)d seconds.  The limit on inotify watches can'
+                     ' be raised with "cola.inotifymaxwatches" or by'
+                     ' running:\n'
+                     '\n'
+                     '    echo fs.inotify.max_user_watches=100000 |'
+                     ' sudo tee -a /etc/sysctl.conf &&'
+                     ' sudo sysctl -p\n') % dict(
+                         watched=watched, scanned=scanned,
+                         seconds=self._SCAN_INTERVAL // 1000)
+            Interaction.log(msg)
+
         def run(self):
             try:
                 with self._lock:
@@ -199,13 +456,16 @@ if AVAILABLE == 'inotify':
                 poll_obj.register(self._inotify_fd, select.POLLIN)
                 poll_obj.register(self._pipe_r, select.POLLIN)
 
-                self.refresh()
+                self._refresh()
 
                 self._log_enabled_message()
 
                 while self._running:
                     if self._pending:
-                        timeout = self._NOTIFICATION_DELAY
+                        timeout = self._notify_delay()
+                    elif self._scanned_dirs:
+                        timeout = max(0, int(
+                            (self._next_scan - time.time()) * 1000))
                     else:
                         timeout = None
                     try:
@@ -220,12 +480,17 @@ if AVAILABLE == 'inotify':
                     else:
                         if not self._running:
                             break
-                        elif not events:
-                            self.notify()
-                        else:
-                            for fd, event in events:
-                                if fd == self._inotify_fd:
-                                    self._handle_events()
+                        for fd, event in events:
+                            if fd == self._inotify_fd:
+                                self._handle_events()
+                            elif fd == self._pipe_r:
+                                os.read(self._pipe_r, 4096)
+                        if self._refresh_requested:
+                            self._refresh()
+                        if (self._scanned_dirs
+                                and time.time() >= self._next_scan):
+                            self._scan()
+                        self._maybe_notify()
             finally:
                 with self._lock:
                     if self._inotify_fd is not None:
@@ -238,34 +503,127 @@ if AVAILABLE == 'inotify':
                         self._pipe_w = None
 
         def refresh(self):
+            """Update the watches from the monitor's thread"""
+            self._refresh_requested = True
             with self._lock:
-                if self._inotify_fd is None:
-                    return
+                if self._pipe_w is not None:
+                    os.write(self._pipe_w, bchr(0))
+
+        def _tracked_dirs(self):
+            """Return the absolute directories that contain tracked files"""
+            paths = tracked.current().paths()
+            if paths is not self._tracked[0]:
+                worktree = self._worktree
+                dirs = set(os.path.dirname(os.path.join(worktree, path))
+                           for path in paths)
+                self._tracked = (paths, dirs)
+            return self._tracked[1]
+
+        def _hot_dirs(self):
+            """Return the directories to watch first, in order"""
+            worktree = self._worktree
+            hot = list(reversed(self._recent_dirs))
+            model = main.model()
+            for paths in (model.unmerged, model.modified, model.staged,
+                          model.untracked):
+                hot.extend(os.path.dirname(os.path.join(worktree, path))
+                           for path in paths)
+            hot.extend(os.path.join(worktree, path).rstrip('/')
+                       for path in self._monitor.open_dirs)
+            return hot
+
+        def _refresh(self):
+            self._refresh_requested = False
+            self._rebalance = False
+            while self._running:
                 try:
-                    if self._worktree is not None:
-                        tracked_dirs = set(
-                                os.path.dirname(os.path.join(self._worktree,
-                                                             path))
-                                for path in gitcmds.tracked_files())
-                        self._refresh_watches(tracked_dirs,
-                                              self._worktree_wd_to_path_map,
-                                              self._worktree_path_to_wd_map)
-                    git_dirs = set()
-                    git_dirs.add(self._git_dir)
-                    for dirpath, dirnames, filenames in core.walk(
-                            os.path.join(self._git_dir, 'refs')):
-                        git_dirs.add(dirpath)
-                    self._refresh_watches(git_dirs,
-                                          self._git_dir_wd_to_path_map,
-                                          self._git_dir_path_to_wd_map)
-                    self._git_dir_wd = \
-                            self._git_dir_path_to_wd_map.get(self._git_dir)
+                    self._refresh_all()
+                    return
                 except OSError as e:
-                    if e.errno == errno.ENOSPC:
-                        self._log_out_of_wds_message()
-                        self._running = False
-                    else:
+                    if e.errno != errno.ENOSPC:
                         raise
+                # Keep the watches that fit and scan the other directories
+                count = (len(self._git_dir_wd_to_path_map) +
+                         len(self._worktree_wd_to_path_map))
+                if self._budget is not None and count >= self._budget:
+                    count = self._budget - 1
+                if count <= len(self._git_dir_wd_to_path_map):
+                    self._log_out_of_wds_message()
+                    self._running = False
+                else:
+                    self._budget = count
+
+        def _refresh_all(self):
+            if self._inotify_fd is None:
+                return
+            git_dirs = set()
+            git_dirs.add(self._git_dir)
+            for dirpath, dirnames, filenames in core.walk(
+                    os.path.join(self._git_dir, 'refs')):
+                git_dirs.add(dirpath)
+            # $GIT_DIR is watched first so that the budget never skips it
+            self._refresh_watches(git_dirs,
+                                  self._git_dir_wd_to_path_map,
+                                  self._git_dir_path_to_wd_map)
+            self._git_dir_wd = \
+                    self._git_dir_path_to_wd_map.get(self._git_dir)
+            if self._worktree is None:
+                return
+
+            tracked_dirs = self._tracked_dirs()
+            budget = self._budget
+            if budget is not None:
+                budget = max(0, budget - len(git_dirs))
+                watched, scanned = _choose_watches(
+                        tracked_dirs, self._hot_dirs(), budget)
+            else:
+                watched, scanned = tracked_dirs, set()
+            self._refresh_watches(watched,
+                                  self._worktree_wd_to_path_map,
+                                  self._worktree_path_to_wd_map)
+            self._set_scanned_dirs(scanned)
+            if scanned:
+                self._log_budget_message(len(watched), len(scanned))
+
+        def _set_scanned_dirs(self, scanned):
+            """Scan the unwatched directories and their tracked files"""
+            self._scanned_dirs = scanned
+            paths = set(scanned)
+            if scanned:
+                worktree = self._worktree
+                for path in tracked.current().paths():
+                    path = os.path.join(worktree, path)
+                    if os.path.dirname(path) in scanned:
+                        paths.add(path)
+                if self._next_scan is None:
+                    self._next_scan = time.time() + self._SCAN_INTERVAL / 1000.0
+            else:
+                self._next_scan = None
+            self._stat_index.set_paths(paths)
+
+        def _scan(self):
+            changed = self._stat_index.scan()
+            if changed:
+                self._add_events(len(changed))
+            for path in changed:
+                if path in self._scanned_dirs:
+                    self._add_recent_dir(path)
+                else:
+                    self._add_recent_dir(os.path.dirname(path))
+                self._file_paths.add(path)
+            self._next_scan = time.time() + self._SCAN_INTERVAL / 1000.0
+            if self._rebalance:
+                # Start watching the directories that changed recently
+                self._refresh()
+
+        def _add_recent_dir(self, path):
+            recent = self._recent_dirs
+            recent.pop(path, None)
+            recent[path] = True
+            if len(recent) > self._RECENT_DIRS:
+                recent.popitem(last=False)
+            if path in self._scanned_dirs:
+                self._rebalance = True
 
         def _refresh_watches(self, paths_to_watch, wd_to_path_map,
                              path_to_wd_map):
@@ -311,9 +669,11 @@ if AVAILABLE == 'inotify':
             elif mask & inotify.IN_ISDIR:
                 pass
             elif wd in self._worktree_wd_to_path_map:
-                if self._use_check_ignore and name:
-                    path = os.path.join(self._worktree_wd_to_path_map[wd],
-                                        core.decode(name))
+                dirname = self._worktree_wd_to_path_map[wd]
+                if self._budget is not None:
+                    self._add_recent_dir(dirname)
+                if name:
+                    path = os.path.join(dirname, core.decode(name))
                     self._file_paths.add(path)
                 else:
                     self._force_notify = True
@@ -328,10 +688,13 @@ if AVAILABLE == 'inotify':
                 self._force_notify = True
 
         def _handle_events(self):
+            count = 0
             for wd, mask, cookie, name in \
                     inotify.read_events(self._inotify_fd):
+                count += 1
                 if not self._force_notify:
                     self._check_event(wd, mask, name)
+            self._add_events(count)
 
         def stop(self):
             self._running = False
@@ -394,6 +757,8 @@ if AVAILABLE == 'pywin32':
                 win32file.CloseHandle(self.event)
 
     class _Win32Thread(_BaseThread):
+        # Paths are lowercased, so they cannot be used as pathspecs
+        _EXACT_PATHS = False
         _FLAGS = (win32con.FILE_NOTIFY_CHANGE_FILE_NAME |
                   win32con.FILE_NOTIFY_CHANGE_DIR_NAME |
                   win32con.FILE_NOTIFY_CHANGE_ATTRIBUTES |
@@ -446,17 +811,16 @@ if AVAILABLE == 'pywin32':
 
                 while self._running:
                     if self._pending:
-                        timeout = self._NOTIFICATION_DELAY
+                        timeout = self._notify_delay()
                     else:
                         timeout = win32event.INFINITE
                     rc = win32event.WaitForMultipleObjects(events, False,
                                                            timeout)
                     if not self._running:
                         break
-                    elif rc == win32event.WAIT_TIMEOUT:
-                        self.notify()
-                    else:
+                    elif rc != win32event.WAIT_TIMEOUT:
                         self._handle_results()
+                    self._maybe_notify()
             finally:
                 with self._stop_event_lock:
                     if self._stop_event is not None:
@@ -468,8 +832,10 @@ if AVAILABLE == 'pywin32':
                     self._git_dir_watch.close()
 
         def _handle_results(self):
+            count = 0
             if self._worktree_watch is not None:
                 for action, path in self._worktree_watch.read():
+                    count += 1
                     if not self._running:
                         break
                     if self._force_notify:
@@ -479,11 +845,9 @@ if AVAILABLE == 'pywin32':
                         and not path.startswith(self._git_dir + '/')
                         and not os.path.isdir(path)
                        ):
-                        if self._use_check_ignore:
-                            self._file_paths.add(path)
-                        else:
-                            self._force_notify = True
+                        self._file_paths.add(path)
             for action, path in self._git_dir_watch.read():
+                count += 1
                 if not self._running:
                     break
                 if self._force_notify:
@@ -499,6 +863,7 @@ if AVAILABLE == 'pywin32':
                     or path.startswith('refs/')
                    ):
                     self._force_notify = True
+            self._add_events(count)
 
         def stop(self):
             self._running = False
@@ -508,6 +873,97 @@ if AVAILABLE == 'pywin32':
             self.wait()
 
 
+class _HookThread(_BaseThread):
+    """Polls git's "core.fsmonitor" hook instead of watching directories
+
+    The hook's daemon already watches the worktree, so no watch is added
+    per directory.  HEAD, the index and the refs are checked by stat()ing
+    a few files in $GIT_DIR on every poll.
+
+    """
+
+    #: The delay, in milliseconds, between queries to the hook
+    _POLL_INTERVAL = _BaseThread._NOTIFICATION_DELAY
+
+    def __init__(self, monitor, hook, version):
+        _BaseThread.__init__(self, monitor)
+        worktree = git.worktree()
+        if worktree is not None:
+            worktree = core.abspath(worktree)
+        self._worktree = worktree
+        self._git_dir = core.abspath(git.git_path())
+        self._hook = fsmonitorhook.FsmonitorHook(hook, version, cwd=worktree)
+        self._stop_event = Event()
+        self._git_stamps = None
+        self._config_stamp = None
+
+    @staticmethod
+    def _log_hook_message(hook):
+        msg = N_('File system change monitoring: enabled using the'
+                 ' "core.fsmonitor" hook "%s".\n') % hook
+        Interaction.log(msg)
+
+    def _stamps(self):
+        """Return the stamps of the files in $GIT_DIR that affect status"""
+        git_dir = self._git_dir
+        head = os.path.join(git_dir, 'HEAD')
+        try:
+            ref = core.read(head).strip()
+        except (OSError, IOError):
+            ref = ''
+        paths = [head, os.path.join(git_dir, 'index'),
+                 os.path.join(git_dir, 'packed-refs'),
+                 os.path.join(git_dir, 'FETCH_HEAD')]
+        if ref.startswith('ref: '):
+            paths.append(os.path.join(git_dir, ref[5:]))
+        return (ref, [core.stat_stamp(path) for path in paths])
+
+    def run(self):
+        self._log_hook_message(self._hook.hook)
+        # The first query only establishes the token
+        self._hook.query()
+        self._git_stamps = self._stamps()
+        self._config_stamp = core.stat_stamp(
+            os.path.join(self._git_dir, 'config'))
+        while self._running:
+            timeout = self._POLL_INTERVAL
+            if self._pending:
+                timeout = min(timeout, self._notify_delay())
+            self._stop_event.wait(timeout / 1000.0)
+            if not self._running:
+                break
+            self._poll()
+            self._maybe_notify()
+
+    def _poll(self):
+        paths, everything = self._hook.query()
+        if everything or paths:
+            self._add_events(len(paths) or 1)
+        if everything:
+            self._force_notify = True
+        elif paths and self._worktree is not None:
+            git_dir = self._git_dir
+            for path in paths:
+                path = os.path.join(self._worktree, path.rstrip('/'))
+                if path != git_dir and not path.startswith(git_dir + '/'):
+                    self._file_paths.add(path)
+
+        stamps = self._stamps()
+        if stamps != self._git_stamps:
+            self._git_stamps = stamps
+            self._force_notify = True
+        config_stamp = core.stat_stamp(
+            os.path.join(self._git_dir, 'config'))
+        if config_stamp != self._config_stamp:
+            self._config_stamp = config_stamp
+            self._force_config = True
+
+    def stop(self):
+        self._running = False
+        self._stop_event.set()
+        self.wait()
+
+
 @memoize
 def current():
     return _create_instance()
@@ -516,10 +972,14 @@ def current():
 def _create_instance():
     thread_class = None
     cfg = gitcfg.current()
+    hook_config = fsmonitorhook.hook_config(cfg)
     if not cfg.get('cola.inotify', default=True):
         msg = N_('File system change monitoring: disabled because'
                  ' "cola.inotify" is false.\n')
         Interaction.log(msg)
+    elif hook_config:
+        thread_class = functools.partial(_HookThread, hook=hook_config[0],
+                                         version=hook_config[1])
     elif AVAILABLE == 'inotify':
         thread_class = _InotifyThread
     elif AVAILABLE == 'pywin32':
@@ -0,0 +1,93 @@
+"""Queries git's "core.fsmonitor" hook for the paths that changed
+
+The hook speaks the protocol that "git status" uses to ask a file system
+monitor such as Watchman which paths changed since a token, so git-cola
+can share the same monitor instead of watching every directory itself.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+import time
+
+from . import core
+from . import utils
+from .compat import ustr
+
+#: The protocol versions understood by query()
+VERSIONS = (1, 2)
+
+# The characters that make git run the hook through the shell
+_SHELL_CHARS = set('|&;<>()$`\\"\' \t\n*?[#~=%')
+
+
+def hook_config(cfg):
+    """Return the (hook, version) configured in "core.fsmonitor", or None
+
+    A boolean "core.fsmonitor" selects git's builtin daemon, which is not
+    a hook and cannot be queried this way.
+
+    """
+    hook = cfg.get('core.fsmonitor')
+    if not hook or not isinstance(hook, (str, ustr)):
+        return None
+    version = cfg.get('core.fsmonitorhookversion', 2)
+    if version not in VERSIONS:
+        version = 2
+    return (hook, version)
+
+
+def _nanoseconds():
+    return '%d' % int(time.time() * 1000000000)
+
+
+class FsmonitorHook(object):
+    """Remembers the last token and asks the hook what changed since then"""
+
+    def __init__(self, hook, version=2, cwd=None):
+        self.hook = hook
+        self.version = version
+        self.cwd = cwd
+        self.token = None
+
+    def command(self, token):
+        """Return the command that asks the hook for changes since token"""
+        args = ['%d' % self.version, token]
+        if utils.is_win32() or not _SHELL_CHARS.intersection(self.hook):
+            return [self.hook] + args
+        # Like git, run hooks with arguments or quoting through the shell
+        return ['sh', '-c', self.hook + ' "$@"', self.hook] + args
+
+    def query(self):
+        """Return (paths, everything) for the changes since the last query
+
+        "paths" are worktree-relative and directories end with "/".
+        "everything" is true when the hook cannot say what changed,
+        e.g. on the first query, after the hook fails or when it restarted.
+
+        """
+        token = self.token
+        if self.version == 1:
+            new_token = _nanoseconds()
+            if token is None:
+                token = new_token
+        elif token is None:
+            # Tokens are opaque, so this asks for a fresh one
+            token = 'builtin:fake'
+        status, out, err = core.run_command(
+            self.command(token), cwd=self.cwd, stdin=None)
+        if status != 0:
+            self.token = None
+            return ([], True)
+
+        fields = out.split('\0')
+        if fields and not fields[-1]:
+            fields.pop()
+        if self.version == 2:
+            if not fields:
+                self.token = None
+                return ([], True)
+            new_token = fields.pop(0)
+        everything = self.token is None or '/' in fields
+        self.token = new_token
+        if everything:
+            return ([], True)
+        return (fields, False)
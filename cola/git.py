@@ -1,22 +1,25 @@
 from __future__ import division, absolute_import, unicode_literals
 
+import collections
+import contextlib
 import functools
 import errno
 import os
 import sys
 import subprocess
 import threading
+import time
 from os.path import join
 
 from . import core
 from .compat import int_types
 from .compat import ustr
 from .compat import WIN32
+from .decorators import interruptable
 from .decorators import memoize
 from .interaction import Interaction
 
 
-INDEX_LOCK = threading.Lock()
 GIT_COLA_TRACE = core.getenv('GIT_COLA_TRACE', '')
 STATUS = 0
 STDOUT = 1
@@ -27,6 +30,219 @@ def dashify(s):
     return s.replace('_', '-')
 
 
+class IndexLock(object):
+    """Serialize the git commands that modify the repository
+
+    Commands that only read the repository run concurrently.  Commands that
+    can take .git/index.lock, or otherwise modify the repository, run
+    exclusively.  Waiting writers block new readers so that a busy stream
+    of background readers cannot starve them.
+
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._condition:
+            self.reads = 0
+            self.writes = 0
+            self.contended = 0
+            """Number of acquisitions that had to wait"""
+            self.wait_time = 0.0
+            """Seconds spent waiting for the lock"""
+            self.max_readers = 0
+            """Largest number of concurrent readers"""
+
+    def stats(self):
+        """Return a snapshot of the concurrency metrics"""
+        with self._condition:
+            return {
+                'reads': self.reads,
+                'writes': self.writes,
+                'contended': self.contended,
+                'wait_time': self.wait_time,
+                'max_readers': self.max_readers,
+                'readers': self._readers,
+                'writing': self._writing,
+            }
+
+    def acquire_read(self):
+        with self._condition:
+            if self._writing or self._waiting_writers:
+                start = time.time()
+                while self._writing or self._waiting_writers:
+                    self._condition.wait()
+                self.contended += 1
+                self.wait_time += time.time() - start
+            self._readers += 1
+            self.reads += 1
+            if self._readers > self.max_readers:
+                self.max_readers = self._readers
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            if self._writing or self._readers:
+                start = time.time()
+                self._waiting_writers += 1
+                while self._writing or self._readers:
+                    self._condition.wait()
+                self._waiting_writers -= 1
+                self.contended += 1
+                self.wait_time += time.time() - start
+            self._writing = True
+            self.writes += 1
+
+    def release_write(self):
+        with self._condition:
+            self._writing = False
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def held(self, readonly):
+        """Hold the lock while running a command
+
+        Commands that are started directly, e.g. to stream their input or
+        output, hold the lock until they have finished.
+
+        """
+        if readonly:
+            self.acquire_read()
+        else:
+            self.acquire_write()
+        try:
+            yield
+        finally:
+            # Let the next thread in
+            if readonly:
+                self.release_read()
+            else:
+                self.release_write()
+
+
+INDEX_LOCK = IndexLock()
+
+# Commands that never modify the repository
+_READONLY_COMMANDS = frozenset((
+    'archive',
+    'blame',
+    'cat-file',
+    'check-attr',
+    'check-ignore',
+    'check-ref-format',
+    'cherry',
+    'count-objects',
+    'diff-files',
+    'diff-index',
+    'diff-tree',
+    'for-each-ref',
+    'format-patch',
+    'grep',
+    'help',
+    'log',
+    'ls-files',
+    'ls-remote',
+    'ls-tree',
+    'merge-base',
+    'name-rev',
+    'rev-list',
+    'rev-parse',
+    'shortlog',
+    'show',
+    'show-branch',
+    'show-ref',
+    'var',
+    'version',
+    'whatchanged',
+))
+
+# Options that make "git branch" and "git tag" list refs
+_LIST_OPTIONS = frozenset((
+    '-l', '--list', '--contains', '--no-contains', '--merged',
+    '--no-merged', '--points-at',
+))
+
+# Options that make "git branch" and "git tag" modify refs
+_REF_OPTIONS = frozenset((
+    '-d', '-D', '-m', '-M', '-c', '-C', '-u', '--delete', '--move', '--copy',
+    '--set-upstream-to', '--unset-upstream', '--edit-description',
+))
+
+# Options that make "git config" read the configuration
+_CONFIG_READ_OPTIONS = frozenset((
+    '-l', '--list', '--get', '--get-all', '--get-regexp', '--get-urlmatch',
+    '--get-color', '--get-colorbool',
+))
+
+
+def split_command(command):
+    """Return the (subcommand, arguments) of a git command line
+
+    The subcommand is None when the command does not run git.
+
+    """
+    if not command or os.path.basename(command[0]) not in ('git', 'git.exe'):
+        return (None, [])
+    idx = 1
+    count = len(command)
+    # Skip options that come before the subcommand
+    while idx < count and command[idx].startswith('-'):
+        if command[idx] in ('-c', '-C'):
+            idx += 1
+        idx += 1
+    if idx >= count:
+        return (None, [])
+    return (command[idx], command[idx+1:])
+
+
+def is_readonly(command):
+    """Return True when a git command line cannot modify the repository
+
+    Unknown commands are assumed to modify the repository.
+
+    """
+    cmd, args = split_command(command)
+    if cmd is None:
+        return False
+    if cmd in _READONLY_COMMANDS:
+        return True
+    if '--' in args:
+        args = args[:args.index('--')]
+    options = set([arg.split('=', 1)[0] for arg in args
+                   if arg.startswith('-')])
+    positional = [arg for arg in args if not arg.startswith('-')]
+
+    if cmd == 'diff':
+        # "git diff" refreshes the index when comparing the worktree
+        return bool(options.intersection(('--cached', '--staged',
+                                          '--no-index')))
+    if cmd == 'describe':
+        return not options.intersection(('--dirty', '--broken'))
+    if cmd == 'config':
+        return bool(options.intersection(_CONFIG_READ_OPTIONS))
+    if cmd in ('branch', 'tag'):
+        if options.intersection(_LIST_OPTIONS):
+            return True
+        return not positional and not options.intersection(_REF_OPTIONS)
+    if cmd == 'remote':
+        return not positional or positional[0] in ('show', 'get-url')
+    if cmd == 'stash':
+        return bool(positional) and positional[0] in ('list', 'show')
+    if cmd == 'symbolic-ref':
+        return len(positional) == 1 and '--delete' not in options
+    return False
+
+
 def is_git_dir(git_dir):
     """From git's setup.c:is_git_directory()."""
     result = False
@@ -140,6 +356,278 @@ def find_git_directory(curpath):
     return paths
 
 
+CatFileObject = collections.namedtuple('CatFileObject', 'oid objtype size data')
+
+
+@interruptable
+def _read_exactly(fh, size):
+    """Read `size` bytes from a filehandle and retry when interrupted"""
+    data = fh.read(size)
+    if len(data) != size:
+        raise IOError(errno.EPIPE, 'short read from git cat-file')
+    return data
+
+
+@interruptable
+def _read_header(fh):
+    """Read a response header from a filehandle"""
+    header = fh.readline()
+    if not header:
+        raise IOError(errno.EPIPE, 'git cat-file exited unexpectedly')
+    return core.decode(header).rstrip('\n')
+
+
+class CoProcess(object):
+    """A long-running git process that answers requests over a pipe
+
+    Requests are pipelined: they are written ahead of the responses being
+    read, but the amount of unanswered input is bounded by `max_pending`
+    bytes so that neither side can block on a full pipe.  The process is
+    restarted when it dies.
+
+    """
+    max_pending = 16 * 1024
+
+    def __init__(self, cwd):
+        self.cwd = cwd
+        self._proc = None
+        self._devnull = None
+        self._lock = threading.Lock()
+
+    def command(self):
+        raise NotImplementedError()
+
+    def _start(self):
+        proc = self._proc
+        if proc is not None and proc.poll() is None:
+            return proc
+        self._stop()
+        cmd = self.command()
+        if GIT_COLA_TRACE:
+            core.stderr(' '.join(cmd))
+        self._devnull = open(os.devnull, 'wb')
+        self._proc = proc = core.start_command(
+            cmd, cwd=self.cwd, stderr=self._devnull)
+        return proc
+
+    def _stop(self):
+        proc = self._proc
+        self._proc = None
+        if proc is not None:
+            try:
+                proc.stdin.close()
+            except (IOError, OSError, ValueError):
+                pass
+            try:
+                core.wait(proc)
+            except OSError:
+                pass
+            proc.stdout.close()
+        if self._devnull is not None:
+            self._devnull.close()
+            self._devnull = None
+
+    def close(self):
+        """Stop the co-process"""
+        with self._lock:
+            self._stop()
+
+    def _query_lines(self, lines):
+        """Send terminated request lines and return a response for each"""
+        if not lines:
+            return []
+        with self._lock:
+            try:
+                return self._query(lines)
+            except (IOError, OSError, ValueError):
+                # The process died; restart it and retry once
+                self._stop()
+                return self._query(lines)
+
+    def _query(self, lines):
+        proc = self._start()
+        stdin = proc.stdin
+        results = []
+        pending = collections.deque()
+        pending_size = 0
+        count = len(lines)
+        idx = 0
+        while idx < count or pending:
+            while idx < count and pending_size < self.max_pending:
+                line = lines[idx]
+                stdin.write(line)
+                pending.append(len(line))
+                pending_size += len(line)
+                idx += 1
+            stdin.flush()
+            pending_size -= pending.popleft()
+            results.append(self._read_response(proc.stdout))
+        return results
+
+    def _read_response(self, stdout):
+        raise NotImplementedError()
+
+
+class CatFile(CoProcess):
+    """A long-running `git cat-file --batch` co-process
+
+    Object reads are served over a pipe instead of forking a new git
+    process per object.
+
+    """
+
+    def __init__(self, cwd, check=False, filters=False):
+        CoProcess.__init__(self, cwd)
+        self.check = check
+        self.filters = filters
+
+    def command(self):
+        cmd = ['git', 'cat-file']
+        if self.check:
+            cmd.append('--batch-check')
+        else:
+            cmd.append('--batch')
+        if self.filters:
+            # Input lines are "<object> <path>" in this mode
+            cmd.append('--filters')
+        return cmd
+
+    def query(self, objects, paths=None):
+        """Return a CatFileObject, or None when missing, for each object
+
+        `paths` provides the path used to select filters for each object
+        when the co-process runs with `--filters`.
+
+        """
+        if paths is not None:
+            requests = ['%s %s' % (obj, path)
+                        for obj, path in zip(objects, paths)]
+        else:
+            requests = objects
+        return self._query_lines([core.encode(request) + b'\n'
+                                  for request in requests])
+
+    def stream(self, obj, fh, path=None, objtype='blob', chunk_size=65536):
+        """Write the content of an object to a filehandle in chunks
+
+        Only objects of type `objtype` are written.  The content of other
+        objects is read and skipped.  Returns a CatFileObject without
+        data, or None when the object is missing.
+
+        """
+        if path is not None:
+            request = '%s %s' % (obj, path)
+        else:
+            request = obj
+        line = core.encode(request) + b'\n'
+        with self._lock:
+            try:
+                header = self._request(line)
+            except (IOError, OSError, ValueError):
+                # The process died; restart it and retry once
+                self._stop()
+                header = self._request(line)
+            try:
+                return self._copy(header, fh, objtype, chunk_size)
+            except (IOError, OSError, ValueError):
+                # The rest of the response is unread, so start over
+                self._stop()
+                raise
+
+    def _request(self, line):
+        proc = self._start()
+        proc.stdin.write(line)
+        proc.stdin.flush()
+        return _read_header(proc.stdout)
+
+    def _copy(self, header, fh, objtype, chunk_size):
+        fields = header.rsplit(' ', 2)
+        if len(fields) != 3 or not fields[2].isdigit():
+            return None
+        oid, kind, size = fields
+        size = int(size)
+        stdout = self._proc.stdout
+        # The content is followed by a newline
+        remaining = size + 1
+        while remaining:
+            data = _read_exactly(stdout, min(remaining, chunk_size))
+            remaining -= len(data)
+            if not remaining:
+                data = data[:-1]
+            if kind == objtype and data:
+                fh.write(data)
+        return CatFileObject(oid, kind, size, None)
+
+    def _read_response(self, stdout):
+        # "<oid> <type> <size>" or "<object> missing"
+        header = _read_header(stdout)
+        fields = header.rsplit(' ', 2)
+        if len(fields) != 3 or not fields[2].isdigit():
+            return None
+        oid, objtype, size = fields
+        size = int(size)
+        data = None
+        if not self.check:
+            data = _read_exactly(stdout, size + 1)[:-1]
+        return CatFileObject(oid, objtype, size, data)
+
+
+class CheckAttr(CoProcess):
+    """A long-running `git check-attr --stdin -z` co-process
+
+    The attributes are chosen when the process starts.  git caches the
+    .gitattributes files that it has read, so the process has to be
+    restarted with close() when they change.
+
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, cwd, attrs):
+        CoProcess.__init__(self, cwd)
+        self.attrs = tuple(attrs)
+        self._buffer = b''
+        self._offset = 0
+
+    def command(self):
+        return ['git', 'check-attr', '--stdin', '-z'] + list(self.attrs)
+
+    def _stop(self):
+        CoProcess._stop(self)
+        self._buffer = b''
+        self._offset = 0
+
+    def query(self, paths):
+        """Return a dict of {attribute: value} for each path
+
+        Values are "unspecified", "set", "unset" or the attribute's value.
+
+        """
+        return self._query_lines([core.encode(path) + b'\0'
+                                  for path in paths])
+
+    def _read_response(self, stdout):
+        # "<path> NUL <attribute> NUL <value> NUL" for each attribute
+        result = {}
+        for _ in self.attrs:
+            self._read_field(stdout)
+            attr = self._read_field(stdout)
+            result[attr] = self._read_field(stdout)
+        return result
+
+    def _read_field(self, stdout):
+        while True:
+            end = self._buffer.find(b'\0', self._offset)
+            if end >= 0:
+                field = self._buffer[self._offset:end]
+                self._offset = end + 1
+                return core.decode(field)
+            data = core.read_chunk(stdout, self.chunk_size)
+            if not data:
+                raise IOError(errno.EPIPE, 'git check-attr exited unexpectedly')
+            self._buffer = self._buffer[self._offset:] + data
+            self._offset = 0
+
+
 class Git(object):
     """
     The Git class manages communication with the Git binary
@@ -149,12 +637,17 @@ class Git(object):
 
         self._git_cwd = None  #: The working directory used by execute()
         self._valid = {}  #: Store the result of is_git_dir() for performance
+        self._cat_file = {}  #: Long-running "git cat-file" co-processes
+        self._cat_file_lock = threading.Lock()
+        self._check_attr = {}  #: Long-running "git check-attr" co-processes
         self.set_worktree(core.getcwd())
 
     def getcwd(self):
         return self._git_cwd
 
     def _find_git_directory(self, path):
+        self.close_cat_file()
+        self.close_check_attr()
         self._git_cwd = None
         self.paths = find_git_directory(path)
 
@@ -205,6 +698,84 @@ class Git(object):
             self._find_git_directory(path)
         return self.paths.git_dir
 
+    def _cat_file_process(self, check=False, filters=False):
+        key = (check, filters)
+        with self._cat_file_lock:
+            try:
+                proc = self._cat_file[key]
+            except KeyError:
+                proc = self._cat_file[key] = CatFile(
+                    self._git_cwd, check=check, filters=filters)
+        return proc
+
+    def cat_file_batch(self, objects, paths=None):
+        """Read objects using a long-running "git cat-file --batch"
+
+        When `paths` are specified the objects are read with `--filters`
+        applied according to the corresponding path.
+
+        :returns: a list with a CatFileObject, or None, for each object
+
+        """
+        filters = paths is not None
+        proc = self._cat_file_process(filters=filters)
+        return proc.query(objects, paths=paths)
+
+    def cat_file_stream(self, obj, fh, path=None):
+        """Write a blob to a filehandle using "git cat-file --batch"
+
+        Filters for `path` are applied when it is specified.
+
+        :returns: a CatFileObject without data, or None when missing.
+            Objects that are not blobs are not written.
+
+        """
+        proc = self._cat_file_process(filters=path is not None)
+        return proc.stream(obj, fh, path=path)
+
+    def cat_file_batch_check(self, objects):
+        """Return the type and size of objects via "git cat-file --batch-check"
+
+        :returns: a list with a CatFileObject, or None, for each object
+
+        """
+        return self._cat_file_process(check=True).query(objects)
+
+    def close_cat_file(self):
+        """Stop the "git cat-file" co-processes"""
+        with self._cat_file_lock:
+            procs = list(self._cat_file.values())
+            self._cat_file.clear()
+        for proc in procs:
+            proc.close()
+
+    def check_attr_batch(self, paths, attrs):
+        """Read attributes using a long-running "git check-attr --stdin"
+
+        :returns: a list with a dict of {attribute: value} for each path
+
+        """
+        key = tuple(attrs)
+        with self._cat_file_lock:
+            try:
+                proc = self._check_attr[key]
+            except KeyError:
+                proc = self._check_attr[key] = CheckAttr(self._git_cwd, key)
+        return proc.query(paths)
+
+    def close_check_attr(self):
+        """Stop the "git check-attr" co-processes
+
+        The co-processes cache the .gitattributes files, so they are
+        stopped when the attributes change.
+
+        """
+        with self._cat_file_lock:
+            procs = list(self._check_attr.values())
+            self._check_attr.clear()
+        for proc in procs:
+            proc.close()
+
     def __getattr__(self, name):
         git_cmd = functools.partial(self.git, name)
         setattr(self, name, git_cmd)
@@ -219,7 +790,8 @@ class Git(object):
                 _stdin=None,
                 _stderr=subprocess.PIPE,
                 _stdout=subprocess.PIPE,
-                _readonly=False,
+                _readonly=None,
+                _limit=None,
                 _no_win32_startupinfo=False):
         """
         Execute a command and returns its output
@@ -230,6 +802,11 @@ class Git(object):
         :param _encoding: default encoding, defaults to None (utf-8).
         :param _raw: do not strip trailing whitespace.
         :param _stdin: optional stdin filehandle.
+        :param _readonly: whether the command can run concurrently with
+            other read-only commands, defaults to None (see is_readonly()).
+        :param _limit: stop reading stdout after this many bytes.  The
+            output is then truncated to complete lines and marked with
+            `truncated`, see core.run_command().
         :returns (status, out, err): exit status, stdout, stderr
 
         """
@@ -248,20 +825,20 @@ class Git(object):
 
         # Start the process
         # Guard against thread-unsafe .git/index.lock files
-        if not _readonly:
-            INDEX_LOCK.acquire()
-        try:
+        if _readonly is None:
+            _readonly = is_readonly(command)
+        with INDEX_LOCK.held(_readonly):
             status, out, err = core.run_command(
                     command, cwd=_cwd, encoding=_encoding,
                     stdin=_stdin, stdout=_stdout, stderr=_stderr,
-                    no_win32_startupinfo=_no_win32_startupinfo, **extra)
-        finally:
-            # Let the next thread in
-            if not _readonly:
-                INDEX_LOCK.release()
+                    no_win32_startupinfo=_no_win32_startupinfo,
+                    limit=_limit, **extra)
 
         if not _raw and out is not None:
+            truncated = out.truncated
             out = core.UStr(out.rstrip('\n'), out.encoding)
+            if truncated:
+                out.truncated = True
 
         cola_trace = GIT_COLA_TRACE
         if cola_trace == 'trace':
@@ -292,6 +869,7 @@ class Git(object):
                 '_stderr',
                 '_raw',
                 '_readonly',
+                '_limit',
                 '_no_win32_startupinfo',
                 )
 
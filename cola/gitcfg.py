@@ -5,12 +5,14 @@ import fnmatch
 import os
 import re
 import struct
+import threading
 from binascii import unhexlify
 from os.path import join
 
 from . import core
 from . import git
 from . import observable
+from . import version
 from .compat import int_types
 from .decorators import memoize
 from .git import STDOUT
@@ -22,6 +24,9 @@ _USER_CONFIG = core.expanduser(join('~', '.gitconfig'))
 _USER_XDG_CONFIG = core.expanduser(
         join(core.getenv('XDG_CONFIG_HOME', join('~', '.config')),
              'git', 'config'))
+_USER_XDG_ATTRIBUTES = core.expanduser(
+        join(core.getenv('XDG_CONFIG_HOME', join('~', '.config')),
+             'git', 'attributes'))
 
 
 @memoize
@@ -48,7 +53,7 @@ def _stat_info():
     return statinfo
 
 
-def _cache_key():
+def _cache_key(origins=()):
     # Try /etc/gitconfig as a fallback for the system config
     paths = ['/etc/gitconfig',
              _USER_XDG_CONFIG,
@@ -56,11 +61,13 @@ def _cache_key():
     config = git.current().git_path('config')
     if config:
         paths.append(config)
+    # Files that were read, including [include] and [includeIf] files
+    paths.extend(sorted(origins))
 
     mtimes = []
     for path in paths:
         try:
-            mtimes.append(core.stat(path).st_mtime)
+            mtimes.append((path, core.stat(path).st_mtime))
         except OSError:
             continue
     return mtimes
@@ -94,8 +101,122 @@ def _config_key_value(line, splitchar):
     return k, _config_to_python(v)
 
 
+def _mtime(path):
+    try:
+        return core.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _attribute_value(value):
+    """Return None for attributes without a string value"""
+    if value in ('unspecified', 'unset', 'set'):
+        return None
+    return value
+
+
+class AttributeCache(object):
+    """Cache the git attributes of paths
+
+    Attributes are read in batches from a long-running "git check-attr"
+    co-process.  The mtime of every attributes file that applies to a cached
+    path is recorded, and the cache is cleared when any of them changes.
+
+    """
+    attrs = ('encoding', 'binary', 'diff', 'filter')
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.git = cfg.git
+        self._values = {}
+        self._mtimes = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """Forget all attributes and restart the co-process"""
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._values = {}
+        self._mtimes = {}
+        self.git.close_check_attr()
+
+    def query(self, paths):
+        """Return a dict of {attribute: value} for each path"""
+        with self._lock:
+            self._check(paths)
+            values = self._values
+            missing = []
+            seen = set()
+            for path in paths:
+                if path not in values and path not in seen:
+                    seen.add(path)
+                    missing.append(path)
+            if missing:
+                try:
+                    results = self.git.check_attr_batch(missing, self.attrs)
+                except (IOError, OSError, ValueError):
+                    results = [dict.fromkeys(self.attrs, 'unspecified')
+                               for _ in missing]
+                for path, result in zip(missing, results):
+                    values[path] = result
+            return [values[path] for path in paths]
+
+    def _check(self, paths):
+        """Clear the cache when the attributes files for paths change"""
+        mtimes = self._mtimes
+        files = set(self._global_files())
+        files.update(self._attribute_files(paths))
+
+        current = {}
+        changed = False
+        for filename in files:
+            mtime = current[filename] = _mtime(filename)
+            if filename in mtimes and mtimes[filename] != mtime:
+                changed = True
+        if changed:
+            self._clear()
+        self._mtimes.update(current)
+
+    def _global_files(self):
+        files = []
+        info_attributes = self.git.git_path('info', 'attributes')
+        if info_attributes:
+            files.append(info_attributes)
+        user_attributes = self.cfg.get('core.attributesfile')
+        if user_attributes:
+            files.append(core.expanduser(user_attributes))
+        else:
+            files.append(_USER_XDG_ATTRIBUTES)
+        files.append('/etc/gitattributes')
+        return files
+
+    def _attribute_files(self, paths):
+        """Return the .gitattributes files that can apply to paths"""
+        worktree = self.git.worktree()
+        if not worktree:
+            return []
+        files = []
+        seen = set()
+        for dirname in set(os.path.dirname(path) for path in paths):
+            # Stop at the first ancestor that was already visited
+            while dirname not in seen:
+                seen.add(dirname)
+                files.append(join(worktree, dirname, '.gitattributes'))
+                if not dirname:
+                    break
+                dirname = os.path.dirname(dirname)
+        return files
+
+
 class GitConfig(observable.Observable):
-    """Encapsulate access to git-config values."""
+    """Encapsulate access to git-config values.
+
+    The values of each scope are kept in dicts that are replaced, and never
+    modified, when the configuration is read again.
+
+    """
 
     message_user_config_changed = 'user_config_changed'
     message_repo_config_changed = 'repo_config_changed'
@@ -110,27 +231,41 @@ class GitConfig(observable.Observable):
         self._user_or_system = {}
         self._repo = {}
         self._all = {}
+        self._origins = set()
         self._cache_key = None
         self._configs = []
         self._config_files = {}
-        self._attr_cache = {}
+        self._attributes = AttributeCache(self)
         self._find_config_files()
 
     def reset(self):
         self._cache_key = None
         self._configs = []
         self._config_files.clear()
-        self._attr_cache = {}
+        self._attributes.clear()
         self._find_config_files()
         self.reset_values()
 
     def reset_values(self):
-        self._map.clear()
-        self._system.clear()
-        self._user.clear()
-        self._user_or_system.clear()
-        self._repo.clear()
-        self._all.clear()
+        self._set_values({}, {}, {}, {}, set())
+
+    def invalidate(self):
+        """Read the configuration again on the next update()"""
+        self._cache_key = None
+
+    def _set_values(self, system, user, repo, key_map, origins):
+        user_or_system = dict(system)
+        user_or_system.update(user)
+        all_values = dict(user_or_system)
+        all_values.update(repo)
+
+        self._map = key_map
+        self._system = system
+        self._user = user
+        self._user_or_system = user_or_system
+        self._repo = repo
+        self._all = all_values
+        self._origins = origins
 
     def user(self):
         return copy.deepcopy(self._user)
@@ -164,7 +299,7 @@ class GitConfig(observable.Observable):
         Updates the cache and returns False when the cache does not match.
 
         """
-        cache_key = _cache_key()
+        cache_key = _cache_key(self._origins)
         if self._cache_key is None or cache_key != self._cache_key:
             self._cache_key = cache_key
             return False
@@ -175,27 +310,74 @@ class GitConfig(observable.Observable):
         if self._cached():
             return
 
-        self.reset_values()
+        if not BUILTIN_READER and version.check_git('config-show-scope'):
+            values = self.read_scopes()
+        else:
+            values = self.read_config_files()
+        self._set_values(*values)
+        if self._origins:
+            # Include files are only known once they have been read
+            self._cache_key = _cache_key(self._origins)
+
+        self.notify_observers(self.message_updated)
+
+    def read_scopes(self):
+        """Read every scope with a single "git config" call
 
+        Returns (system, user, repo, key_map, origins), where origins is the
+        set of files that the values were read from.
+
+        """
+        scopes = {
+            'system': {},
+            'global': {},
+            'local': {},
+            'worktree': {},
+        }
+        key_map = {}
+        origins = set()
+        status, out, _ = self.git.config('--list', '--show-origin',
+                                         '--show-scope', z=True,
+                                         _readonly=True)
+        items = out.split('\0')
+        for idx in range(0, len(items) - 2, 3):
+            scope, origin, line = items[idx:idx+3]
+            # Values set with "git -c" have the "command" scope
+            dest = scopes.get(scope)
+            if dest is None or not line:
+                continue
+            if origin.startswith('file:'):
+                origins.add(core.abspath(origin[len('file:'):]))
+            k, v = _config_key_value(line, '\n')
+            key_map[k.lower()] = k
+            dest[k] = v
+        repo = scopes['local']
+        repo.update(scopes['worktree'])
+        return (scopes['system'], scopes['global'], repo, key_map, origins)
+
+    def read_config_files(self):
+        """Read the system, user and repo config files one at a time
+
+        Returns the same values as read_scopes().
+
+        """
+        system = {}
+        user = {}
+        repo = {}
         if 'system' in self._config_files:
-            self._system.update(
-                    self.read_config(self._config_files['system']))
+            system = self.read_config(self._config_files['system'])
 
         if 'user' in self._config_files:
-            self._user.update(
-                    self.read_config(self._config_files['user']))
+            user = self.read_config(self._config_files['user'])
 
         if 'repo' in self._config_files:
-            self._repo.update(
-                    self.read_config(self._config_files['repo']))
+            repo = self.read_config(self._config_files['repo'])
 
-        for dct in (self._system, self._user):
-            self._user_or_system.update(dct)
-
-        for dct in (self._system, self._user, self._repo):
-            self._all.update(dct)
-
-        self.notify_observers(self.message_updated)
+        key_map = {}
+        for dct in (system, user, repo):
+            for k in dct:
+                key_map[k.lower()] = k
+        return (system, user, repo, key_map, set())
 
     def read_config(self, path):
         """Return git config data from a path as a dictionary."""
@@ -211,7 +393,6 @@ class GitConfig(observable.Observable):
                 # the user has an invalid entry in their git config
                 continue
             k, v = _config_key_value(line, '\n')
-            self._map[k.lower()] = k
             dest[k] = v
         return dest
 
@@ -243,14 +424,15 @@ class GitConfig(observable.Observable):
 
             k, v = _config_key_value(line, '=')
             k = prefix + k
-            self._map[k.lower()] = k
             config[k] = v
 
         return config
 
-    def _get(self, src, key, default, fn=None, cached=True):
-        if not cached or not src:
+    def _get(self, scope, key, default, fn=None, cached=True):
+        if not cached or not getattr(self, scope):
             self.update()
+        # The dicts are replaced by update() so look them up afterwards
+        src = getattr(self, scope)
         try:
             value = self._get_with_fallback(src, key)
         except KeyError:
@@ -275,7 +457,7 @@ class GitConfig(observable.Observable):
 
     def get(self, key, default=None, fn=None, cached=True):
         """Return the string value for a config key."""
-        return self._get(self._all, key, default, fn=fn, cached=cached)
+        return self._get('_all', key, default, fn=fn, cached=cached)
 
     def get_all(self, key):
         """Return all values for a key sorted in priority order
@@ -326,13 +508,13 @@ class GitConfig(observable.Observable):
         return result
 
     def get_user(self, key, default=None):
-        return self._get(self._user, key, default)
+        return self._get('_user', key, default)
 
     def get_repo(self, key, default=None):
-        return self._get(self._repo, key, default)
+        return self._get('_repo', key, default)
 
     def get_user_or_system(self, key, default=None):
-        return self._get(self._user_or_system, key, default)
+        return self._get('_user_or_system', key, default)
 
     def python_to_git(self, value):
         if isinstance(value, bool):
@@ -349,6 +531,7 @@ class GitConfig(observable.Observable):
             self.git.config('--global', key, unset=True)
         else:
             self.git.config('--global', key, self.python_to_git(value))
+        self.invalidate()
         self.update()
         msg = self.message_user_config_changed
         self.notify_observers(msg, key, value)
@@ -358,6 +541,7 @@ class GitConfig(observable.Observable):
             self.git.config(key, unset=True)
         else:
             self.git.config(key, self.python_to_git(value))
+        self.invalidate()
         self.update()
         msg = self.message_repo_config_changed
         self.notify_observers(msg, key, value)
@@ -368,7 +552,8 @@ class GitConfig(observable.Observable):
         result = {}
         if not self._all:
             self.update()
-        for key, val in self._all.items():
+        all_values = self._all
+        for key, val in all_values.items():
             if match(key.lower(), pat):
                 result[key] = val
         return result
@@ -387,27 +572,24 @@ class GitConfig(observable.Observable):
     def file_encoding(self, path):
         if not self.is_per_file_attrs_enabled():
             return self.gui_encoding()
-        cache = self._attr_cache
-        try:
-            value = cache[path]
-        except KeyError:
-            value = cache[path] = (self._file_encoding(path) or
-                                   self.gui_encoding())
-        return value
+        return self.file_encodings([path])[0]
 
-    def _file_encoding(self, path):
-        """Return the file encoding for a path"""
-        status, out, err = self.git.check_attr('encoding', '--', path)
-        if status != 0:
-            return None
-        header = '%s: encoding: ' % path
-        if out.startswith(header):
-            encoding = out[len(header):].strip()
-            if (encoding != 'unspecified' and
-                    encoding != 'unset' and
-                    encoding != 'set'):
-                return encoding
-        return None
+    def file_encodings(self, paths):
+        """Return the encoding for each path in a single batch"""
+        if not self.is_per_file_attrs_enabled():
+            return [self.gui_encoding()] * len(paths)
+        default = self.gui_encoding()
+        return [_attribute_value(attrs['encoding']) or default
+                for attrs in self.file_attributes(paths)]
+
+    def file_attributes(self, paths):
+        """Return a dict of {attribute: value} for each path
+
+        The "encoding", "binary", "diff" and "filter" attributes are read.
+        Values are "unspecified", "set", "unset" or the attribute's value.
+
+        """
+        return self._attributes.query(paths)
 
     def get_guitool_opts(self, name):
         """Return the guitool.<name> namespace as a dict
@@ -1,15 +1,20 @@
 """Git commands and queries for Git"""
 from __future__ import division, absolute_import, unicode_literals
+import collections
 import json
 import os
 import re
+import threading
+import time
 from io import StringIO
 
 from . import core
+from . import diffparse
 from . import gitcfg
 from . import utils
 from . import version
 from .git import git
+from .git import INDEX_LOCK
 from .git import STDOUT
 from .i18n import N_
 from .interaction import Interaction
@@ -28,10 +33,123 @@ class InvalidRepositoryError(Exception):
 def add(items, u=False):
     """Run "git add" while preventing argument overflow"""
     add = git.add
+    if version.check_git('pathspec-from-file'):
+        return with_pathspec_file(add, items, force=True, verbose=True, u=u)
     return utils.slice_fn(
         items, lambda paths: add('--', force=True, verbose=True, u=u, *paths))
 
 
+def with_pathspec_file(fn, paths, *args, **kwargs):
+    """Call a git command with the paths in a --pathspec-from-file file
+
+    The paths are NUL-separated, so every path is passed to a single git
+    command regardless of how many there are.
+
+    """
+    if not paths:
+        return (0, '', '')
+    tmp_file = utils.tmp_filename('pathspec')
+    try:
+        core.write(tmp_file, '\0'.join(paths))
+        return fn(pathspec_from_file=tmp_file, pathspec_file_nul=True,
+                  *args, **kwargs)
+    finally:
+        core.unlink(tmp_file)
+
+
+def stage_paths(paths, files=(), deleted=(), progress=None):
+    """Stage the additions, modifications and removals of paths
+
+    `files` is the set of files known to the status model.  They are
+    staged with a single "git update-index", which is much faster than
+    matching thousands of pathspecs in "git add".  Other paths, e.g.
+    directories, are staged with "git add".  `deleted` is the set of
+    paths known to be missing from the worktree, which saves stat'ing
+    paths when git cannot read them from a pathspec file.
+    `progress` is passed on to update_index().
+
+    """
+    to_update = []
+    to_add = []
+    to_remove = []
+    use_pathspec_file = version.check_git('pathspec-from-file')
+    for path in set(paths):
+        if path in files:
+            to_update.append(path)
+            continue
+        path = path.rstrip('/') or path
+        if use_pathspec_file:
+            # "git add <pathspec>" stages removals, too
+            to_add.append(path)
+        elif path in deleted:
+            to_remove.append(path)
+        elif core.exists(path) or core.islink(path):
+            to_add.append(path)
+        else:
+            to_remove.append(path)
+
+    results = []
+    if to_update:
+        results.append(update_index(to_update, progress=progress))
+    # `git add -u` doesn't work on untracked files
+    if to_add:
+        results.append(add(to_add))
+    # If a path doesn't exist then that means it should be removed
+    # from the index.   We use `git add -u` for that.
+    if to_remove:
+        results.append(add(to_remove, u=True))
+    return _combine_results(results)
+
+
+def update_index(paths, progress=None, chunk_size=1024):
+    """Add, update or remove files in the index using "git update-index"
+
+    The paths are read from stdin, so any number of files are handled by
+    a single command.  `progress` is called with (done, total) after each
+    chunk of `chunk_size` paths is read by git.
+
+    """
+    if not paths:
+        return (0, '', '')
+    cmd = ['git', 'update-index', '--add', '--remove', '-z', '--stdin']
+    # The index stays locked until git has read every path
+    with INDEX_LOCK.held(readonly=False):
+        proc = core.start_command(cmd, cwd=git.getcwd())
+        _write_paths(proc, paths, progress, chunk_size)
+        out, err = core.communicate(proc)
+    return (proc.returncode, core.decode(out), core.decode(err))
+
+
+def _write_paths(proc, paths, progress, chunk_size):
+    """Write NUL-terminated paths to a command in chunks"""
+    total = len(paths)
+    try:
+        for start in range(0, total, chunk_size):
+            chunk = paths[start:start + chunk_size]
+            # Writes block once the pipe is full, i.e. until git has
+            # read most of the previous chunk
+            core.xwrite(proc.stdin, ''.join(path + '\0' for path in chunk))
+            proc.stdin.flush()
+            if progress is not None:
+                progress(start + len(chunk), total)
+    except (IOError, OSError):
+        # git exited early, its status and errors are reported by the caller
+        pass
+
+
+def _combine_results(results):
+    status = 0
+    outs = []
+    errs = []
+    for stat, out, err in results:
+        status = max(stat, status)
+        if out:
+            outs.append(out)
+        if err:
+            errs.append(err)
+    return (status, '\n'.join(outs), '\n'.join(errs))
+
+
 def apply_diff(filename):
     return git.apply(filename, index=True, cached=True)
 
@@ -129,15 +247,6 @@ def _parse_diff_filenames(out):
         return []
 
 
-def tracked_files(*args):
-    """Return the names of all files in the repository"""
-    out = git.ls_files('--', *args, z=True)[STDOUT]
-    if out:
-        return sorted(out[:-1].split('\0'))
-    else:
-        return []
-
-
 def all_files(*args):
     """Returns a sorted list of all files, including untracked files."""
     ls_files = git.ls_files('--', *args,
@@ -158,6 +267,16 @@ def reset():
     _current_branch.key = None
 
 
+def _cache_current_branch(value):
+    """Seed the current_branch() cache, e.g. from "git status" output"""
+    head = git.git_path('HEAD')
+    try:
+        _current_branch.key = core.stat(head).st_mtime
+    except OSError:
+        return
+    _current_branch.value = value
+
+
 def current_branch():
     """Return the current branch"""
     head = git.git_path('HEAD')
@@ -308,6 +427,73 @@ def untracked_files(git=git, paths=None, **kwargs):
     return []
 
 
+def last_commits(paths, pathspecs=None, chunk_size=64*1024):
+    """Find the last commit that touched each path
+
+    A single "git log" walk limited to `pathspecs`, which defaults to
+    `paths`, is used for all of the paths.  A directory is touched by the
+    commits that touch any file inside of it.  The walk stops as soon as
+    every path has been seen.
+
+    Returns a dict mapping paths to (relative date, summary, author).
+    Paths without history are not included.
+
+    """
+    pending = set(paths)
+    if not pending:
+        return {}
+    if pathspecs is None:
+        pathspecs = paths
+    cmd = ['git', '--literal-pathspecs', 'log', '--no-renames',
+           '--name-only', '-z', '--pretty=format:%x02%ar%x01%s%x01%an',
+           '--stdin']
+    with INDEX_LOCK.held(readonly=True):
+        proc = core.start_command(cmd, cwd=git.getcwd())
+        try:
+            if pathspecs:
+                core.xwrite(proc.stdin,
+                            '--\n' + '\n'.join(pathspecs) + '\n')
+            proc.stdin.close()
+            return _read_last_commits(proc, pending, chunk_size)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.stdout.close()
+            proc.stderr.close()
+            core.wait(proc)
+
+
+def _read_last_commits(proc, pending, chunk_size):
+    """Read "git log" records until every pending path has been seen"""
+    result = {}
+    info = None
+    buf = b''
+    while pending:
+        data = core.read_chunk(proc.stdout, chunk_size)
+        records = (buf + data).split(b'\0')
+        buf = records.pop()
+        if not data and buf:
+            # The last record is not terminated
+            records.append(buf)
+        for record in records:
+            if record.startswith(b'\x02'):
+                header, _, record = record[1:].partition(b'\n')
+                info = tuple(core.decode(header).split('\x01', 2))
+            if not record or info is None:
+                continue
+            path = core.decode(record)
+            while path:
+                if path in pending:
+                    pending.remove(path)
+                    result[path] = info
+                path = utils.dirname(path)
+            if not pending:
+                break
+        if not data:
+            break
+    return result
+
+
 def tag_list():
     """Return a list of tags."""
     result = for_each_ref_basename('refs/tags')
@@ -377,8 +563,34 @@ def oid_diff(git, oid, filename=None):
     return out
 
 
+def commit_body(oid, git=git):
+    """Return the body of a commit message, i.e. "git log --pretty=%b"
+
+    The commit object is read from the "git cat-file --batch" co-process.
+
+    """
+    obj = git.cat_file_batch([oid])[0]
+    if obj is None or obj.objtype != 'commit':
+        return log(git, '-1', oid, '--', pretty='format:%b')
+    return parse_commit_body(obj.data)
+
+
+def parse_commit_body(data):
+    """Extract the message body from a raw commit object"""
+    headers, _, message = data.partition(b'\n\n')
+    encoding = None
+    for line in headers.split(b'\n'):
+        if line.startswith(b'encoding '):
+            encoding = core.decode(line[len(b'encoding '):])
+            break
+    # The subject is the first paragraph of the message
+    message = message.lstrip(b'\n')
+    _, _, body = message.partition(b'\n\n')
+    return core.decode(body, encoding=encoding).lstrip('\n')
+
+
 def diff_info(oid, git=git, filename=None):
-    decoded = log(git, '-1', oid, '--', pretty='format:%b').strip()
+    decoded = commit_body(oid, git=git).strip()
     if decoded:
         decoded += '\n\n'
     return decoded + oid_diff(git, oid, filename=filename)
@@ -395,8 +607,14 @@ def diff_helper(commit=None,
                 with_diff_header=False,
                 suppress_header=True,
                 reverse=False,
+                max_size=None,
                 git=git):
-    "Invokes git diff on a filepath."
+    """Invokes git diff on a filepath.
+
+    When max_size is given, at most max_size bytes of the diff are read
+    and the result's `truncated` attribute tells whether it was cut short.
+
+    """
     if commit:
         ref, endref = commit+'^', commit
     argv = []
@@ -420,18 +638,139 @@ def diff_helper(commit=None,
 
     status, out, err = git.diff(R=reverse, M=True, cached=cached,
                                 _encoding=encoding,
+                                _limit=max_size or None,
                                 *argv,
                                 **common_diff_opts())
-    if status != 0:
+    truncated = out.truncated
+    if status != 0 and not truncated:
         # git init
         if with_diff_header:
             return ('', '')
         else:
             return ''
 
+    if truncated:
+        # Drop the incomplete last hunk so that every hunk can be staged
+        end = out.rfind('\n@@ -')
+        if out.rfind('\n@@ -', 0, end) >= 0:
+            out = core.UStr(out[:end], out.encoding)
+
     result = extract_diff_header(status, deleted,
                                  with_diff_header, suppress_header, out)
-    return core.UStr(result, out.encoding)
+    result = core.UStr(result, out.encoding)
+    if truncated:
+        result.truncated = True
+    return result
+
+
+def _head_stamp():
+    """Return a stamp that changes when HEAD or the branch it names moves"""
+    head = git.git_path('HEAD')
+    if not head:
+        return None
+    try:
+        content = core.read(head).strip()
+    except (IOError, OSError):
+        return None
+    stamp = [content]
+    if content.startswith('ref: '):
+        stamp.append(core.stat_stamp(git.git_path(content[5:])))
+        stamp.append(core.stat_stamp(git.git_path('packed-refs')))
+    return tuple(stamp)
+
+
+class DiffCache(object):
+    """An LRU cache of parsed diff_helper() results for files
+
+    Entries are keyed by the diff's arguments and options, and by stamps
+    of the files that the diff was computed from: the index, HEAD when
+    diffing the index, and the worktree file otherwise.
+
+    """
+
+    def __init__(self, size=64):
+        self.size = size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def stats(self):
+        """Return the hit rate and the time spent computing diffs"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': lookups and self.hits / lookups or 0.0,
+                'avg_latency': (self.misses and
+                                self.total_latency / self.misses or 0.0),
+                'max_latency': self.max_latency,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def key(self, filename, cached=False, deleted=False, ref=None,
+            max_size=None):
+        """Return the cache key for a diff of filename"""
+        if cached:
+            stamp = _head_stamp()
+        else:
+            # Paths are relative to the worktree, not to the current
+            # directory
+            worktree = git.worktree()
+            if worktree:
+                stamp = core.stat_stamp(os.path.join(worktree, filename))
+            else:
+                stamp = core.stat_stamp(filename)
+        opts = tuple(sorted(common_diff_opts().items()))
+        return (filename, cached, deleted, ref, max_size, opts, stamp,
+                core.stat_stamp(git.git_path('index')))
+
+    def get(self, key):
+        """Return the cached diffparse.ParsedDiff, or None"""
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                return None
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def diff(self, key, filename, cached=False, deleted=False, ref=None,
+             max_size=None):
+        """Compute and parse a diff and store it in the cache"""
+        start = time.time()
+        value = diffparse.ParsedDiff(diff_helper(
+            filename=filename, cached=cached, deleted=deleted, ref=ref,
+            max_size=max_size))
+        latency = time.time() - start
+        with self._lock:
+            self.misses += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return value
+
+
+_diff_cache = DiffCache()
+
+
+def diff_cache():
+    """Return the process-wide DiffCache"""
+    return _diff_cache
 
 
 def extract_diff_header(status, deleted,
@@ -534,12 +873,17 @@ def export_patchset(start, end, output='patches', **kwargs):
 def reset_paths(items):
     """Run "git reset" while preventing argument overflow"""
     reset = git.reset
+    if version.check_git('pathspec-from-file'):
+        return with_pathspec_file(reset, items)
     status, out, err = utils.slice_fn(items, lambda paths: reset('--', *paths))
     return (status, out, err)
 
 
 def unstage_paths(args, head='HEAD'):
-    status, out, err = git.reset(head, '--', *set(args))
+    if version.check_git('pathspec-from-file'):
+        status, out, err = with_pathspec_file(git.reset, list(set(args)), head)
+    else:
+        status, out, err = git.reset(head, '--', *set(args))
     if status == 128:
         # handle git init: we have to use 'git rm --cached'
         # detect this condition by checking if the file is still staged
@@ -564,6 +908,23 @@ def worktree_state(head='HEAD',
             changed_upstream, and submodule.
 
     """
+    # "git status" cannot compare the index against anything but HEAD,
+    # e.g. HEAD^ when amending, so the diff-based scanner is used then.
+    if head == 'HEAD' and version.check_git('status-porcelain-v2'):
+        return status_worktree_state(display_untracked=display_untracked,
+                                     paths=paths)
+    return diff_worktree_state(head=head,
+                               update_index=update_index,
+                               display_untracked=display_untracked,
+                               paths=paths)
+
+
+def diff_worktree_state(head='HEAD',
+                        update_index=False,
+                        display_untracked=True,
+                        paths=None,
+                        upstream=True):
+    """Return the worktree_state() dict using diff-index and diff-files"""
     if update_index:
         git.update_index(refresh=True)
 
@@ -578,7 +939,10 @@ def worktree_state(head='HEAD',
         modified = [path for path in modified if path not in unmerged_set]
 
     # Look for upstream modified files if this is a tracking branch
-    upstream_changed = diff_upstream(head)
+    if upstream:
+        upstream_changed = diff_upstream(head)
+    else:
+        upstream_changed = []
 
     # Keep stuff sorted
     staged.sort()
@@ -597,6 +961,169 @@ def worktree_state(head='HEAD',
             'submodules': staged_submods | modified_submods}
 
 
+def paths_state(paths, head='HEAD', display_untracked=True):
+    """Return the worktree_state() lists for the given paths only
+
+    Only the entries for the paths are queried, so the result can be
+    used to update a larger worktree_state() in place.  The branch and
+    upstream keys are not included.
+
+    """
+    pathspecs = ['--'] + [':(literal)' + path for path in paths]
+    if head == 'HEAD' and version.check_git('status-porcelain-v2'):
+        if display_untracked:
+            untracked_files = 'all'
+        else:
+            untracked_files = 'no'
+        status, out, err = git.status(porcelain='v2', z=True,
+                                      untracked_files=untracked_files,
+                                      *pathspecs)
+        state = parse_status_v2(out)
+    else:
+        state = diff_worktree_state(head=head,
+                                    display_untracked=display_untracked,
+                                    paths=pathspecs[1:], upstream=False)
+    for key in ('upstream_changed', 'branch', 'upstream', 'ahead', 'behind'):
+        state.pop(key, None)
+    return state
+
+
+def status_worktree_state(display_untracked=True, paths=None):
+    """Return the worktree_state() dict using a single "git status" call
+
+    "git status --porcelain=v2 -z --branch" provides the staged, modified,
+    unmerged, untracked and submodule paths along with the branch, its
+    upstream and the ahead/behind counts.  The index is refreshed by
+    "git status" itself.
+
+    The dict has additional "branch", "upstream", "ahead" and "behind" keys.
+
+    """
+    if display_untracked:
+        untracked_files = 'all'
+    else:
+        untracked_files = 'no'
+    args = ['--']
+    if paths:
+        args.extend(paths)
+    status, out, err = git.status(porcelain='v2', z=True, branch=True,
+                                  untracked_files=untracked_files, *args)
+    state = parse_status_v2(out)
+
+    # Look for upstream modified files if this is a tracking branch.
+    # The upstream has nothing new when we are not behind it.
+    upstream = state['upstream']
+    if upstream and state['behind']:
+        base = merge_base('HEAD', upstream)
+        state['upstream_changed'] = sorted(diff_filenames(base, upstream))
+
+    branch = state['branch']
+    if branch:
+        _cache_current_branch(branch)
+
+    return state
+
+
+def parse_status_v2(out):
+    """Parse "git status --porcelain=v2 -z --branch" output
+
+    See worktree_state() and status_worktree_state() for the result.
+
+    """
+    staged = []
+    modified = []
+    unmerged = []
+    untracked = []
+    staged_deleted = set()
+    unstaged_deleted = set()
+    submodules = set()
+    branch = None
+    upstream = None
+    ahead = None
+    behind = None
+
+    fields = out.split('\0')
+    fields.reverse()
+    while fields:
+        entry = fields.pop()
+        kind = entry[:1]
+        if kind == '1':
+            # 1 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <path>
+            info = entry.split(' ', 8)
+            paths = [info[8]]
+        elif kind == '2':
+            # 2 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <X><score> <path>
+            # followed by <origPath> in a separate field.
+            info = entry.split(' ', 9)
+            paths = [info[9], fields.pop()]
+        elif kind == 'u':
+            # u <XY> <sub> <m1> <m2> <m3> <mW> <h1> <h2> <h3> <path>
+            info = entry.split(' ', 10)
+            unmerged.append(info[10])
+            if info[2].startswith('S'):
+                submodules.add(info[10])
+            continue
+        elif kind == '?':
+            untracked.append(entry[2:])
+            continue
+        elif kind == '#':
+            header, _, value = entry[2:].partition(' ')
+            if header == 'branch.head':
+                if value == '(detached)':
+                    branch = None
+                else:
+                    branch = value
+            elif header == 'branch.upstream':
+                upstream = value
+            elif header == 'branch.ab':
+                ahead_behind = value.split(' ')
+                ahead = int(ahead_behind[0][1:])
+                behind = int(ahead_behind[1][1:])
+            continue
+        else:
+            continue
+
+        index_status = info[1][0]
+        worktree_status = info[1][1]
+        is_submodule = info[2].startswith('S')
+        path = paths[0]
+        if is_submodule:
+            submodules.add(path)
+        if index_status != '.':
+            staged.append(path)
+            if index_status == 'D':
+                staged_deleted.add(path)
+            elif index_status == 'R':
+                # The source of a rename is a staged deletion
+                staged.append(paths[1])
+                staged_deleted.add(paths[1])
+        if worktree_status != '.':
+            modified.append(path)
+            if worktree_status == 'D':
+                unstaged_deleted.add(path)
+            elif worktree_status == 'R':
+                modified.append(paths[1])
+                unstaged_deleted.add(paths[1])
+
+    staged.sort()
+    modified.sort()
+    unmerged.sort()
+    untracked.sort()
+
+    return {'staged': staged,
+            'modified': modified,
+            'unmerged': unmerged,
+            'untracked': untracked,
+            'upstream_changed': [],
+            'staged_deleted': staged_deleted,
+            'unstaged_deleted': unstaged_deleted,
+            'submodules': submodules,
+            'branch': branch,
+            'upstream': upstream,
+            'ahead': ahead,
+            'behind': behind}
+
+
 def _parse_raw_diff(out):
     while out:
         info, path, out = out.split('\0', 2)
@@ -845,31 +1372,41 @@ def write_blob(oid, filename):
 
 
 def cat_file_blob(filename, oid):
-    return cat_file(filename, 'blob', oid)
+    return cat_file_batch(filename, oid)
 
 
 def cat_file_to_path(filename, oid):
-    return cat_file(filename, oid, path=filename, filters=True)
+    return cat_file_batch(filename, oid, path=filename)
+
 
+def cat_file_batch(filename, obj, path=None):
+    """Write a blob to a temporary path using "git cat-file --batch"
 
-def cat_file(filename, *args, **kwargs):
-    """Redirect git cat-file output to a path"""
-    result = None
+    The blob is streamed from a long-running git process.
+    Filters for `path` are applied when it is specified.
+
+    """
     # Use the original filename in the suffix so that the generated filename
     # has the correct extension, and so that it resembles the original name.
     basename = os.path.basename(filename)
     suffix = '-' + basename  # ensures the correct filename extension
-    path = utils.tmp_filename('blob', suffix=suffix)
-    with open(path, 'wb') as fp:
-        status, out, err = git.cat_file(
-            _raw=True, _readonly=True, _stdout=fp, *args, **kwargs)
-        Interaction.command(
-            N_('Error'), 'git cat-file', status, out, err)
-        if status == 0:
-            result = path
-    if not result:
-        core.unlink(path)
-    return result
+    tmp_path = utils.tmp_filename('blob', suffix=suffix)
+    try:
+        with open(tmp_path, 'wb') as fp:
+            result = git.cat_file_stream(obj, fp, path=path)
+    except (IOError, OSError) as e:
+        result = None
+        err = 'fatal: unable to read %s: %s' % (obj, e)
+    else:
+        if result is None:
+            err = 'fatal: Not a valid object name %s' % obj
+        elif result.objtype != 'blob':
+            err = 'fatal: %s is a %s, not a blob' % (obj, result.objtype)
+    if result is None or result.objtype != 'blob':
+        core.unlink(tmp_path)
+        Interaction.command(N_('Error'), 'git cat-file', 128, '', err)
+        return None
+    return tmp_path
 
 
 def write_blob_path(head, oid, filename):
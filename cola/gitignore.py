@@ -0,0 +1,387 @@
+"""Matches paths against git's exclude rules without running git
+
+The rules come from the ".gitignore" files in the worktree,
+$GIT_DIR/info/exclude and "core.excludesFile", and follow the same
+precedence and pattern syntax as "git check-ignore".
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+import os
+import re
+
+from . import core
+
+# A regex that never matches, used for patterns that git never matches
+_NEVER = '(?!)'
+
+_POSIX_CLASSES = {
+    'alnum': 'a-zA-Z0-9',
+    'alpha': 'a-zA-Z',
+    'blank': ' \\t',
+    'cntrl': '\\x00-\\x1f\\x7f',
+    'digit': '0-9',
+    'graph': '!-~',
+    'lower': 'a-z',
+    'print': ' -~',
+    'punct': '!-/:-@\\[-`{-~',
+    'space': ' \\t\\n\\r\\f\\v',
+    'upper': 'A-Z',
+    'xdigit': '0-9A-Fa-f',
+}
+
+
+def _class_char(char):
+    if char in '\\]^-[':
+        return '\\' + char
+    return char
+
+
+def _translate_bracket(pattern, i):
+    """Translate the bracket expression at pattern[i] into a regex
+
+    Returns (regex, index after the expression), or (None, None) when the
+    expression is not terminated.
+
+    """
+    count = len(pattern)
+    i += 1
+    negate = i < count and pattern[i] in '!^'
+    if negate:
+        i += 1
+    items = []
+    first = True
+    while i < count:
+        char = pattern[i]
+        if char == ']' and not first:
+            break
+        first = False
+        if char == '[' and pattern.startswith('[:', i):
+            end = pattern.find(':]', i + 2)
+            if end < 0:
+                items.append('\\[')
+                i += 1
+                continue
+            name = pattern[i + 2:end]
+            if name not in _POSIX_CLASSES:
+                return (_NEVER, end + 2)
+            items.append(_POSIX_CLASSES[name])
+            i = end + 2
+            continue
+        if char == '\\':
+            i += 1
+            if i >= count:
+                return (None, None)
+            char = pattern[i]
+        if (i + 2 < count and pattern[i + 1] == '-'
+                and pattern[i + 2] != ']'):
+            high = pattern[i + 2]
+            i += 2
+            if high == '\\':
+                i += 1
+                if i >= count:
+                    return (None, None)
+                high = pattern[i]
+            if char <= high:
+                items.append(_class_char(char) + '-' + _class_char(high))
+        else:
+            items.append(_class_char(char))
+        i += 1
+    if i >= count:
+        return (None, None)
+    if items:
+        regex = '[%s%s]' % (negate and '^' or '', ''.join(items))
+    elif negate:
+        regex = '.'
+    else:
+        regex = _NEVER
+    # With WM_PATHNAME a bracket expression never matches "/"
+    return ('(?!/)' + regex, i + 1)
+
+
+def translate(pattern):
+    """Translate a wildmatch pattern into an anchored regex string
+
+    This follows git's wildmatch() with WM_PATHNAME: "*", "?" and bracket
+    expressions do not match "/", while "**" between slashes or at either
+    end of the pattern matches across directories.
+
+    """
+    result = []
+    count = len(pattern)
+    i = 0
+    while i < count:
+        char = pattern[i]
+        if char == '*':
+            start = i
+            while i < count and pattern[i] == '*':
+                i += 1
+            bounded = ((start == 0 or pattern[start - 1] == '/') and
+                       (i == count or pattern[i] == '/' or
+                        pattern.startswith('\\/', i)))
+            if i - start > 1 and bounded:
+                if i == count:
+                    result.append('.*')
+                else:
+                    # "**/" also matches no directory at all
+                    i += pattern[i] == '\\' and 2 or 1
+                    result.append('(?:.*/)?')
+            else:
+                result.append('[^/]*')
+            continue
+        if char == '?':
+            result.append('[^/]')
+        elif char == '[':
+            regex, end = _translate_bracket(pattern, i)
+            if regex is None:
+                return _NEVER
+            result.append(regex)
+            i = end
+            continue
+        elif char == '\\':
+            i += 1
+            if i >= count:
+                # A trailing backslash never matches
+                return _NEVER
+            result.append(re.escape(pattern[i]))
+        else:
+            result.append(re.escape(char))
+        i += 1
+    return ''.join(result) + '\\Z'
+
+
+def _trim_trailing_spaces(line):
+    """Remove trailing spaces unless they are escaped with a backslash"""
+    last_space = None
+    i = 0
+    count = len(line)
+    while i < count:
+        char = line[i]
+        if char == ' ':
+            if last_space is None:
+                last_space = i
+        elif char == '\\':
+            i += 1
+            if i >= count:
+                return line
+            last_space = None
+        else:
+            last_space = None
+        i += 1
+    if last_space is not None:
+        line = line[:last_space]
+    return line
+
+
+class Pattern(object):
+    """One exclude pattern from an ignore file"""
+
+    __slots__ = ('text', 'negative', 'must_be_dir', 'basename', 'regex')
+
+    def __init__(self, text, ignore_case=False):
+        self.text = text
+        self.negative = text.startswith('!')
+        if self.negative:
+            text = text[1:]
+        self.must_be_dir = text.endswith('/')
+        if self.must_be_dir:
+            text = text[:-1]
+        # Patterns without a slash match the basename at any depth
+        self.basename = '/' not in text
+        if text.startswith('/'):
+            text = text[1:]
+        flags = re.DOTALL
+        if ignore_case:
+            flags |= re.IGNORECASE
+        self.regex = re.compile(translate(text), flags)
+
+    def match(self, name, is_dir):
+        """Match the basename or the base-relative path of a path"""
+        if self.must_be_dir and not is_dir():
+            return False
+        return self.regex.match(name) is not None
+
+
+def parse(text, ignore_case=False):
+    """Parse the contents of an ignore file into a list of Patterns"""
+    if text.startswith('\ufeff'):
+        text = text[1:]
+    patterns = []
+    for line in text.split('\n'):
+        if line.endswith('\r'):
+            line = line[:-1]
+        if not line or line.startswith('#'):
+            continue
+        line = _trim_trailing_spaces(line)
+        if line and line not in ('!', '/', '!/'):
+            patterns.append(Pattern(line, ignore_case=ignore_case))
+    return patterns
+
+
+class PatternFile(object):
+    """The patterns from one ignore file, relative to a base directory"""
+
+    def __init__(self, path, base, ignore_case=False):
+        self.path = path
+        self.base = base
+        self.stamp = core.stat_stamp(path)
+        if self.stamp is None:
+            self.patterns = []
+        else:
+            try:
+                text = core.read(path, errors='replace')
+            except (OSError, IOError):
+                text = ''
+            self.patterns = parse(text, ignore_case=ignore_case)
+
+    def changed(self):
+        return core.stat_stamp(self.path) != self.stamp
+
+    def match(self, path, basename, is_dir):
+        """Return True or False for the last matching pattern, else None"""
+        base = self.base
+        if base:
+            relative = path[len(base) + 1:]
+        else:
+            relative = path
+        for pattern in reversed(self.patterns):
+            if pattern.basename:
+                name = basename
+            else:
+                name = relative
+            if pattern.match(name, is_dir):
+                return not pattern.negative
+        return None
+
+
+def excludes_file(config):
+    """Return the path to the "core.excludesFile" of a GitConfig"""
+    path = config.get('core.excludesfile')
+    if path:
+        return core.expanduser(path)
+    xdg_config_home = core.getenv('XDG_CONFIG_HOME')
+    if not xdg_config_home:
+        xdg_config_home = os.path.join(core.expanduser('~'), '.config')
+    return os.path.join(xdg_config_home, 'git', 'ignore')
+
+
+class IgnoreMatcher(object):
+    """Answers "git check-ignore" questions in-process
+
+    The ".gitignore" files are read as directories are visited.  Whether a
+    directory is ignored is remembered, so the paths below an ignored
+    directory are answered without matching them.  Call refresh() before
+    each batch of queries to pick up edited ignore files and config.
+
+    """
+
+    def __init__(self, worktree, git_dir, config):
+        self.worktree = worktree
+        self.git_dir = git_dir
+        self.config = config
+        self._settings = None
+        self._global_files = []
+        self._dir_files = {}
+        self._dir_ignored = {}
+
+    def _reset(self, settings):
+        excludes, ignore_case = settings
+        self._settings = settings
+        self._dir_files = {}
+        self._dir_ignored = {}
+        # info/exclude has precedence over core.excludesFile
+        self._global_files = [
+            PatternFile(os.path.join(self.git_dir, 'info', 'exclude'), '',
+                        ignore_case=ignore_case),
+            PatternFile(os.path.join(self.worktree, excludes), '',
+                        ignore_case=ignore_case),
+        ]
+
+    def refresh(self):
+        """Reload changed ignore files and return True if any changed"""
+        settings = (excludes_file(self.config),
+                    bool(self.config.get('core.ignorecase', False)))
+        if settings != self._settings:
+            changed = self._settings is not None
+            self._reset(settings)
+            return changed
+        files = self._global_files + list(self._dir_files.values())
+        for pattern_file in files:
+            if pattern_file.changed():
+                self._reset(settings)
+                return True
+        return False
+
+    def _pattern_file(self, dirname):
+        try:
+            return self._dir_files[dirname]
+        except KeyError:
+            pass
+        path = os.path.join(self.worktree, dirname, '.gitignore')
+        pattern_file = self._dir_files[dirname] = PatternFile(
+            path, dirname, ignore_case=self._settings[1])
+        return pattern_file
+
+    def _match(self, path, is_dir):
+        """Match a path whose parent directories are not ignored"""
+        basename = path.rsplit('/', 1)[-1]
+        dirname = path
+        while dirname:
+            if '/' in dirname:
+                dirname = dirname.rsplit('/', 1)[0]
+            else:
+                dirname = ''
+            result = self._pattern_file(dirname).match(path, basename, is_dir)
+            if result is not None:
+                return result
+        for pattern_file in self._global_files:
+            result = pattern_file.match(path, basename, is_dir)
+            if result is not None:
+                return result
+        return False
+
+    def _is_dir_ignored(self, dirname):
+        try:
+            return self._dir_ignored[dirname]
+        except KeyError:
+            pass
+        if '/' in dirname:
+            parent = dirname.rsplit('/', 1)[0]
+            ignored = self._is_dir_ignored(parent)
+        else:
+            ignored = False
+        if not ignored:
+            ignored = self._match(dirname, _true)
+        self._dir_ignored[dirname] = ignored
+        return ignored
+
+    def is_ignored(self, path):
+        """Return True if a worktree-relative path is ignored"""
+        if self._settings is None:
+            self.refresh()
+        path = path.strip('/')
+        if not path:
+            return False
+        if '/' in path and self._is_dir_ignored(path.rsplit('/', 1)[0]):
+            return True
+        return self._match(path, _IsDir(os.path.join(self.worktree, path)))
+
+
+def _true():
+    return True
+
+
+class _IsDir(object):
+    """Check whether a path is a directory on first use"""
+
+    __slots__ = ('path', 'value')
+
+    def __init__(self, path):
+        self.path = path
+        self.value = None
+
+    def __call__(self):
+        if self.value is None:
+            # Like lstat(), a symlink to a directory is not a directory
+            path = self.path
+            self.value = core.isdir(path) and not core.islink(path)
+        return self.value
@@ -7,6 +7,16 @@ from . import core
 from .i18n import N_
 
 
+class NullProgress(object):
+    """A progress indicator that is not displayed"""
+
+    def set_progress(self, value, maximum):
+        pass
+
+    def hide(self):
+        pass
+
+
 class Interaction(object):
     """Prompts the user and answers questions"""
 
@@ -126,3 +136,13 @@ class Interaction(object):
     @staticmethod
     def async_command(title, command, runtask):
         pass
+
+    @staticmethod
+    def progress(title, label):
+        """Show progress for a long command that runs on the main thread
+
+        The returned object is updated with set_progress(value, maximum)
+        and closed with hide().
+
+        """
+        return NullProgress()
@@ -13,9 +13,9 @@ from .. import core
 from .. import icons
 from .. import utils
 from .. import qtutils
-from ..git import STDOUT
 from ..i18n import N_
 from ..models import main
+from ..models import tracked
 
 
 class Columns(object):
@@ -80,6 +80,7 @@ class GitRepoModel(QtGui.QStandardItemModel):
         self._parent = parent
         self._interesting_paths = set()
         self._interesting_files = set()
+        self._status_index = None
         self._runtask = qtutils.RunTask(parent=parent)
 
         self.model_updated.connect(self.refresh, type=Qt.QueuedConnection)
@@ -188,14 +189,19 @@ class GitRepoModel(QtGui.QStandardItemModel):
             if '/' in dirname:
                 dir_parent = self.add_parent_directories(parent, dirname)
             self.add_directory(dir_parent, dirname)
-            self.update_entry(dirname)
 
         for filename in paths:
             file_parent = parent
             if '/' in filename:
                 file_parent = self.add_parent_directories(parent, filename)
             self.add_file(file_parent, filename)
-            self.update_entry(filename)
+
+        # Walk the history of the directory once for all of its entries
+        if path == './':
+            pathspecs = []
+        else:
+            pathspecs = [path.rstrip('/')]
+        self.update_entries(dirs + paths, pathspecs=pathspecs)
 
     def add_parent_directories(self, parent, dirname):
         """Ensure that all parent directory entries exist"""
@@ -219,8 +225,16 @@ class GitRepoModel(QtGui.QStandardItemModel):
         model = main.model()
         return set(model.staged + model.unstaged)
 
+    def status_index(self):
+        """Return the StatusIndex for the current status of the repository"""
+        index = self._status_index
+        if index is None:
+            index = self._status_index = StatusIndex(main.model())
+        return index
+
     def _model_updated(self):
         """Observes model changes and updates paths accordingly."""
+        self._status_index = None
         self.model_updated.emit()
 
     def refresh(self):
@@ -236,8 +250,7 @@ class GitRepoModel(QtGui.QStandardItemModel):
             self.restore.emit()
 
         # Existing items
-        for path in sorted(new_paths.union(old_paths)):
-            self.update_entry(path)
+        self.update_entries(sorted(new_paths.union(old_paths)))
 
         self._interesting_files = new_files
         self._interesting_paths = new_paths
@@ -252,48 +265,73 @@ class GitRepoModel(QtGui.QStandardItemModel):
         self.populate_dir(root, './')
 
     def update_entry(self, path):
-        if self.turbo or path not in self.entries:
-            return  # entry doesn't currently exist
-        task = GitRepoInfoTask(self._parent, path, self.default_author)
+        self.update_entries([path])
+
+    def update_entries(self, paths, pathspecs=None):
+        """Look up the status and last commit of entries in the background
+
+        A single task is used for all of the paths.  The history walk is
+        limited to `pathspecs`, which defaults to the paths themselves.
+
+        """
+        if self.turbo:
+            return
+        # Skip entries that don't currently exist
+        paths = [path for path in paths if path in self.entries]
+        if not paths:
+            return
+        task = GitRepoInfoTask(self._parent, paths, self.default_author,
+                               self.status_index(), pathspecs=pathspecs)
         self._runtask.start(task)
 
 
-class GitRepoInfoTask(qtutils.Task):
-    """Handles expensive git lookups for a path."""
+class StatusIndex(object):
+    """The status of paths and of the directories that contain them
 
-    def __init__(self, parent, path, default_author):
-        qtutils.Task.__init__(self, parent)
-        self.path = path
-        self._parent = parent
-        self._default_author = default_author
-        self._data = {}
+    The sets are built once for each status update and shared by the
+    browser's tasks and actions.
 
-    def data(self, key):
-        """Return git data for a path
+    """
 
-        Supported keys are 'date', 'message', and 'author'
+    def __init__(self, model):
+        self.unmerged = utils.add_parents(model.unmerged)
+        self.modified = utils.add_parents(model.modified)
+        self.staged = utils.add_parents(model.staged)
+        self.untracked = utils.add_parents(model.untracked)
+        self.upstream_changed = utils.add_parents(model.upstream_changed)
 
-        """
-        if not self._data:
-            log_line = main.model().git.log('-1', '--', self.path,
-                                            no_color=True,
-                                            pretty=r'format:%ar%x01%s%x01%an',
-                                            _readonly=True
-                                            )[STDOUT]
-            if log_line:
-                log_line = log_line
-                date, message, author = log_line.split(chr(0x01), 2)
-                self._data['date'] = date
-                self._data['message'] = message
-                self._data['author'] = author
-            else:
-                self._data['date'] = self.date()
-                self._data['message'] = '-'
-                self._data['author'] = self._default_author
+    def status(self, path):
+        """Return the (icon, text) status for a path"""
+        if path in self.unmerged:
+            status = (icons.modified_name(), N_('Unmerged'))
+        elif path in self.modified and path in self.staged:
+            status = (icons.partial_name(), N_('Partially Staged'))
+        elif path in self.modified:
+            status = (icons.modified_name(), N_('Modified'))
+        elif path in self.staged:
+            status = (icons.staged_name(), N_('Staged'))
+        elif path in self.upstream_changed:
+            status = (icons.upstream_name(), N_('Changed Upstream'))
+        elif path in self.untracked:
+            status = (None, '?')
+        else:
+            status = (None, '')
+        return status
 
-        return self._data[key]
 
-    def date(self):
+class GitRepoInfoTask(qtutils.Task):
+    """Handles expensive git lookups for a set of paths."""
+
+    def __init__(self, parent, paths, default_author, status_index,
+                 pathspecs=None):
+        qtutils.Task.__init__(self, parent)
+        self.paths = paths
+        self.pathspecs = pathspecs
+        self.status_index = status_index
+        self._parent = parent
+        self._default_author = default_author
+
+    def date(self, path):
         """Returns a relative date for a file path
 
         This is typically used for new entries that do not have
@@ -301,7 +339,7 @@ class GitRepoInfoTask(qtutils.Task):
 
         """
         try:
-            st = core.stat(self.path)
+            st = core.stat(path)
         except:
             return N_('%d minutes ago') % 0
         elapsed = time.time() - st.st_mtime
@@ -313,44 +351,23 @@ class GitRepoInfoTask(qtutils.Task):
             return N_('%d hours ago') % hours
         return N_('%d days ago') % int(elapsed / 60 / 60 / 24)
 
-    def status(self):
-        """Return the status for the entry's path."""
-
-        model = main.model()
-        unmerged = utils.add_parents(model.unmerged)
-        modified = utils.add_parents(model.modified)
-        staged = utils.add_parents(model.staged)
-        untracked = utils.add_parents(model.untracked)
-        upstream_changed = utils.add_parents(model.upstream_changed)
-
-        path = self.path
-        if path in unmerged:
-            status = (icons.modified_name(), N_('Unmerged'))
-        elif path in modified and self.path in staged:
-            status = (icons.partial_name(), N_('Partially Staged'))
-        elif path in modified:
-            status = (icons.modified_name(), N_('Modified'))
-        elif path in staged:
-            status = (icons.staged_name(), N_('Staged'))
-        elif path in upstream_changed:
-            status = (icons.upstream_name(), N_('Changed Upstream'))
-        elif path in untracked:
-            status = (None, '?')
-        else:
-            status = (None, '')
-        return status
-
     def task(self):
         """Perform expensive lookups and post corresponding events."""
-        data = (
-            self.path,
-            self.status(),
-            self.data('message'),
-            self.data('author'),
-            self.data('date'),
-        )
+        # Untracked entries have no history and would make the walk
+        # visit every commit looking for them
+        paths = tracked.current().select(self.paths)
+        commits = gitcmds.last_commits(paths, pathspecs=self.pathspecs)
         app = QtWidgets.QApplication.instance()
-        app.postEvent(self._parent, GitRepoInfoEvent(data))
+        for path in self.paths:
+            try:
+                date, message, author = commits[path]
+            except KeyError:
+                date = self.date(path)
+                message = '-'
+                author = self._default_author
+            data = (path, self.status_index.status(path),
+                    message, author, date)
+            app.postEvent(self._parent, GitRepoInfoEvent(data))
 
 
 class GitRepoInfoEvent(QtCore.QEvent):
@@ -0,0 +1,94 @@
+"""Provides an index for matching completion candidates"""
+from __future__ import division, absolute_import, unicode_literals
+
+from .. import utils
+
+
+def _identity(x):
+    return x
+
+
+def _lower(x):
+    return x.lower()
+
+
+class CompletionIndex(object):
+    """Match completion candidates against text as it is typed
+
+    The candidates are lowercased and ranked once per candidate set.
+    Matches keep the ranked order, so nothing is sorted per keystroke, and
+    when the text grows only the previous matches are searched again.
+
+    """
+
+    def __init__(self, candidates, sort_key=None, parents=False):
+        self.candidates = candidates
+        if parents:
+            files = set(candidates)
+            candidates = utils.add_parents(files)
+            self.dirs = candidates.difference(files)
+        else:
+            self.dirs = set()
+        self._items = candidates
+        self._sort_key = sort_key or _identity
+        self._ranked = {}
+        self._last = None
+
+    def _ranking(self, case_sensitive):
+        """Return the ranked candidates and the strings to search"""
+        try:
+            return self._ranked[case_sensitive]
+        except KeyError:
+            pass
+        if case_sensitive:
+            transform = _identity
+        else:
+            transform = _lower
+        sort_key = self._sort_key
+        if sort_key is _identity:
+            items = sorted(self._items, key=transform)
+        else:
+            items = sorted(self._items, key=lambda x: sort_key(transform(x)))
+        if case_sensitive:
+            haystacks = items
+        else:
+            haystacks = [x.lower() for x in items]
+        ranking = self._ranked[case_sensitive] = (items, haystacks)
+        return ranking
+
+    def matches(self, text, case_sensitive, limit=None):
+        """Return up to "limit" ranked candidates that contain text"""
+        items, haystacks = self._ranking(case_sensitive)
+        if not case_sensitive:
+            text = text.lower()
+        if not text:
+            self._last = None
+            return items[:limit]
+
+        last = self._last
+        if last is not None and last[0] == case_sensitive and last[1] in text:
+            # Longer text can only match a subset of the previous matches
+            indexes = [i for i in last[2] if text in haystacks[i]]
+        else:
+            indexes = [i for i, haystack in enumerate(haystacks)
+                       if text in haystack]
+        self._last = (case_sensitive, text, indexes)
+        return [items[i] for i in indexes[:limit]]
+
+
+class CompletionIndexCache(object):
+    """Hold a CompletionIndex and rebuild it when the candidates change"""
+
+    def __init__(self, sort_key=None, parents=False):
+        self.sort_key = sort_key
+        self.parents = parents
+        self._index = None
+
+    def index(self, candidates):
+        """Return a CompletionIndex for the candidates"""
+        index = self._index
+        if index is None or (index.candidates is not candidates and
+                             index.candidates != candidates):
+            index = self._index = CompletionIndex(
+                candidates, sort_key=self.sort_key, parents=self.parents)
+        return index
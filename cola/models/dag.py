@@ -1,8 +1,19 @@
 from __future__ import division, absolute_import, unicode_literals
+import binascii
+import bisect
+import collections
+import hashlib
+import itertools
 import json
+import math
+import mmap
+import os
+import struct
+import sys
 
 from .. import core
 from .. import utils
+from ..compat import PY2
 from ..git import git
 from ..observable import Observable
 
@@ -11,15 +22,33 @@ from ..observable import Observable
 logfmt = 'format:%H%x01%P%x01%d%x01%an%x01%ad%x01%ae%x01%s'
 logsep = chr(0x01)
 
+if PY2:
+    _interned = {}
+
+    def intern(value):
+        """Share a single copy of a string
+
+        Python 2's intern() rejects unicode strings, so the copies are
+        kept in a dict.
+
+        """
+        return _interned.setdefault(value, value)
+else:
+    intern = sys.intern
+
 
 class CommitFactory(object):
     root_generation = 0
     commits = {}
+    commit_graph = None
 
     @classmethod
-    def reset(cls):
+    def reset(cls, commit_graph=None):
         cls.commits.clear()
         cls.root_generation = 0
+        if cls.commit_graph is not None:
+            cls.commit_graph.close()
+        cls.commit_graph = commit_graph
 
     @classmethod
     def new(cls, oid=None, log_entry=None):
@@ -35,13 +64,134 @@ class CommitFactory(object):
             commit = Commit(oid=oid,
                             log_entry=log_entry)
             if not log_entry:
-                cls.root_generation += 1
-                commit.generation = max(commit.generation,
-                                        cls.root_generation)
+                # The commit-graph knows the generation of commits
+                # that precede the commits being read.
+                generation = None
+                if cls.commit_graph is not None:
+                    generation = cls.commit_graph.generation(oid)
+                if generation is None:
+                    cls.root_generation += 1
+                    generation = max(commit.generation, cls.root_generation)
+                commit.generation = generation
             cls.commits[oid] = commit
         return commit
 
 
+class CommitGraph(object):
+    """Read generation numbers from git's commit-graph files
+
+    The commit-graph stores the topological level of each commit, which is
+    the same generation number that Commit.parse() computes from the parents
+    of a commit.  The files are memory-mapped and only consulted for the
+    commits whose parents were not read from "git log".
+
+    """
+
+    signature = b'CGPH'
+
+    def __init__(self):
+        self.layers = []
+
+    @classmethod
+    def load(cls, git):
+        """Load the commit-graph of a repository, or return None"""
+        graph = cls()
+        path = git.git_path('objects', 'info', 'commit-graph')
+        if path and core.isfile(path):
+            graph.add_layer(path)
+        else:
+            chain_dir = git.git_path('objects', 'info', 'commit-graphs')
+            chain = chain_dir and os.path.join(chain_dir, 'commit-graph-chain')
+            if chain and core.isfile(chain):
+                try:
+                    hashes = core.read(chain).split()
+                except (IOError, OSError):
+                    hashes = []
+                for graph_hash in hashes:
+                    graph.add_layer(os.path.join(
+                        chain_dir, 'graph-%s.graph' % graph_hash))
+        if not graph.layers:
+            return None
+        return graph
+
+    def add_layer(self, path):
+        """Map a commit-graph file, ignoring unreadable or unknown files"""
+        try:
+            with core.xopen(path, 'rb') as fh:
+                data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return False
+        layer = self._parse(data)
+        if layer is None:
+            data.close()
+            return False
+        self.layers.append(layer)
+        return True
+
+    def _parse(self, data):
+        if len(data) < 8 or data[:4] != self.signature:
+            return None
+        version, hash_version, num_chunks = struct.unpack('>BBB', data[4:7])
+        if version != 1 or hash_version not in (1, 2):
+            return None
+        hash_size = hash_version == 1 and 20 or 32
+        chunks = {}
+        for idx in range(num_chunks):
+            offset = 8 + idx * 12
+            chunk_id = data[offset:offset+4]
+            chunks[chunk_id] = struct.unpack(
+                '>Q', data[offset+4:offset+12])[0]
+        try:
+            fanout_offset = chunks[b'OIDF']
+            lookup_offset = chunks[b'OIDL']
+            commit_data_offset = chunks[b'CDAT']
+        except KeyError:
+            return None
+        fanout = struct.unpack('>256I',
+                               data[fanout_offset:fanout_offset+1024])
+        return (data, hash_size, fanout, lookup_offset, commit_data_offset)
+
+    def generation(self, oid):
+        """Return the topological level of a commit, or None"""
+        try:
+            key = binascii.unhexlify(oid)
+        except (TypeError, ValueError, binascii.Error):
+            return None
+        for layer in self.layers:
+            generation = self._generation(layer, key)
+            if generation is not None:
+                return generation
+        return None
+
+    @staticmethod
+    def _generation(layer, key):
+        data, hash_size, fanout, lookup_offset, commit_data_offset = layer
+        if len(key) != hash_size:
+            return None
+        first = bytearray(key[:1])[0]
+        lo = first and fanout[first - 1] or 0
+        hi = fanout[first]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = lookup_offset + mid * hash_size
+            value = data[offset:offset+hash_size]
+            if value < key:
+                lo = mid + 1
+            elif value > key:
+                hi = mid
+            else:
+                # tree oid, two parent positions, generation and date
+                offset = commit_data_offset + mid * (hash_size + 16)
+                offset += hash_size + 8
+                return struct.unpack('>I', data[offset:offset+4])[0] >> 2
+        return None
+
+    def close(self):
+        for layer in self.layers:
+            layer[0].close()
+        self.layers = []
+
+
 class DAG(Observable):
     ref_updated = 'ref_updated'
     count_updated = 'count_updated'
@@ -109,7 +259,7 @@ class Commit(object):
         self.summary = None
         self.parents = []
         self.children = []
-        self.tags = set()
+        self.tags = ()
         self.email = None
         self.author = None
         self.authdate = None
@@ -121,34 +271,39 @@ class Commit(object):
             self.parse(log_entry)
 
     def parse(self, log_entry, sep=logsep):
-        self.oid = log_entry[:40]
-        after_oid = log_entry[41:]
-        details = after_oid.split(sep, 5)
-        (parents, tags, author, authdate, email, summary) = details
-
-        self.summary = summary and summary or ''
-        self.author = author and author or ''
-        self.authdate = authdate or ''
-        self.email = email and email or ''
+        (oid, parents, tags, author, authdate, email,
+         summary) = log_entry.split(sep, 6)
+        self.oid = oid
+        self.summary = summary
+        # Names and emails repeat across commits so share a single copy
+        self.author = intern(author)
+        self.authdate = authdate
+        self.email = intern(email)
 
         if parents:
-            generation = None
+            generation = 0
+            commits = CommitFactory.commits
             for parent_oid in parents.split(' '):
-                parent = CommitFactory.new(oid=parent_oid)
+                parent = commits.get(parent_oid)
+                if parent is None:
+                    parent = CommitFactory.new(oid=parent_oid)
                 parent.children.append(self)
-                if generation is None:
-                    generation = parent.generation+1
                 self.parents.append(parent)
-                generation = max(parent.generation+1, generation)
+                if parent.generation >= generation:
+                    generation = parent.generation + 1
             self.generation = generation
 
         if tags:
-            for tag in tags[2:-1].split(', '):
-                self.add_label(tag)
+            self.add_decorations(tags)
 
         self.parsed = True
         return self
 
+    def add_decorations(self, decorations):
+        """Add the labels from a `git log --decorate` " (a, b)" string"""
+        for tag in decorations[2:-1].split(', '):
+            self.add_label(tag)
+
     def add_label(self, tag):
         """Add tag/branch labels from `git log --decorate ....`"""
 
@@ -191,6 +346,8 @@ class Commit(object):
         #
         # C.f. http://thread.gmane.org/gmane.linux.kernel/1931234
 
+        if not self.tags:
+            self.tags = set()
         head_arrow = 'HEAD -> '
         if tag.startswith(head_arrow):
             self.tags.add('HEAD')
@@ -224,16 +381,28 @@ class Commit(object):
 
 
 class RepoReader(object):
+    """Read commits from "git log"
 
-    def __init__(self, params, git=git):
+    Records are NUL-terminated so the output is read and split in large
+    chunks rather than one line at a time.  Iterating yields individual
+    commits; batches() yields the commits parsed from each chunk.
+
+    """
+    chunk_size = 64 * 1024
+    cached_batch_size = 4096
+    """Number of records per batch when commits are served from the cache"""
+
+    def __init__(self, params, git=git, cache=None):
         self.params = params
         self.git = git
+        self.cache = cache
         self._proc = None
         self._objects = {}
         self._cmd = ['git', 'log',
                      '--topo-order',
                      '--reverse',
                      '--decorate=full',
+                     '-z',
                      '--pretty='+logfmt]
         self._cached = False
         """Indicates that all data has been read"""
@@ -241,6 +410,18 @@ class RepoReader(object):
         """Index into the cached commits"""
         self._topo_list = []
         """List of commits objects in topological order"""
+        self._buffer = b''
+        """Partial record left over from the previous chunk"""
+        self._pending = collections.deque()
+        """Commits that have been parsed but not yet returned by next()"""
+        self._records = None
+        """Raw records served from the cache instead of git log"""
+        self._offset = 0
+        self._decorations = {}
+        """Current ref labels for the records served from the cache"""
+        self._revisions = None
+        self._saved = None
+        """Raw records read from "git log", kept to be stored in the cache"""
 
     cached = property(lambda self: self._cached)
     """Return True when no commits remain to be read"""
@@ -249,20 +430,25 @@ class RepoReader(object):
         return len(self._topo_list)
 
     def reset(self):
-        CommitFactory.reset()
+        CommitFactory.reset(commit_graph=CommitGraph.load(self.git))
         if self._proc:
             self._topo_list = []
             self._proc.kill()
         self._proc = None
         self._cached = False
+        self._buffer = b''
+        self._pending.clear()
+        self._records = None
+        self._decorations = {}
+        self._saved = None
 
     def __iter__(self):
-        if self._cached:
-            return self
-        self.reset()
         return self
 
     def __next__(self):
+        if self._pending:
+            return self._pending.popleft()
+
         if self._cached:
             try:
                 self._idx += 1
@@ -271,36 +457,915 @@ class RepoReader(object):
                 self._idx = -1
                 raise StopIteration
 
-        if self._proc is None:
-            ref_args = utils.shell_split(self.params.ref)
-            cmd = self._cmd + ['-%d' % self.params.count] + ref_args
-            self._proc = core.start_command(cmd)
-            self._topo_list = []
-
-        log_entry = core.readline(self._proc.stdout).rstrip()
-        if not log_entry:
-            self._cached = True
-            self._proc.wait()
-            self.returncode = self._proc.returncode
-            self._proc = None
-            raise StopIteration
+        while not self._pending:
+            batch = self.read_batch()
+            if batch is None:
+                raise StopIteration
+            self._pending.extend(batch)
 
-        oid = log_entry[:40]
-        try:
-            return self._objects[oid]
-        except KeyError:
-            c = CommitFactory.new(log_entry=log_entry)
-            self._objects[c.oid] = c
-            self._topo_list.append(c)
-            return c
+        return self._pending.popleft()
 
     next = __next__  # python2
 
-    def __iter__(self):
-        return self
+    def batches(self):
+        """Yield lists of commits as they are read"""
+        if self._cached:
+            yield self._topo_list
+            return
+        if self._pending:
+            batch = list(self._pending)
+            self._pending.clear()
+            yield batch
+        while True:
+            batch = self.read_batch()
+            if batch is None:
+                break
+            if batch:
+                yield batch
+
+    def read_batch(self):
+        """Read the next chunk of "git log" output and parse its commits
+
+        Returns None once all commits have been read.
+
+        """
+        if self._proc is None and self._records is None:
+            self._start()
+        if self._records is not None:
+            return self._read_cached_batch()
+
+        data = core.read_chunk(self._proc.stdout, self.chunk_size)
+        if data:
+            records = (self._buffer + data).split(b'\0')
+            self._buffer = records.pop()
+            return self._parse_records(records)
+
+        # The last record is not terminated
+        if self._buffer:
+            records = [self._buffer]
+            self._buffer = b''
+            return self._parse_records(records)
+
+        self._cached = True
+        self._proc.wait()
+        self.returncode = self._proc.returncode
+        self._proc = None
+        if self._saved is not None and self.returncode == 0:
+            self.cache.store(self.params, self._revisions, self._saved)
+        self._saved = None
+        return None
+
+    def _start(self):
+        """Serve the commits from the cache, or start git log"""
+        self._topo_list = []
+        self._buffer = b''
+        self._saved = None
+        ref_args = utils.shell_split(self.params.ref)
+        cache = self.cache
+        if cache is not None:
+            self._revisions = cache.revisions(ref_args or ['HEAD'])
+            if self._revisions is not None:
+                records = cache.lookup(self.params, self._revisions,
+                                       self._cmd)
+                if records is not None:
+                    self._records = records
+                    self._offset = 0
+                    self._decorations = cache.decorations()
+                    return
+                self._saved = []
+        cmd = self._cmd + ['-%d' % self.params.count] + ref_args
+        self._proc = core.start_command(cmd)
+
+    def _read_cached_batch(self):
+        """Parse the next batch of records that were read from the cache"""
+        records = self._records
+        start = self._offset
+        if start < len(records):
+            end = self._offset = start + self.cached_batch_size
+            return self._parse_records(records[start:end])
+        self._cached = True
+        self.returncode = 0
+        self._records = None
+        self._decorations = {}
+        return None
+
+    def _parse_records(self, records):
+        """Create commits for a list of raw log records"""
+        if self._saved is not None:
+            self._saved.extend(records)
+        objects = self._objects
+        topo_list = self._topo_list
+        commits = CommitFactory.commits
+        decorations = self._decorations
+        batch = []
+        for log_entry in _decode_records(records):
+            oid = log_entry[:40]
+            if not oid or oid in objects:
+                continue
+            c = commits.get(oid)
+            if c is None:
+                c = commits[oid] = Commit(oid=oid, log_entry=log_entry)
+            else:
+                # A parent that was seen before its own record
+                if not c.parsed:
+                    c.parse(log_entry)
+                CommitFactory.root_generation = max(
+                    c.generation, CommitFactory.root_generation)
+            if oid in decorations:
+                c.add_decorations(decorations[oid])
+            objects[oid] = c
+            topo_list.append(c)
+            batch.append(c)
+        return batch
 
     def __getitem__(self, oid):
         return self._objects[oid]
 
     def items(self):
         return list(self._objects.items())
+
+
+def _decode_records(records):
+    """Decode a list of records, falling back to per-record detection"""
+    try:
+        return b'\0'.join(records).decode(core.ENCODING).split('\0')
+    except UnicodeDecodeError:
+        return [core.decode(record) for record in records]
+
+
+class DAGCache(object):
+    """Store the records read by RepoReader in $GIT_DIR/cola/dag
+
+    Entries are keyed by the DAG's ref and count.  Each entry remembers the
+    object IDs that the ref resolved to, so it is reused as-is while they do
+    not change.  When the cached tips are ancestors of the current tips only
+    the commits added on top of them are read from "git log".
+
+    Ref labels are stripped from the stored records because refs can move
+    without changing the history.  They are read again for the ref tips when
+    an entry is used.
+
+    """
+    version = 1
+    max_entries = 16
+
+    def __init__(self, git=git):
+        self.git = git
+
+    def path(self, params):
+        """Return the path of the entry for the DAG parameters"""
+        cache_dir = self.git.git_path('cola', 'dag')
+        if not cache_dir:
+            return None
+        key = json.dumps([self.version, params.ref, params.count])
+        digest = hashlib.sha1(core.encode(key)).hexdigest()
+        return os.path.join(cache_dir, digest)
+
+    def revisions(self, ref_args):
+        """Resolve the "git log" arguments into object IDs, or return None"""
+        status, out, _ = self.git.rev_parse(_readonly=True, *ref_args)
+        if status != 0:
+            return None
+        return out.splitlines()
+
+    def decorations(self):
+        """Return the "git log --decorate" labels of the ref tips by oid"""
+        status, out, _ = self.git.log(
+            '--no-walk=unsorted', '--decorate=full', '--all', '-z',
+            pretty='format:%H%x01%d', _readonly=True)
+        result = {}
+        if status != 0:
+            return result
+        for record in out.split('\0'):
+            oid, _, decoration = record.partition(logsep)
+            if decoration:
+                result[oid] = decoration
+        return result
+
+    def load(self, params):
+        """Return the (header, records) of an entry, or (None, None)"""
+        path = self.path(params)
+        if not path or not core.isfile(path):
+            return (None, None)
+        try:
+            with core.xopen(path, 'rb') as fh:
+                data = fh.read()
+            header, _, body = data.partition(b'\n')
+            header = json.loads(header.decode(core.ENCODING))
+        except (IOError, OSError, ValueError):
+            return (None, None)
+        if (not isinstance(header, dict)
+                or header.get('version') != self.version
+                or header.get('ref') != params.ref
+                or header.get('count') != params.count):
+            return (None, None)
+        records = body and body.split(b'\0') or []
+        return (header, records)
+
+    def store(self, params, revisions, records):
+        """Write an entry, ignoring errors"""
+        path = self.path(params)
+        if not path:
+            return
+        header = json.dumps({
+            'version': self.version,
+            'ref': params.ref,
+            'count': params.count,
+            'revisions': revisions,
+        })
+        body = b'\0'.join([_strip_decorations(r) for r in records if r])
+        cache_dir = os.path.dirname(path)
+        tmp_path = path + '.tmp'
+        try:
+            if not core.isdir(cache_dir):
+                core.makedirs(cache_dir)
+            with core.xopen(tmp_path, 'wb') as fh:
+                fh.write(header.encode(core.ENCODING) + b'\n' + body)
+            if core.exists(path):
+                core.unlink(path)
+            os.rename(core.mkpath(tmp_path), core.mkpath(path))
+        except (IOError, OSError):
+            return
+        self.prune(cache_dir)
+
+    def prune(self, cache_dir):
+        """Remove the least recently written entries"""
+        try:
+            paths = [os.path.join(cache_dir, name)
+                     for name in os.listdir(cache_dir)]
+            if len(paths) <= self.max_entries:
+                return
+            paths.sort(key=lambda path: core.stat(path).st_mtime)
+            for path in paths[:-self.max_entries]:
+                core.unlink(path)
+        except (IOError, OSError):
+            pass
+
+    def lookup(self, params, revisions, cmd):
+        """Return the records for the resolved revisions, or None
+
+        `cmd` is the "git log" command used to read the commits that were
+        added on top of the cached tips.
+
+        """
+        header, records = self.load(params)
+        if header is None:
+            return None
+        cached = header.get('revisions')
+        if cached == revisions:
+            return records
+        new_records = self.extend(params, cached, revisions, cmd)
+        if new_records is None:
+            return None
+        records.extend(new_records)
+        if params.count > 0:
+            del records[:-params.count]
+        self.store(params, revisions, records)
+        return records
+
+    def extend(self, params, cached, revisions, cmd):
+        """Read the records of the commits added on top of the cached tips
+
+        Returns None when the entry cannot be extended, e.g. when a branch
+        was rewound or when the arguments contain paths or options.
+
+        """
+        old_tips, old_excluded = _split_revisions(cached or [])
+        tips, excluded = _split_revisions(revisions)
+        if (old_tips is None or tips is None or not old_tips
+                or set(old_excluded) != set(excluded)):
+            return None
+        # Every cached commit must still be part of the history
+        argv = old_tips + ['--not'] + tips
+        status, out, _ = self.git.rev_list(max_count=1, _readonly=True, *argv)
+        if status != 0 or out:
+            return None
+        argv = (cmd + ['-%d' % params.count] + tips + excluded +
+                ['--not'] + old_tips + ['--'])
+        proc = core.start_command(argv)
+        out, _ = core.communicate(proc)
+        if proc.returncode != 0:
+            return None
+        return [_strip_decorations(r) for r in out.split(b'\0') if r]
+
+
+def _split_revisions(revisions):
+    """Split "git rev-parse" output into included and excluded object IDs
+
+    Returns (None, None) when the output contains anything else.
+
+    """
+    if revisions and revisions[-1] == '--':
+        revisions = revisions[:-1]
+    tips = []
+    excluded = []
+    for revision in revisions:
+        if revision.startswith('^') and _is_oid(revision[1:]):
+            excluded.append(revision)
+        elif _is_oid(revision):
+            tips.append(revision)
+        else:
+            return (None, None)
+    return (tips, excluded)
+
+
+def _is_oid(value):
+    return len(value) in (40, 64) and not value.strip('0123456789abcdef')
+
+
+def _strip_decorations(record):
+    """Remove the %d field from a raw log record"""
+    fields = record.split(b'\x01', 3)
+    if len(fields) == 4 and fields[2]:
+        fields[2] = b''
+        record = b'\x01'.join(fields)
+    return record
+
+
+class BandIndex(object):
+    """Index keys by the horizontal bands of the scene that they overlap
+
+    The graph view uses it to find the commits and edges that intersect the
+    viewport without visiting the whole history.  Bands whose contents
+    change are recorded as dirty so that their cached drawing is rebuilt.
+
+    """
+
+    def __init__(self, band_height, offset=0.0):
+        self.band_height = band_height
+        self.offset = offset
+        self.reset()
+
+    def reset(self):
+        self.bands = {}
+        """Band number to set of keys"""
+        self.spans = {}
+        """Key to (first band, last band)"""
+        self.dirty = set()
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __contains__(self, key):
+        return key in self.spans
+
+    def band(self, y):
+        """Return the band number containing the y coordinate"""
+        return int(math.floor((y - self.offset) / self.band_height))
+
+    def band_range(self, top, bottom):
+        """Return the band numbers overlapping [top, bottom]"""
+        return range(self.band(min(top, bottom)),
+                     self.band(max(top, bottom)) + 1)
+
+    def band_top(self, band):
+        """Return the y coordinate where a band starts"""
+        return band * self.band_height + self.offset
+
+    def update(self, key, top, bottom=None):
+        """Register a key over the vertical span [top, bottom]"""
+        if bottom is None:
+            bottom = top
+        first = self.band(min(top, bottom))
+        last = self.band(max(top, bottom))
+        span = self.spans.get(key)
+        if span == (first, last):
+            return
+        if span is not None:
+            self._unregister(key, span)
+        self.spans[key] = (first, last)
+        bands = self.bands
+        for band in range(first, last + 1):
+            try:
+                bands[band].add(key)
+            except KeyError:
+                bands[band] = set([key])
+        self.dirty.update(range(first, last + 1))
+
+    def touch(self, key):
+        """Mark the bands of a key dirty after its contents changed"""
+        span = self.spans.get(key)
+        if span is not None:
+            self.dirty.update(range(span[0], span[1] + 1))
+
+    def remove(self, key):
+        span = self.spans.pop(key, None)
+        if span is not None:
+            self._unregister(key, span)
+
+    def _unregister(self, key, span):
+        bands = self.bands
+        for band in range(span[0], span[1] + 1):
+            keys = bands.get(band)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del bands[band]
+        self.dirty.update(range(span[0], span[1] + 1))
+
+    def keys(self, band):
+        """Return the keys that overlap a band"""
+        return self.bands.get(band, ())
+
+    def query(self, top, bottom):
+        """Return the keys that overlap [top, bottom]"""
+        result = set()
+        bands = self.bands
+        for band in self.band_range(top, bottom):
+            keys = bands.get(band)
+            if keys:
+                result.update(keys)
+        return result
+
+    def take_dirty(self):
+        """Return and forget the dirty bands"""
+        dirty = self.dirty
+        self.dirty = set()
+        return dirty
+
+
+def order_by_generation(commits):
+    """Return commits in generation order, keeping the order of equal ones
+
+    Generation numbers are dense integers, so the commits are distributed
+    into per-generation buckets instead of being compared with each other.
+
+    """
+    if not commits:
+        return []
+    buckets = {}
+    for commit in commits:
+        try:
+            buckets[commit.generation].append(commit)
+        except KeyError:
+            buckets[commit.generation] = [commit]
+    if len(buckets) == 1:
+        return list(commits)
+    low = min(buckets)
+    high = max(buckets)
+    if high - low < 2 * len(commits):
+        generations = range(low, high + 1)
+    else:
+        generations = sorted(buckets)
+    ordered = []
+    for generation in generations:
+        try:
+            ordered.extend(buckets[generation])
+        except KeyError:
+            pass
+    return ordered
+
+
+def merge_by_generation(first, second):
+    """Merge two generation-ordered lists, preferring `first` on ties"""
+    if not first:
+        return list(second)
+    if not second:
+        return list(first)
+    result = []
+    append = result.append
+    idx = 0
+    count = len(second)
+    other = second[0]
+    for commit in first:
+        while idx < count and other.generation < commit.generation:
+            append(other)
+            idx += 1
+            if idx < count:
+                other = second[idx]
+        append(commit)
+    result.extend(second[idx:])
+    return result
+
+
+class GraphLayout(object):
+    """Incremental commit grid layout
+
+    Nodes are aligned by a mesh. Columns and rows are distributed using
+algorithms described below.
+
+    Row assignment algorithm
+
+    The algorithm aims consequent.
+    1. A commit should be above all its parents.
+    2. No commit should be at right side of a commit with a tag in same row.
+This prevents overlapping of tag labels with commits and other labels.
+    3. Commit density should be maximized.
+
+    The algorithm requires that all parents of a commit were assigned column.
+Nodes must be traversed in generation ascend order. This guarantees that all
+parents of a commit were assigned row. So, the algorithm may operate in course
+of column assignment algorithm.
+
+   Row assignment uses frontier. A frontier is a dictionary that contains
+minimum available row index for each column. It propagates during the
+algorithm. Set of cells with tags is also maintained to meet second aim.
+
+    Initialization is performed by reset_rows method. Each new column should
+be declared using declare_column method. Getting row for a cell is implemented
+in alloc_cell method. Frontier must be propagated for any child of fork
+commit which occupies different column. This meets first aim.
+
+    Column assignment algorithm
+
+    The algorithm traverses nodes in generation ascend order. This guarantees
+that a node will be visited after all its parents.
+
+    The set of occupied columns are maintained during work. Initially it is
+empty and no node occupied a column. Empty columns are allocated on demand.
+Free index for column being allocated is searched in following way.
+    1. Start from desired column and look towards graph center (0 column).
+    2. Start from center and look in both directions simultaneously.
+Desired column is defaulted to 0. Fork node should set desired column for
+children equal to its one. This prevents branch from jumping too far from
+its fork.
+
+    Initialization is performed by reset_columns method. Column allocation is
+implemented in alloc_column method. The main loop is in place_node method.
+The method also embeds row assignment algorithm by implementation.
+
+    Actions for each node are follow.
+    1. If the node was not assigned a column then it is assigned empty one.
+    2. Allocate row.
+    3. Allocate columns for children.
+    If a child have a column assigned then it should no be overridden. One of
+children is assigned same column as the node. If the node is a fork then the
+child is chosen in generation descent order. This is a heuristic and it only
+affects resulting appearance of the graph. Other children are assigned empty
+columns in same order. It is the heuristic too.
+    4. If no child occupies column of the node then leave it.
+    It is possible in consequent situations.
+    4.1 The node is a leaf.
+    4.2 The node is a fork and all its children are already assigned side
+column. It is possible if all the children are merges.
+    4.3 Single node child is a merge that is already assigned a column.
+    5. Propagate frontier with respect to this node.
+    Each frontier entry corresponding to column occupied by any node's child
+must be gather than node row index. This meets first aim of the row assignment
+algorithm.
+    Note that frontier of child that occupies same row was propagated during
+step 2. Hence, it must be propagated for children on side columns.
+
+    Incremental layout
+
+    Commits arrive in batches while the history is being read. Only the
+children that were added to the layout are considered, so the placement of a
+node depends only on the nodes that precede it in generation order and on its
+known children. A checkpoint of the grid state is recorded after each batch,
+at regular intervals, and before each leaf, since leaves are the nodes that
+gain children when the next batch arrives. Older checkpoints are thinned out
+exponentially with their distance from the newest one to bound their memory.
+The layout then rolls back to the latest checkpoint that precedes both the
+insertion point of the new nodes and every node that gained a child, and
+replays the nodes from there. A batch that extends the tips of the graph
+therefore only places the new nodes and the former tips, and a full recompute
+is done only when the earliest placement is invalidated.
+
+    """
+
+    checkpoint_interval = 64
+
+    def __init__(self, x_off=-18):
+        # The sign of x_off determines the side on which tags are drawn.
+        self.x_off = x_off
+        self.reset()
+
+    def reset(self):
+        """Forget all nodes and grid state"""
+        self.commits = []
+        """Nodes in generation order"""
+        self.generations = []
+        """Generation numbers parallel to `commits`, used for bisection"""
+        self.known = set()
+        """Object IDs of the nodes added to the layout"""
+        self.checkpoints = []
+        self.pending = {}
+        """Columns assigned to children that were not placed yet"""
+        self.replayed = 0
+        """Number of nodes placed by the latest call to add_commits()"""
+        self.full_recomputes = 0
+        self.reset_columns()
+        self.reset_rows()
+
+    def reset_columns(self):
+        self.columns = {}
+        self.max_column = 0
+        self.min_column = 0
+
+    def reset_rows(self):
+        self.frontier = {}
+        self.tagged_cells = set()
+        self.tagged_log = []
+
+    def add_commits(self, commits):
+        """Add new nodes and return the nodes whose cells were (re)assigned
+
+        The new nodes are merged into the generation-ordered node list, so
+        the layout is never re-sorted.
+
+        """
+        known = self.known
+        new_commits = []
+        affected = None
+        for commit in commits:
+            if commit.oid in known:
+                continue
+            known.add(commit.oid)
+            commit.column = None
+            commit.row = None
+            new_commits.append(commit)
+            generation = commit.generation
+            # Parents that were already placed gain a child, so their
+            # placement decisions have to be replayed.
+            for parent in commit.parents:
+                if parent.oid in known and parent.row is not None:
+                    generation = min(generation, parent.generation)
+            if affected is None or generation < affected:
+                affected = generation
+
+        if not new_commits:
+            self.replayed = 0
+            return []
+
+        start = bisect.bisect_left(self.generations, affected)
+        start = self.restore(start)
+
+        tail = merge_by_generation(self.commits[start:],
+                                   order_by_generation(new_commits))
+        del self.commits[start:]
+        del self.generations[start:]
+        self.commits.extend(tail)
+        self.generations.extend([c.generation for c in tail])
+
+        for position, node in enumerate(tail, start):
+            self.place_node(node, position)
+        self.checkpoint(len(self.commits))
+        self.replayed = len(tail)
+        return tail
+
+    def checkpoint(self, position):
+        """Record the grid state before the node at `position` is placed"""
+        checkpoints = self.checkpoints
+        if checkpoints and checkpoints[-1][0] == position:
+            # Replaying from a restored checkpoint records it again
+            checkpoints.pop()
+        checkpoints.append((position,
+                            dict(self.columns),
+                            self.max_column,
+                            self.min_column,
+                            dict(self.frontier),
+                            len(self.tagged_log),
+                            dict(self.pending)))
+        if position % self.checkpoint_interval == 0:
+            self.thin_checkpoints(position)
+
+    def thin_checkpoints(self, position):
+        """Drop checkpoints that are spaced closer than their age requires
+
+        Checkpoints within one interval of `position` are all kept. Older
+        checkpoints are kept only at multiples of the interval doubled once
+        for each doubling of their distance from `position`, so a rollback
+        replays at most twice the nodes it has to while the number of
+        checkpoints grows logarithmically with the number of nodes.
+
+        """
+        interval = self.checkpoint_interval
+        kept = []
+        for checkpoint in self.checkpoints:
+            distance = position - checkpoint[0]
+            if distance >= interval:
+                level = (distance // interval).bit_length() - 1
+                if checkpoint[0] % (interval << level):
+                    continue
+            kept.append(checkpoint)
+        self.checkpoints = kept
+
+    def restore(self, position):
+        """Roll back to the latest checkpoint at or before `position`
+
+        Returns the position of the restored checkpoint.
+
+        """
+        checkpoints = self.checkpoints
+        while checkpoints and checkpoints[-1][0] > position:
+            checkpoints.pop()
+
+        if checkpoints:
+            (start, columns, max_column, min_column,
+             frontier, tagged_count, pending) = checkpoints[-1]
+        else:
+            start = 0
+            columns = {}
+            max_column = min_column = 0
+            frontier = {}
+            tagged_count = 0
+            pending = {}
+            if self.commits:
+                self.full_recomputes += 1
+
+        for node in self.commits[start:]:
+            node.column = None
+            node.row = None
+
+        self.columns = dict(columns)
+        self.max_column = max_column
+        self.min_column = min_column
+        self.frontier = dict(frontier)
+
+        tagged_cells = self.tagged_cells
+        for cell in self.tagged_log[tagged_count:]:
+            tagged_cells.discard(cell)
+        del self.tagged_log[tagged_count:]
+
+        self.pending = dict(pending)
+        for node, column in pending.items():
+            node.column = column
+
+        return start
+
+    def children(self, node):
+        """Return the children of a node that were added to the layout"""
+        known = self.known
+        return [child for child in node.children if child.oid in known]
+
+    def assign_column(self, node, column):
+        node.column = column
+        self.pending[node] = column
+
+    def place_node(self, node, position):
+        children = self.children(node)
+        if not children or position % self.checkpoint_interval == 0:
+            # Leaves are the nodes most likely to gain children in the next
+            # batch so keep a checkpoint that allows replaying from them.
+            self.checkpoint(position)
+
+        self.pending.pop(node, None)
+        if node.column is None:
+            # Node is either root or its parent is not in items. The last
+            # happens when tree loading is in progress. Allocate new
+            # columns for such nodes.
+            node.column = self.alloc_column()
+
+        node.row = self.alloc_cell(node.column, node.tags)
+
+        # Allocate columns for children which are still without one. Also
+        # propagate frontier for children.
+        if len(children) > 1:
+            sorted_children = sorted(children,
+                                     key=lambda c: c.generation,
+                                     reverse=True)
+            citer = iter(sorted_children)
+            for child in citer:
+                if child.column is None:
+                    # Top most child occupies column of parent.
+                    self.assign_column(child, node.column)
+                    # Note that frontier is propagated in course of
+                    # alloc_cell.
+                    break
+                else:
+                    self.propagate_frontier(child.column, node.row + 1)
+            else:
+                # No child occupies same column.
+                self.leave_column(node.column)
+                # Note that the loop below will pass no iteration.
+
+            # Rest children are allocated new column.
+            for child in citer:
+                if child.column is None:
+                    self.assign_column(child, self.alloc_column(node.column))
+                self.propagate_frontier(child.column, node.row + 1)
+        elif children:
+            child = children[0]
+            if child.column is None:
+                self.assign_column(child, node.column)
+                # Note that frontier is propagated in course of alloc_cell.
+            elif child.column != node.column:
+                # Child node have other parents and occupies column of one
+                # of them.
+                self.leave_column(node.column)
+                # But frontier must be propagated with respect to this
+                # parent.
+                self.propagate_frontier(child.column, node.row + 1)
+        else:
+            # This is a leaf node.
+            self.leave_column(node.column)
+
+    def declare_column(self, column):
+        if self.frontier:
+            # Align new column frontier by frontier of nearest column. If all
+            # columns were left then select maximum frontier value.
+            if not self.columns:
+                self.frontier[column] = max(list(self.frontier.values()))
+                return
+            # This is heuristic that mostly affects roots. Note that the
+            # frontier values for fork children will be overridden in course of
+            # propagate_frontier.
+            for offset in itertools.count(1):
+                for c in [column + offset, column - offset]:
+                    if c not in self.columns:
+                        # Column 'c' is not occupied.
+                        continue
+                    try:
+                        frontier = self.frontier[c]
+                    except KeyError:
+                        # Column 'c' was never allocated.
+                        continue
+
+                    frontier -= 1
+                    # The frontier of the column may be higher because of
+                    # tag overlapping prevention performed for previous head.
+                    try:
+                        if self.frontier[column] >= frontier:
+                            break
+                    except KeyError:
+                        pass
+
+                    self.frontier[column] = frontier
+                    break
+                else:
+                    continue
+                break
+        else:
+            # First commit must be assigned 0 row.
+            self.frontier[column] = 0
+
+    def alloc_column(self, column=0):
+        columns = self.columns
+        # First, look for free column by moving from desired column to graph
+        # center (column 0).
+        for c in range(column, 0, -1 if column > 0 else 1):
+            if c not in columns:
+                if c > self.max_column:
+                    self.max_column = c
+                elif c < self.min_column:
+                    self.min_column = c
+                break
+        else:
+            # If no free column was found between graph center and desired
+            # column then look for free one by moving from center along both
+            # directions simultaneously.
+            for c in itertools.count(0):
+                if c not in columns:
+                    if c > self.max_column:
+                        self.max_column = c
+                    break
+                c = -c
+                if c not in columns:
+                    if c < self.min_column:
+                        self.min_column = c
+                    break
+        self.declare_column(c)
+        columns[c] = 1
+        return c
+
+    def alloc_cell(self, column, tags):
+        # Get empty cell from frontier.
+        cell_row = self.frontier[column]
+
+        if tags:
+            # Prevent overlapping of tag with cells already allocated a row.
+            if self.x_off > 0:
+                can_overlap = list(range(column + 1, self.max_column + 1))
+            else:
+                can_overlap = list(range(column - 1, self.min_column - 1, -1))
+            for c in can_overlap:
+                frontier = self.frontier[c]
+                if frontier > cell_row:
+                    cell_row = frontier
+
+        # Avoid overlapping with tags of commits at cell_row.
+        if self.x_off > 0:
+            can_overlap = list(range(self.min_column, column))
+        else:
+            can_overlap = list(range(self.max_column, column, -1))
+        for cell_row in itertools.count(cell_row):
+            for c in can_overlap:
+                if (c, cell_row) in self.tagged_cells:
+                    # Overlapping. Try next row.
+                    break
+            else:
+                # No overlapping was found.
+                break
+            # Note that all checks should be made for new cell_row value.
+
+        if tags:
+            cell = (column, cell_row)
+            self.tagged_cells.add(cell)
+            self.tagged_log.append(cell)
+
+        # Propagate frontier.
+        self.frontier[column] = cell_row + 1
+        return cell_row
+
+    def propagate_frontier(self, column, value):
+        current = self.frontier[column]
+        if current < value:
+            self.frontier[column] = value
+
+    def leave_column(self, column):
+        count = self.columns[column]
+        if count == 1:
+            del self.columns[column]
+        else:
+            self.columns[column] = count - 1
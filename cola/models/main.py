@@ -3,12 +3,17 @@
 """
 from __future__ import division, absolute_import, unicode_literals
 
+import functools
 import os
+import threading
+import time
 
 from .. import core
+from .. import diffparse
 from .. import git
 from .. import gitcmds
 from .. import gitcfg
+from .. import utils
 from ..compat import ustr
 from ..decorators import memoize
 from ..git import STDOUT
@@ -79,12 +84,16 @@ class MainModel(Observable):
         self.lfs = False
         self.head = 'HEAD'
         self.diff_text = ''
+        self._parsed_diff = None
         self.diff_type = 'text'  # text, image
         self.mode = self.mode_none
         self.filename = None
         self.is_merging = False
         self.is_rebasing = False
         self.currentbranch = ''
+        self.upstream = None  # upstream of the current branch
+        self.ahead = None  # commits ahead of and behind the upstream
+        self.behind = None
         self.directory = ''
         self.project = ''
         self.remotes = []
@@ -107,6 +116,8 @@ class MainModel(Observable):
         self.local_branches = []
         self.remote_branches = []
         self.tags = []
+        self.refresher = StatusRefresher(self)
+        self.diff_loader = DiffLoader()
         if cwd:
             self.set_worktree(cwd)
 
@@ -158,11 +169,24 @@ class MainModel(Observable):
             pass
         return path
 
-    def set_diff_text(self, txt):
-        """Update the text displayed in the diff editor"""
+    def set_diff_text(self, txt, parsed_diff=None):
+        """Update the text displayed in the diff editor
+
+        parsed_diff is the diffparse.ParsedDiff for txt, when it is known.
+
+        """
         self.diff_text = txt
+        self._parsed_diff = parsed_diff
         self.notify_observers(self.message_diff_text_changed, txt)
 
+    def parsed_diff(self):
+        """Return the ParsedDiff for diff_text, parsing it on first use"""
+        parsed_diff = self._parsed_diff
+        if parsed_diff is None or parsed_diff.text is not self.diff_text:
+            parsed_diff = self._parsed_diff = diffparse.ParsedDiff(
+                self.diff_text)
+        return parsed_diff
+
     def set_diff_type(self, diff_type):  # text, image
         """Set the diff type to either text or image"""
         self.diff_type = diff_type
@@ -210,28 +234,93 @@ class MainModel(Observable):
         self.update_files(update_index=update_index, emit=True)
 
     def update_status(self, update_index=False):
+        """Query the repository and update the model in-place"""
+        # A background refresh that is in flight is now out of date
+        self.refresher.cancel()
+        self.apply_status(self.gather_status(update_index=update_index))
+
+    def gather_status(self, update_index=False):
+        """Query the repository status without modifying the model
+
+        The independent queries are run in parallel.  The result is
+        applied to the model by apply_status(), which lets the queries
+        run on a background thread.
+
+        """
+        stages = {
+            'merge_rebase': self._query_merge_rebase_status,
+            'files': functools.partial(self._query_files_and_branch,
+                                       update_index=update_index),
+            'remotes': self._query_remotes,
+            'refs': self._query_branches_and_tags,
+            'merge_msg': self._query_merge_message,
+        }
+        return run_parallel(stages)
+
+    def apply_status(self, status):
+        """Apply the result of gather_status() to the model"""
         # Give observers a chance to respond
         self.emit_about_to_update()
         self.initialized = True
-        self._update_merge_rebase_status()
-        self._update_files(update_index=update_index)
-        self._update_remotes()
-        self._update_branches_and_tags()
-        self._update_branch_heads()
-        self._update_commitmsg()
+        self._set_merge_rebase_status(status['merge_rebase'])
+        state, currentbranch = status['files']
+        self._set_files(state)
+        self.remotes = status['remotes']
+        self._set_branches_and_tags(status['refs'])
+        self.currentbranch = currentbranch
+        self._set_commitmsg(status['merge_msg'])
+        self.emit_updated()
+
+    def gather_path_status(self, paths):
+        """Query the status of specific paths without modifying the model"""
+        return gitcmds.paths_state(paths, head=self.head,
+                                   display_untracked=prefs.display_untracked())
+
+    def apply_path_status(self, paths, state):
+        """Replace the status of paths with the gather_path_status() result"""
+        self.emit_about_to_update()
+        self._set_files(_update_state(self._files_state(), paths, state))
         self.emit_updated()
 
+    def _files_state(self):
+        return {
+            'staged': self.staged,
+            'modified': self.modified,
+            'unmerged': self.unmerged,
+            'untracked': self.untracked,
+            'upstream_changed': self.upstream_changed,
+            'staged_deleted': self.staged_deleted,
+            'unstaged_deleted': self.unstaged_deleted,
+            'submodules': self.submodules,
+            'upstream': self.upstream,
+            'ahead': self.ahead,
+            'behind': self.behind,
+        }
+
     def update_files(self, update_index=False, emit=False):
+        # A background refresh that is in flight is now out of date
+        self.refresher.cancel()
         self._update_files(update_index=update_index)
         if emit:
             self.emit_updated()
 
     def _update_files(self, update_index=False):
+        self._set_files(self._query_files(update_index=update_index))
+
+    def _query_files(self, update_index=False):
         display_untracked = prefs.display_untracked()
-        state = gitcmds.worktree_state(head=self.head,
-                                       update_index=update_index,
-                                       display_untracked=display_untracked,
-                                       paths=self.filter_paths)
+        return gitcmds.worktree_state(head=self.head,
+                                      update_index=update_index,
+                                      display_untracked=display_untracked,
+                                      paths=self.filter_paths)
+
+    def _query_files_and_branch(self, update_index=False):
+        # The current branch is read after the status so that the
+        # branch cached by "git status" is reused.
+        state = self._query_files(update_index=update_index)
+        return (state, gitcmds.current_branch())
+
+    def _set_files(self, state):
         self.staged = state.get('staged', [])
         self.modified = state.get('modified', [])
         self.unmerged = state.get('unmerged', [])
@@ -240,6 +329,9 @@ class MainModel(Observable):
         self.staged_deleted = state.get('staged_deleted', set())
         self.unstaged_deleted = state.get('unstaged_deleted', set())
         self.submodules = state.get('submodules', set())
+        self.upstream = state.get('upstream', None)
+        self.ahead = state.get('ahead', None)
+        self.behind = state.get('behind', None)
 
         selection = self.selection
         if self.is_empty():
@@ -257,38 +349,55 @@ class MainModel(Observable):
         return not self.local_branches
 
     def _update_remotes(self):
-        self.remotes = self.git.remote()[STDOUT].splitlines()
+        self.remotes = self._query_remotes()
+
+    def _query_remotes(self):
+        return self.git.remote(_readonly=True)[STDOUT].splitlines()
 
     def _update_branch_heads(self):
         # Set these early since they are used to calculate 'upstream_changed'.
         self.currentbranch = gitcmds.current_branch()
 
     def _update_branches_and_tags(self):
-        local_branches, remote_branches, tags = gitcmds.all_refs(split=True)
+        self._set_branches_and_tags(self._query_branches_and_tags())
+
+    def _query_branches_and_tags(self):
+        return gitcmds.all_refs(split=True)
+
+    def _set_branches_and_tags(self, refs):
+        local_branches, remote_branches, tags = refs
         self.local_branches = local_branches
         self.remote_branches = remote_branches
         self.tags = tags
 
-    def _update_merge_rebase_status(self):
+    def _query_merge_rebase_status(self):
         merge_head = self.git.git_path('MERGE_HEAD')
         rebase_merge = self.git.git_path('rebase-merge')
-        self.is_merging = merge_head and core.exists(merge_head)
-        self.is_rebasing = rebase_merge and core.exists(rebase_merge)
+        is_merging = merge_head and core.exists(merge_head)
+        is_rebasing = rebase_merge and core.exists(rebase_merge)
+        return (is_merging, is_rebasing)
+
+    def _set_merge_rebase_status(self, status):
+        self.is_merging, self.is_rebasing = status
         if self.is_merging and self.mode == self.mode_amend:
             self.set_mode(self.mode_none)
 
-    def _update_commitmsg(self):
-        """Check for merge message files and update the commit message
+    def _query_merge_message(self):
+        """Return the contents of the merge message file, if any"""
+        merge_msg_path = gitcmds.merge_message_path()
+        if merge_msg_path:
+            return core.read(merge_msg_path)
+        return None
+
+    def _set_commitmsg(self, msg):
+        """Update the commit message from the merge message file
 
         The message is cleared when the merge completes
 
         """
         if self.amending():
             return
-        # Check if there's a message file in .git/
-        merge_msg_path = gitcmds.merge_message_path()
-        if merge_msg_path:
-            msg = core.read(merge_msg_path)
+        if msg is not None:
             if msg != self._auto_commitmsg:
                 self._auto_commitmsg = msg
                 self._prev_commitmsg = self.commitmsg
@@ -439,3 +548,290 @@ def refspec_arg(local_branch, remote_branch, pull, push):
 def run_remote_action(action, remote, **kwargs):
     args, kwargs = remote_args(remote, **kwargs)
     return action(*args, **kwargs)
+
+
+def _moving_average(average, value, weight=0.3):
+    if not average:
+        return value
+    return average + (value - average) * weight
+
+
+class StatusRefresher(object):
+    """Coalesce status refreshes and apply their results to the model
+
+    At most one gather_status() call runs at a time.  Refreshes that are
+    requested while another is in flight are coalesced: the running
+    query's result is applied and a single follow-up refresh is started
+    once it finishes, no matter how many requests arrived.
+
+    refresh_paths() requests a refresh of specific paths, e.g. the files
+    reported by the filesystem monitor.  Their status is queried with
+    pathspecs and patched into the model instead of scanning the whole
+    worktree.  Pending paths are merged, and a full refresh replaces them.
+
+    Refreshes are synchronous until a runner is installed with
+    set_runner().  The average time taken by full and path refreshes is
+    kept so that the filesystem monitor can pace its notifications.
+
+    """
+
+    # Larger path refreshes scan the whole worktree instead
+    max_paths = 1000
+
+    def __init__(self, model):
+        self.model = model
+        self.runner = None
+        self.running = False
+        self.pending = False
+        self.cancelled = False
+        self.update_index = False
+        self.full = False
+        self.paths = set()
+        # Counters for tracing and tests
+        self.requested = 0
+        self.started = 0
+        self.applied = 0
+        self.discarded = 0
+        # Moving averages of the seconds taken by full and path refreshes
+        self.full_seconds = 0.0
+        self.paths_seconds = 0.0
+        self._start_time = 0.0
+
+    def set_runner(self, runner):
+        """Install a runner for background refreshes
+
+        runner(fn, callback) must call fn() on a background thread
+        and callback(result) on the thread that owns the model.
+
+        """
+        self.runner = runner
+
+    def refresh(self, update_index=False):
+        """Request a status refresh"""
+        self.requested += 1
+        self.update_index = self.update_index or update_index
+        self.full = True
+        self.paths = set()
+        self._request()
+
+    def refresh_paths(self, paths):
+        """Request a status refresh of specific paths"""
+        if self.full:
+            self.requested += 1
+            self._request()
+            return
+        self.paths.update(paths)
+        if self.model.filter_paths or len(self.paths) > self.max_paths:
+            self.refresh()
+            return
+        self.requested += 1
+        self._request()
+
+    def cancel(self):
+        """Discard the result of the refresh that is in flight"""
+        if self.running:
+            self.cancelled = True
+
+    def _request(self):
+        if self.running:
+            self.pending = True
+            return
+        self._start()
+
+    def _start(self):
+        update_index = self.update_index
+        paths = self.paths
+        full = self.full or not paths
+        self.update_index = False
+        self.full = False
+        self.paths = set()
+        self.pending = False
+        self.cancelled = False
+        self.running = True
+        self.started += 1
+        self._start_time = time.time()
+        if full:
+            paths = None
+            gather = functools.partial(self._gather, update_index)
+        else:
+            gather = functools.partial(self._gather_paths, paths)
+        finish = functools.partial(self._finish, paths)
+        if self.runner is None:
+            finish(gather())
+        else:
+            self.runner(gather, finish)
+
+    def _gather(self, update_index):
+        try:
+            return (self.model.gather_status(update_index=update_index), None)
+        except Exception as e:  # pylint: disable=broad-except
+            return (None, e)
+
+    def _gather_paths(self, paths):
+        try:
+            return (self.model.gather_path_status(paths), None)
+        except Exception as e:  # pylint: disable=broad-except
+            return (None, e)
+
+    def _finish(self, paths, result):
+        status, error = result
+        self.running = False
+        seconds = time.time() - self._start_time
+        if paths is None:
+            self.full_seconds = _moving_average(self.full_seconds, seconds)
+        else:
+            self.paths_seconds = _moving_average(self.paths_seconds, seconds)
+        # The result is applied even when a newer refresh is pending.
+        # It is newer than the model's status, and discarding it would
+        # never update the model while requests keep arriving.
+        pending = self.pending
+        cancelled = self.cancelled
+        if cancelled:
+            self.discarded += 1
+        elif error is None:
+            self.applied += 1
+            if paths is None:
+                self.model.apply_status(status)
+            else:
+                self.model.apply_path_status(paths, status)
+        if pending:
+            # Files that changed while this refresh ran
+            self._start()
+        if error is not None and not cancelled:
+            raise error
+
+
+class DiffLoader(object):
+    """Compute diffs in the background and apply only the latest one
+
+    At most one diff is computed at a time.  A request that arrives while
+    another is running replaces any request that has not started yet, so
+    moving quickly through many files only computes the first and the
+    last diff.  The results of superseded and cancelled requests are
+    discarded.
+
+    Diffs are computed synchronously until a runner is installed with
+    set_runner().
+
+    """
+
+    def __init__(self):
+        self.runner = None
+        self.running = False
+        self.pending = None
+        self.generation = 0
+        # Counters for tracing and tests
+        self.requested = 0
+        self.started = 0
+        self.applied = 0
+        self.discarded = 0
+
+    def set_runner(self, runner):
+        """Install a runner for background diffs, see StatusRefresher"""
+        self.runner = runner
+
+    def load(self, fn, callback):
+        """Call fn() in the background and pass its result to callback()"""
+        self.requested += 1
+        self.generation += 1
+        request = (self.generation, fn, callback)
+        if self.running:
+            self.pending = request
+            return
+        self._start(request)
+
+    def cancel(self):
+        """Discard the results of the running and pending requests"""
+        self.generation += 1
+        self.pending = None
+
+    def _start(self, request):
+        self.running = True
+        self.started += 1
+        run = functools.partial(self._run, request[1])
+        finish = functools.partial(self._finish, request)
+        if self.runner is None:
+            finish(run())
+        else:
+            self.runner(run, finish)
+
+    def _run(self, fn):
+        try:
+            return (fn(), None)
+        except Exception as e:  # pylint: disable=broad-except
+            return (None, e)
+
+    def _finish(self, request, result):
+        self.running = False
+        pending = self.pending
+        self.pending = None
+        generation, _, callback = request
+        value, error = result
+        if generation != self.generation:
+            self.discarded += 1
+        elif error is not None:
+            raise error
+        else:
+            self.applied += 1
+            callback(value)
+        if pending is not None and pending[0] == self.generation:
+            self._start(pending)
+
+
+def _update_state(state, paths, path_state):
+    """Return a worktree_state() dict with the entries for paths replaced
+
+    A directory in paths replaces the entries for every path below it,
+    e.g. when a directory was removed.
+
+    """
+    paths = set(paths)
+
+    def replaced(path):
+        while path:
+            if path in paths:
+                return True
+            path = utils.dirname(path)
+        return False
+
+    result = dict(state)
+    for key in ('staged', 'modified', 'unmerged', 'untracked'):
+        new = path_state.get(key, [])
+        old = state.get(key, [])
+        kept = [path for path in old if not replaced(path)]
+        if not new and len(kept) == len(old):
+            continue
+        result[key] = sorted(set(kept).union(new))
+    for key in ('staged_deleted', 'unstaged_deleted', 'submodules'):
+        old = state.get(key, set())
+        result[key] = (set(path for path in old if not replaced(path))
+                       .union(path_state.get(key, ())))
+    return result
+
+
+def run_parallel(stages):
+    """Call each function in the "stages" dict in its own thread
+
+    Returns a dict mapping each key to the value returned by its function.
+    The first exception raised by a stage is re-raised.
+
+    """
+    results = {}
+    errors = []
+
+    def run(key, fn):
+        try:
+            results[key] = fn()
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(key, fn))
+               for key, fn in stages.items()]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
@@ -20,6 +20,7 @@ EDITOR = 'gui.editor'
 FONTDIFF = 'cola.fontdiff'
 HISTORY_BROWSER = 'gui.historybrowser'
 LINEBREAK = 'cola.linebreak'
+MAXDIFFSIZE = 'cola.maxdiffsize'
 MAXRECENT = 'cola.maxrecent'
 MERGE_DIFFSTAT = 'merge.diffstat'
 MERGE_KEEPBACKUP = 'merge.keepbackup'
@@ -103,6 +104,10 @@ def linebreak():
     return gitcfg.current().get(LINEBREAK, default=True)
 
 
+def maxdiffsize():
+    return gitcfg.current().get(MAXDIFFSIZE, default=8 * 1024 * 1024)
+
+
 def maxrecent():
     return gitcfg.current().get(MAXRECENT, default=8)
 
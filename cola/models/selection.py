@@ -49,22 +49,24 @@ def pick(s):
 
 def union(s):
     """Return the union of all selected items in a sorted list"""
-    return list(sorted(set(s.staged + s.unmerged + s.modified + s.untracked)))
+    return sorted(set().union(s.staged, s.unmerged, s.modified, s.untracked))
 
 
 def _filter(a, b):
+    """Return the items of "a" that are in "b" while preserving order"""
+    if not a:
+        return a
     b_set = set(b)
-    a_copy = list(a)
-    last = len(a_copy) - 1
-    for idx, i in enumerate(reversed(a)):
-        if i not in b_set:
-            a.pop(last - idx)
+    return [i for i in a if i in b_set]
 
 
 class SelectionModel(Observable):
     """Provides information about selected file paths."""
     # Notification message sent out when selection changes
     message_selection_changed = 'selection_changed'
+    # Sent with (added, removed) States of frozensets when the selected
+    # paths change.  The delta is only computed when there are observers.
+    message_selection_delta = 'selection_delta'
 
     # These properties wrap the individual selection items
     # to provide higher-level pseudo-selections.
@@ -77,30 +79,63 @@ class SelectionModel(Observable):
         self.unmerged = []
         self.modified = []
         self.untracked = []
+        self._sets = None
 
     def reset(self):
-        self.staged = []
-        self.unmerged = []
-        self.modified = []
-        self.untracked = []
+        self._set_state([], [], [], [])
+
+    def _set_state(self, staged, unmerged, modified, untracked):
+        self.staged = staged
+        self.unmerged = unmerged
+        self.modified = modified
+        self.untracked = untracked
+        self._sets = None
 
     def is_empty(self):
         return not(bool(self.staged or self.unmerged or
                         self.modified or self.untracked))
 
+    def sets(self):
+        """Return a State of frozensets for constant-time membership tests"""
+        sets = self._sets
+        if sets is None:
+            sets = self._sets = State(
+                frozenset(self.staged), frozenset(self.unmerged),
+                frozenset(self.modified), frozenset(self.untracked))
+        return sets
+
+    def is_selected(self, path):
+        """Is the path selected in any category?"""
+        return any(path in paths for paths in self.sets())
+
     def set_selection(self, s):
         """Set the new selection."""
-        self.staged = s.staged
-        self.unmerged = s.unmerged
-        self.modified = s.modified
-        self.untracked = s.untracked
-        self.notify_observers(self.message_selection_changed)
+        old = self._delta_base()
+        self._set_state(s.staged, s.unmerged, s.modified, s.untracked)
+        self._notify(old)
 
     def update(self, other):
-        _filter(self.staged, other.staged)
-        _filter(self.unmerged, other.unmerged)
-        _filter(self.modified, other.modified)
-        _filter(self.untracked, other.untracked)
+        """Deselect the paths that are no longer in the other model"""
+        old = self._delta_base()
+        self._set_state(_filter(self.staged, other.staged),
+                        _filter(self.unmerged, other.unmerged),
+                        _filter(self.modified, other.modified),
+                        _filter(self.untracked, other.untracked))
+        self._notify(old)
+
+    def _delta_base(self):
+        if self.observers.get(self.message_selection_delta):
+            return self.sets()
+        return None
+
+    def _notify(self, old):
+        if old is not None:
+            new = self.sets()
+            added = State(*[n - o for n, o in zip(new, old)])
+            removed = State(*[o - n for n, o in zip(new, old)])
+            if any(added) or any(removed):
+                self.notify_observers(self.message_selection_delta,
+                                      added, removed)
         self.notify_observers(self.message_selection_changed)
 
     def selection(self):
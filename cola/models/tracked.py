@@ -0,0 +1,121 @@
+"""Provides a shared index of the files tracked by git"""
+from __future__ import division, absolute_import, unicode_literals
+import bisect
+import fnmatch
+import re
+import threading
+
+from .. import core
+from .. import git
+from .. import utils
+from ..decorators import memoize
+from ..git import STDOUT
+
+
+@memoize
+def current():
+    """Return the TrackedFiles singleton"""
+    return TrackedFiles(git.current())
+
+
+class TrackedFiles(object):
+    """The sorted list of tracked files, shared by every consumer
+
+    "git ls-files" is only run again when $GIT_DIR/index changes.  The
+    lists are replaced, never modified, so callers can hold onto them.
+
+    """
+
+    def __init__(self, git):
+        self.git = git
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._paths = []
+        self._dirs = None
+
+    def invalidate(self):
+        """Read the tracked files again on the next query"""
+        with self._lock:
+            self._stamp = None
+
+    def _update(self):
+        with self._lock:
+            path = self.git.git_path('index')
+            stamp = None
+            if path:
+                # The path changes when another repository is opened
+                stamp = (path, core.stat_stamp(path))
+            if stamp is not None and stamp == self._stamp:
+                return self._paths
+            out = self.git.ls_files('--', z=True)[STDOUT]
+            if out:
+                paths = sorted(out[:-1].split('\0'))
+            else:
+                paths = []
+            self._paths = paths
+            self._dirs = None
+            self._stamp = stamp
+            return paths
+
+    def paths(self):
+        """Return the sorted list of tracked files"""
+        return self._update()
+
+    def directories(self):
+        """Return the set of directories that contain tracked files"""
+        paths = self._update()
+        with self._lock:
+            dirs = self._dirs
+            if dirs is None or dirs[0] is not paths:
+                files = set(paths)
+                dirs = self._dirs = (
+                    paths, utils.add_parents(files).difference(files))
+            return dirs[1]
+
+    def contains(self, path):
+        """Return True if path is a tracked file"""
+        paths = self._update()
+        idx = bisect.bisect_left(paths, path)
+        return idx < len(paths) and paths[idx] == path
+
+    def select(self, paths):
+        """Return the paths that are tracked files or contain tracked files
+
+        Untracked and ignored entries are dropped, e.g. before walking the
+        history of a directory listing.
+
+        """
+        dirs = self.directories()
+        return [path for path in paths
+                if path in dirs or self.contains(path)]
+
+    def startswith(self, prefix):
+        """Return the sorted tracked files that start with prefix"""
+        paths = self._update()
+        start = bisect.bisect_left(paths, prefix)
+        end = start
+        count = len(paths)
+        while end < count and paths[end].startswith(prefix):
+            end += 1
+        return paths[start:end]
+
+    def listdir(self, path):
+        """Return the sorted files and directories directly below path"""
+        prefix = path and (path.rstrip('/') + '/') or ''
+        offset = len(prefix)
+        return sorted(set(child[offset:].split('/', 1)[0]
+                          for child in self.startswith(prefix)))
+
+    def match(self, patterns):
+        """Return the sorted tracked files that match any glob pattern
+
+        Patterns follow ls-files' pathspec globbing, where "*" also
+        matches "/".
+
+        """
+        paths = self._update()
+        if not patterns:
+            return paths
+        regex = re.compile('|'.join(fnmatch.translate(pattern)
+                                    for pattern in patterns))
+        return [path for path in paths if regex.match(path)]
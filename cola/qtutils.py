@@ -301,13 +301,47 @@ class TreeWidgetItem(QtWidgets.QTreeWidgetItem):
         QtWidgets.QTreeWidgetItem.__init__(self)
         self.path = path
         self.deleted = deleted
-        self.setIcon(0, icons.from_name(icon))
+        if icon is not None:
+            self.setIcon(0, icons.from_name(icon))
         self.setText(0, path)
 
     def type(self):
         return self.TYPE
 
 
+class StatusTreeWidgetItem(TreeWidgetItem):
+    """A status widget item that looks up its icon when it is painted
+
+    Guessing the mimetype of every path is deferred until the item is
+    visible.
+
+    """
+
+    def __init__(self, path, staged=False, deleted=False, untracked=False):
+        TreeWidgetItem.__init__(self, path, None, deleted)
+        self.staged = staged
+        self.untracked = untracked
+        self._icon = None
+
+    def set_deleted(self, deleted):
+        """Update the deleted state and its icon"""
+        if deleted != self.deleted:
+            self.deleted = deleted
+            self._icon = None
+            self.emitDataChanged()
+
+    def data(self, column, role):
+        if column == 0 and role == Qt.DecorationRole:
+            icon = self._icon
+            if icon is None:
+                icon_name = icons.status(self.path, self.deleted,
+                                         self.staged, self.untracked)
+                icon = self._icon = icons.from_name(
+                    icons.name_from_basename(icon_name))
+            return icon
+        return TreeWidgetItem.data(self, column, role)
+
+
 def paths_from_indexes(model, indexes,
                        item_type=TreeWidgetItem.TYPE,
                        item_filter=None):
@@ -330,29 +364,6 @@ def paths_from_items(items,
             if i.type() == item_type and item_filter(i)]
 
 
-def tree_selection(tree_item, items):
-    """Returns an array of model items that correspond to the selected
-    QTreeWidgetItem children"""
-    selected = []
-    count = min(tree_item.childCount(), len(items))
-    for idx in range(count):
-        if tree_item.child(idx).isSelected():
-            selected.append(items[idx])
-
-    return selected
-
-
-def tree_selection_items(tree_item):
-    """Returns selected widget items"""
-    selected = []
-    for idx in range(tree_item.childCount()):
-        child = tree_item.child(idx)
-        if child.isSelected():
-            selected.append(child)
-
-    return selected
-
-
 def selected_item(list_widget, items):
     """Returns the model item that corresponds to the selected QListWidget
     row."""
@@ -512,9 +523,8 @@ def create_treeitem(filename, staged=False, deleted=False, untracked=False):
     "staged", "deleted, and "untracked" control which icon is used.
 
     """
-    icon_name = icons.status(filename, deleted, staged, untracked)
-    return TreeWidgetItem(filename, icons.name_from_basename(icon_name),
-                          deleted=deleted)
+    return StatusTreeWidgetItem(filename, staged=staged, deleted=deleted,
+                                untracked=untracked)
 
 
 def add_close_action(widget):
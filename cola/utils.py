@@ -43,7 +43,8 @@ def add_parents(paths):
         all_paths.add(path)
         if '/' in path:
             parent_dir = dirname(path)
-            while parent_dir:
+            # The parents of paths that were already added are present
+            while parent_dir and parent_dir not in all_paths:
                 all_paths.add(parent_dir)
                 parent_dir = dirname(parent_dir)
     return all_paths
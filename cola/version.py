@@ -35,6 +35,12 @@ _versions = {
     # new: git cat-file --filters --path=<path> SHA1
     # old: git cat-file --filters blob SHA1:<path>
     'cat-file-filters-path': '2.11.0',
+    # git status --porcelain=v2 was introduced in 2.11.0
+    'status-porcelain-v2': '2.11.0',
+    # git config --show-scope was introduced in 2.26.0
+    'config-show-scope': '2.26.0',
+    # git add and git reset --pathspec-from-file were available in 2.26.0
+    'pathspec-from-file': '2.26.0',
 }
 
 
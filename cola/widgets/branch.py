@@ -332,14 +332,21 @@ class BranchesTreeWidget(standard.TreeWidget):
             if self.current_branch is not None and tracked_branch is not None:
                 status = {'ahead': 0, 'behind': 0}
                 status_str = ''
+                model = self.main_model
 
-                origin = tracked_branch + '..' + self.current_branch
-                log = self.git_helper.log(origin)
-                status['ahead'] = len(log[1].splitlines())
+                if (model.upstream == tracked_branch and
+                        model.ahead is not None):
+                    # "git status" already reported the ahead/behind counts
+                    status['ahead'] = model.ahead
+                    status['behind'] = model.behind
+                else:
+                    origin = tracked_branch + '..' + self.current_branch
+                    log = self.git_helper.log(origin)
+                    status['ahead'] = len(log[1].splitlines())
 
-                origin = self.current_branch + '..' + tracked_branch
-                log = self.git_helper.log(origin)
-                status['behind'] = len(log[1].splitlines())
+                    origin = self.current_branch + '..' + tracked_branch
+                    log = self.git_helper.log(origin)
+                    status['behind'] = len(log[1].splitlines())
 
                 if status['ahead'] > 0:
                     status_str += '%s%s' % (unichr(0x2191), status['ahead'])
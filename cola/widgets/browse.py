@@ -18,6 +18,7 @@ from ..models import browse
 from ..models import main
 from .. import cmds
 from .. import core
+from .. import fsmonitor
 from .. import gitcmds
 from .. import hotkeys
 from .. import icons
@@ -208,6 +209,7 @@ class RepoTreeView(standard.TreeView):
         # Remember open folders so that we can restore them when refreshing
         item = self.name_item_from_index(index)
         self.saved_open_folders.add(item.path)
+        fsmonitor.current().set_open_dirs(self.saved_open_folders)
         self.size_columns()
 
         # update information about a directory as it is expanded
@@ -215,19 +217,17 @@ class RepoTreeView(standard.TreeView):
             return
         path = item.path
 
+        # populate() also updates the entries inside of the directory
         model = self.model()
         model.populate(item)
         model.update_entry(path)
 
-        for row in range(item.rowCount()):
-            path = item.child(row, 0).path
-            model.update_entry(path)
-
         item.cached = True
 
     def index_collapsed(self, index):
         item = self.name_item_from_index(index)
         self.saved_open_folders.remove(item.path)
+        fsmonitor.current().set_open_dirs(self.saved_open_folders)
 
     def refresh(self):
         self.model().refresh()
@@ -395,11 +395,11 @@ class RepoTreeView(standard.TreeView):
         state = State(staged, unmerged, modified, untracked)
 
         paths = self.selected_paths()
-        model = main.model()
-        model_staged = utils.add_parents(model.staged)
-        model_modified = utils.add_parents(model.modified)
-        model_unmerged = utils.add_parents(model.unmerged)
-        model_untracked = utils.add_parents(model.untracked)
+        index = self.model().status_index()
+        model_staged = index.staged
+        model_modified = index.modified
+        model_unmerged = index.unmerged
+        model_untracked = index.untracked
 
         for path in paths:
             if path in model_unmerged:
@@ -452,35 +452,31 @@ class RepoTreeView(standard.TreeView):
         """Return selected staged paths."""
         if selection is None:
             selection = self.selected_paths()
-        staged = utils.add_parents(main.model().staged)
+        staged = self.model().status_index().staged
         return [p for p in selection if p in staged]
 
     def selected_modified_paths(self, selection=None):
         """Return selected modified paths."""
         if selection is None:
             selection = self.selected_paths()
-        model = main.model()
-        modified = utils.add_parents(model.modified)
+        modified = self.model().status_index().modified
         return [p for p in selection if p in modified]
 
     def selected_unstaged_paths(self, selection=None):
         """Return selected unstaged paths."""
         if selection is None:
             selection = self.selected_paths()
-        model = main.model()
-        modified = utils.add_parents(model.modified)
-        untracked = utils.add_parents(model.untracked)
-        unstaged = modified.union(untracked)
+        index = self.model().status_index()
+        unstaged = index.modified.union(index.untracked)
         return [p for p in selection if p in unstaged]
 
     def selected_tracked_paths(self, selection=None):
         """Return selected tracked paths."""
         if selection is None:
             selection = self.selected_paths()
-        model = main.model()
         staged = set(self.selected_staged_paths(selection=selection))
         modified = set(self.selected_modified_paths(selection=selection))
-        untracked = utils.add_parents(model.untracked)
+        untracked = self.model().status_index().untracked
         tracked = staged.union(modified)
         return [p for p in selection
                 if p not in untracked or p in tracked]
@@ -13,6 +13,8 @@ from .. import icons
 from .. import qtutils
 from .. import utils
 from ..models import main
+from ..models import tracked
+from ..models.completion import CompletionIndexCache
 from . import defs
 from . import text
 
@@ -388,6 +390,9 @@ class CompletionModel(QtGui.QStandardItemModel):
     items_gathered = Signal(object)
     model_updated = Signal()
 
+    # Only the best-ranked matches are displayed
+    max_matches = 1000
+
     def __init__(self, parent):
         QtGui.QStandardItemModel.__init__(self, parent)
         self.match_text = ''
@@ -451,44 +456,6 @@ class CompletionModel(QtGui.QStandardItemModel):
         self.update_thread.dispose()
 
 
-def _identity(x):
-    return x
-
-
-def _lower(x):
-    return x.lower()
-
-
-def filter_matches(match_text, candidates, case_sensitive,
-                   sort_key=lambda x: x):
-    """Filter candidates and return the matches"""
-
-    if case_sensitive:
-        case_transform = _identity
-    else:
-        case_transform = _lower
-
-    if match_text:
-        match_text = case_transform(match_text)
-        matches = [r for r in candidates if match_text in case_transform(r)]
-    else:
-        matches = list(candidates)
-
-    matches.sort(key=lambda x: sort_key(case_transform(x)))
-    return matches
-
-
-def filter_path_matches(match_text, file_list, case_sensitive):
-    """Return matching completions from a list of candidate files"""
-
-    files = set(file_list)
-    files_and_dirs = utils.add_parents(files)
-    dirs = files_and_dirs.difference(files)
-
-    paths = filter_matches(match_text, files_and_dirs, case_sensitive)
-    return (paths, dirs)
-
-
 class Completer(QtWidgets.QCompleter):
 
     def __init__(self, model, parent):
@@ -517,12 +484,26 @@ class GitCompletionModel(CompletionModel):
         self.main_model = model = main.model()
         msg = model.message_updated
         model.add_observer(msg, self.emit_model_updated)
+        self._ref_index = CompletionIndexCache(sort_key=ref_sort_key)
+        self._path_index = CompletionIndexCache(parents=True)
 
     def gather_matches(self, case_sensitive):
-        refs = filter_matches(self.match_text, self.matches(), case_sensitive,
-                              sort_key=ref_sort_key)
+        refs = self.filter_refs(self.matches(), case_sensitive)
         return (refs, (), set())
 
+    def filter_refs(self, refs, case_sensitive):
+        """Return the best matching refs"""
+        index = self._ref_index.index(refs)
+        return index.matches(self.match_text, case_sensitive,
+                             limit=self.max_matches)
+
+    def filter_paths(self, paths, case_sensitive):
+        """Return the best matching paths and the set of directories"""
+        index = self._path_index.index(paths)
+        matches = index.matches(self.match_text, case_sensitive,
+                                limit=self.max_matches)
+        return (matches, index.dirs)
+
     def emit_model_updated(self):
         try:
             self.model_updated.emit()
@@ -623,9 +604,8 @@ class GitPathCompletionModel(GitCompletionModel):
         return []
 
     def gather_matches(self, case_sensitive):
-        paths, dirs = filter_path_matches(self.match_text,
-                                          self.candidate_paths(),
-                                          case_sensitive)
+        paths, dirs = self.filter_paths(self.candidate_paths(),
+                                        case_sensitive)
         return ((), paths, dirs)
 
 
@@ -650,15 +630,14 @@ class GitTrackedCompletionModel(GitPathCompletionModel):
         self._paths = []
 
     def gather_paths(self):
-        self._paths = gitcmds.tracked_files()
+        self._paths = tracked.current().paths()
 
     def gather_matches(self, case_sensitive):
         if not self._paths:
             self.gather_paths()
 
         refs = []
-        paths, dirs = filter_path_matches(self.match_text, self._paths,
-                                          case_sensitive)
+        paths, dirs = self.filter_paths(self._paths, case_sensitive)
         return (refs, paths, dirs)
 
 
@@ -671,15 +650,13 @@ class GitLogCompletionModel(GitRefCompletionModel):
         self._paths = []
 
     def gather_paths(self):
-        self._paths = gitcmds.tracked_files()
+        self._paths = tracked.current().paths()
 
     def gather_matches(self, case_sensitive):
         if not self._paths:
             self.gather_paths()
-        refs = filter_matches(self.match_text, self.matches(), case_sensitive,
-                              sort_key=ref_sort_key)
-        paths, dirs = filter_path_matches(self.match_text, self._paths,
-                                          case_sensitive)
+        refs = self.filter_refs(self.matches(), case_sensitive)
+        paths, dirs = self.filter_paths(self._paths, case_sensitive)
         has_doubledash = (self.match_text == '--' or
                           self.full_text.startswith('-- ') or
                           ' -- ' in self.full_text)
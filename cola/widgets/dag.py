@@ -1,6 +1,5 @@
 from __future__ import division, absolute_import, unicode_literals
 import collections
-import itertools
 import math
 import re
 
@@ -814,11 +813,10 @@ class ReaderThread(QtCore.QThread):
         self._condition = QtCore.QWaitCondition()
 
     def run(self):
-        repo = dag.RepoReader(self.params)
+        repo = dag.RepoReader(self.params, cache=dag.DAGCache())
         repo.reset()
         self.begin.emit()
-        commits = []
-        for c in repo:
+        for commits in repo.batches():
             self._mutex.lock()
             if self._stop:
                 self._condition.wait(self._mutex)
@@ -826,14 +824,9 @@ class ReaderThread(QtCore.QThread):
             if self._abort:
                 repo.reset()
                 return
-            commits.append(c)
-            if len(commits) >= 512:
-                self.add.emit(commits)
-                commits = []
+            self.add.emit(commits)
 
         self.status.emit(repo.returncode == 0)
-        if commits:
-            self.add.emit(commits)
         self.end.emit()
 
     def start(self):
@@ -870,84 +863,41 @@ class Cache(object):
         return font
 
 
-class Edge(QtWidgets.QGraphicsItem):
-    item_type = QtWidgets.QGraphicsItem.UserType + 1
+class Edge(object):
+    """A link between a parent commit and its child
 
-    def __init__(self, source, dest):
+    Edges are not scene items.  The graph view draws them band by band
+    into cached paths so that the number of scene items does not depend
+    on the size of the history.
 
-        QtWidgets.QGraphicsItem.__init__(self)
+    """
+    __slots__ = ('source', 'dest', 'color')
 
-        self.setAcceptedMouseButtons(Qt.NoButton)
+    def __init__(self, source, dest, color):
         self.source = source
         self.dest = dest
-        self.commit = source.commit
-        self.setZValue(-2)
-
-        self.recompute_bound()
-        self.path_valid = False
-
-        # Choose a new color for new branch edges
-        if self.source.x() < self.dest.x():
-            color = EdgeColor.cycle()
-            line = Qt.SolidLine
-        elif self.source.x() != self.dest.x():
-            color = EdgeColor.current()
-            line = Qt.SolidLine
-        else:
-            color = EdgeColor.current()
-            line = Qt.SolidLine
-
-        self.pen = QtGui.QPen(color, 4.0, line, Qt.SquareCap, Qt.RoundJoin)
-
-    def recompute_bound(self):
-        dest_pt = Commit.item_bbox.center()
-
-        self.source_pt = self.mapFromItem(self.source, dest_pt)
-        self.dest_pt = self.mapFromItem(self.dest, dest_pt)
-        self.line = QtCore.QLineF(self.source_pt, self.dest_pt)
-
-        width = self.dest_pt.x() - self.source_pt.x()
-        height = self.dest_pt.y() - self.source_pt.y()
-        rect = QtCore.QRectF(self.source_pt, QtCore.QSizeF(width, height))
-        self.bound = rect.normalized()
-
-    def commits_were_invalidated(self):
-        self.recompute_bound()
-        self.prepareGeometryChange()
-        # The path should not be recomputed immediately because just small part
-        # of DAG is actually shown at same time. It will be recomputed on
-        # demand in course of 'paint' method.
-        self.path_valid = False
-        # Hence, just queue redrawing.
-        self.update()
+        self.color = color
 
-    # Qt overrides
-    def type(self):
-        return self.item_type
-
-    def boundingRect(self):
-        return self.bound
-
-    def recompute_path(self):
+    @staticmethod
+    def add_path(path, source_x, source_y, dest_x, dest_y):
+        """Add the path from (source_x, source_y) to (dest_x, dest_y)"""
         QRectF = QtCore.QRectF
         QPointF = QtCore.QPointF
 
         arc_rect = 10
         connector_length = 5
 
-        path = QtGui.QPainterPath()
-
-        if self.source.x() == self.dest.x():
-            path.moveTo(self.source.x(), self.source.y())
-            path.lineTo(self.dest.x(), self.dest.y())
+        if source_x == dest_x:
+            path.moveTo(source_x, source_y)
+            path.lineTo(dest_x, dest_y)
         else:
             # Define points starting from source
-            point1 = QPointF(self.source.x(), self.source.y())
+            point1 = QPointF(source_x, source_y)
             point2 = QPointF(point1.x(), point1.y() - connector_length)
             point3 = QPointF(point2.x() + arc_rect, point2.y() - arc_rect)
 
             # Define points starting from dest
-            point4 = QPointF(self.dest.x(), self.dest.y())
+            point4 = QPointF(dest_x, dest_y)
             point5 = QPointF(point4.x(), point3.y() - arc_rect)
             point6 = QPointF(point5.x() - arc_rect, point5.y() + arc_rect)
 
@@ -958,11 +908,11 @@ class Edge(QtWidgets.QGraphicsItem):
 
             # If the dest is at the left of the source, then we
             # need to reverse some values
-            if self.source.x() > self.dest.x():
+            if source_x > dest_x:
                 point5 = QPointF(point4.x(), point4.y() + connector_length)
                 point6 = QPointF(point5.x() + arc_rect, point5.y() + arc_rect)
-                point3 = QPointF(self.source.x() - arc_rect, point6.y())
-                point2 = QPointF(self.source.x(), point3.y() + arc_rect)
+                point3 = QPointF(source_x - arc_rect, point6.y())
+                point2 = QPointF(source_x, point3.y() + arc_rect)
 
                 span_angle_arc1 = 90
 
@@ -975,15 +925,6 @@ class Edge(QtWidgets.QGraphicsItem):
                        start_angle_arc2, span_angle_arc2)
             path.lineTo(point4)
 
-        self.path = path
-        self.path_valid = True
-
-    def paint(self, painter, option, widget):
-        if not self.path_valid:
-            self.recompute_path()
-        painter.setPen(self.pen)
-        painter.drawPath(self.path)
-
 
 class EdgeColor(object):
     """An edge color factory"""
@@ -1064,30 +1005,41 @@ class Commit(QtWidgets.QGraphicsItem):
 
         QtWidgets.QGraphicsItem.__init__(self)
 
-        self.commit = commit
         self.notifier = notifier
+        self.label = None
+        self.xpos = xpos
+        self.cached_commit_color = cached_commit_color
+        self.cached_merge_color = cached_merge_color
 
         self.setZValue(0)
         self.setFlag(selectable)
         self.setCursor(cursor)
+
+        self.pressed = False
+        self.dragged = False
+
+        self.set_commit(commit)
+
+    def set_commit(self, commit):
+        """Display a commit; items are recycled as the view scrolls"""
+        self.commit = commit
         self.setToolTip(commit.oid[:12] + ': ' + commit.summary)
 
         if commit.tags:
-            self.label = label = Label(commit)
-            label.setParentItem(self)
-            label.setPos(xpos + 1, -self.commit_radius/2.0)
-        else:
-            self.label = None
+            if self.label is None:
+                self.label = label = Label(commit)
+                label.setParentItem(self)
+                label.setPos(self.xpos + 1, -self.commit_radius/2.0)
+            else:
+                self.label.set_commit(commit)
+                self.label.show()
+        elif self.label is not None:
+            self.label.hide()
 
         if len(commit.parents) > 1:
-            self.brush = cached_merge_color
+            self.brush = self.cached_merge_color
         else:
-            self.brush = cached_commit_color
-
-        self.pressed = False
-        self.dragged = False
-
-        self.edges = {}
+            self.brush = self.cached_commit_color
 
     def blockSignals(self, blocked):
         self.notifier.notification_enabled = not blocked
@@ -1188,6 +1140,10 @@ class Label(QtWidgets.QGraphicsItem):
         self.setZValue(-1)
         self.commit = commit
 
+    def set_commit(self, commit):
+        self.prepareGeometryChange()
+        self.commit = commit
+
     def type(self):
         return self.item_type
 
@@ -1276,6 +1232,15 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
     x_off = -18
     y_off = -24
 
+    # Rows per band of the scene.  Edges and, when zoomed out, commits are
+    # drawn one band at a time from cached paths.
+    band_rows = 32
+    # Commits are drawn as part of the bands below this scale instead of
+    # being materialized as items.
+    lod_scale = 0.35
+    # Room for labels to the right of a commit
+    label_width = 300
+
     def __init__(self, notifier, parent):
         QtWidgets.QGraphicsView.__init__(self, parent)
         ViewerMixin.__init__(self)
@@ -1288,12 +1253,30 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
         self.menu_actions = None
         self.notifier = notifier
         self.commits = []
+        self.commit_map = {}
+        """All commits by oid"""
         self.items = {}
+        """Commit items that are currently materialized in the scene"""
+        self.item_pool = []
+        """Commit items that are ready to be recycled"""
+        self.edges = {}
+        """Edges keyed by (parent oid, child oid)"""
+        self.tiles = {}
+        """Cached drawing of each band"""
+        self.band_homes = {}
+        """Bands whose edge paths cross each band"""
+        self.max_row = 0
+        self.drawn_low_detail = False
+        band_height = self.band_rows * abs(self.y_off)
+        band_offset = abs(self.y_off) / 2.0
+        self.node_index = dag.BandIndex(band_height, offset=band_offset)
+        self.edge_index = dag.BandIndex(band_height, offset=band_offset)
         self.saved_matrix = self.transform()
 
         self.x_start = 24
         self.x_min = 24
         self.x_offsets = collections.defaultdict(lambda: self.x_min)
+        self.layout = dag.GraphLayout(x_off=self.x_off)
 
         self.is_panning = False
         self.pressed = False
@@ -1306,9 +1289,13 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
         scene.setItemIndexMethod(QtWidgets.QGraphicsScene.NoIndex)
         self.setScene(scene)
 
+        self.visible_timer = QtCore.QTimer(self)
+        self.visible_timer.setSingleShot(True)
+        self.visible_timer.setInterval(0)
+        self.visible_timer.timeout.connect(self.update_visible_items)
+
         self.setRenderHint(QtGui.QPainter.Antialiasing)
         self.setViewportUpdateMode(self.BoundingRectViewportUpdate)
-        self.setCacheMode(QtWidgets.QGraphicsView.CacheBackground)
         self.setTransformationAnchor(QtWidgets.QGraphicsView.AnchorUnderMouse)
         self.setResizeAnchor(QtWidgets.QGraphicsView.NoAnchor)
         self.setBackgroundBrush(QtGui.QColor(Qt.white))
@@ -1338,12 +1325,23 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
 
     def clear(self):
         EdgeColor.reset()
-        self.scene().clear()
+        scene = self.scene()
+        scene.clear()
+        scene.setSceneRect(QtCore.QRectF())
         self.selection_list = []
         self.items.clear()
+        self.item_pool = []
+        self.commit_map.clear()
+        self.edges.clear()
+        self.tiles.clear()
+        self.band_homes.clear()
+        self.node_index.reset()
+        self.edge_index.reset()
+        self.max_row = 0
         self.x_offsets.clear()
         self.x_min = 24
         self.commits = []
+        self.layout.reset()
 
     # ViewerMixin interface
     def selected_items(self):
@@ -1365,9 +1363,8 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
         """Select the item for the oids"""
         self.scene().clearSelection()
         for oid in oids:
-            try:
-                item = self.items[oid]
-            except KeyError:
+            item = self.item_for(oid)
+            if item is None:
                 continue
             item.blockSignals(True)
             item.setSelected(True)
@@ -1385,10 +1382,7 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
                     criteria_fn(generation, commit.generation)):
                 oid = commit.oid
                 generation = commit.generation
-        try:
-            return self.items[oid]
-        except KeyError:
-            return None
+        return self.item_for(oid)
 
     def oldest_item(self, commits):
         """Return the item for the commit with the oldest generation number"""
@@ -1402,7 +1396,7 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
         items = self.selected_items()
         if not items:
             return
-        selected_commits = self.sort_by_generation([n.commit for n in items])
+        selected_commits = dag.order_by_generation([n.commit for n in items])
         oids = [c.oid for c in selected_commits]
         all_oids = [c.oid for c in self.commits]
         cmds.do(cmds.FormatPatch, oids, all_oids)
@@ -1465,10 +1459,9 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
 
     def set_initial_view(self):
         self_commits = self.commits
-        self_items = self.items
 
         commits = self_commits[-7:]
-        items = [self_items[c.oid] for c in commits]
+        items = [self.item_for(c.oid) for c in commits]
 
         selected = self.selected_items()
         if selected:
@@ -1484,7 +1477,7 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
 
     def fit_view_to_items(self, items):
         if not items:
-            rect = self.scene().itemsBoundingRect()
+            rect = self.scene().sceneRect()
         else:
             x_min = y_min = maxsize
             x_max = y_max = -maxsize
@@ -1515,6 +1508,7 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
 
         self.fitInView(rect, Qt.KeepAspectRatio)
         self.scene().invalidate()
+        self.schedule_visible_update()
 
     def save_selection(self, event):
         if event.button() != Qt.LeftButton:
@@ -1564,6 +1558,7 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
 
         self.setTransformationAnchor(QtWidgets.QGraphicsView.NoAnchor)
         self.setTransform(matrix)
+        self.schedule_visible_update()
 
     def wheel_zoom(self, event):
         """Handle mouse wheel zooming."""
@@ -1578,6 +1573,7 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
         self.setTransformationAnchor(QtWidgets.QGraphicsView.AnchorUnderMouse)
         self.zoom = zoom
         self.scale(zoom, zoom)
+        self.schedule_visible_update()
 
     def wheel_pan(self, event):
         """Handle mouse wheel panning."""
@@ -1588,6 +1584,7 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
         matrix = self.transform().translate(tx * factor, ty * factor)
         self.setTransformationAnchor(QtWidgets.QGraphicsView.NoAnchor)
         self.setTransform(matrix)
+        self.schedule_visible_update()
 
     def scale_view(self, scale):
         factor = (self.transform()
@@ -1622,358 +1619,295 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
             range_ = max_ - min_
             value = min_ + int(float(range_) * scrolloffset)
             scrollbar.setValue(value)
+        self.schedule_visible_update()
 
     def add_commits(self, commits):
         """Traverse commits and add them to the view."""
         self.commits.extend(commits)
-        scene = self.scene()
+        commit_map = self.commit_map
         for commit in commits:
-            item = Commit(commit, self.notifier)
-            self.items[commit.oid] = item
-            for ref in commit.tags:
-                self.items[ref] = item
-            scene.addItem(item)
+            commit_map[commit.oid] = commit
 
-        self.layout_commits()
+        self.layout_commits(commits)
         self.link(commits)
+        self.update_scene_rect()
+        self.invalidate_tiles()
+        self.schedule_visible_update()
 
     def link(self, commits):
         """Create edges linking commits with their parents"""
-        scene = self.scene()
+        commit_map = self.commit_map
+        edges = self.edges
+        edge_index = self.edge_index
+        node_pos = self.node_pos
         for commit in commits:
-            try:
-                commit_item = self.items[commit.oid]
-            except KeyError:
-                # TODO - Handle truncated history viewing
-                continue
+            x, y = node_pos(commit)
             for parent in reversed(commit.parents):
-                try:
-                    parent_item = self.items[parent.oid]
-                except KeyError:
+                if parent.oid not in commit_map:
                     # TODO - Handle truncated history viewing
                     continue
-                try:
-                    edge = parent_item.edges[commit.oid]
-                except KeyError:
-                    edge = Edge(parent_item, commit_item)
-                else:
+                key = (parent.oid, commit.oid)
+                if key in edges:
                     continue
-                parent_item.edges[commit.oid] = edge
-                commit_item.edges[parent.oid] = edge
-                scene.addItem(edge)
+                # Choose a new color for new branch edges
+                parent_x, parent_y = node_pos(parent)
+                if parent_x < x:
+                    color = EdgeColor.cycle()
+                else:
+                    color = EdgeColor.current()
+                edges[key] = Edge(parent, commit, QtGui.QColor(color))
+                edge_index.update(key, parent_y, y)
 
-    def layout_commits(self):
-        positions = self.position_nodes()
+    def layout_commits(self, commits):
+        positions = self.position_nodes(commits)
 
-        # Each edge is accounted in two commits. Hence, accumulate invalid
-        # edges to prevent double edge invalidation.
-        invalid_edges = set()
+        items = self.items
+        node_index = self.node_index
+        edge_index = self.edge_index
+        edges = self.edges
+        # Each edge is accounted in two commits. Hence, accumulate moved
+        # edges to prevent updating an edge twice.
+        moved_edges = set()
 
         for oid, (x, y) in positions.items():
-            item = self.items[oid]
-
-            pos = item.pos()
-            if pos != (x, y):
-                item.setPos(x, y)
-
-                for edge in item.edges.values():
-                    invalid_edges.add(edge)
-
-        for edge in invalid_edges:
-            edge.commits_were_invalidated()
-
-    """Commit node layout technique
-
-    Nodes are aligned by a mesh. Columns and rows are distributed using
-algorithms described below.
-
-    Row assignment algorithm
-
-    The algorithm aims consequent.
-    1. A commit should be above all its parents.
-    2. No commit should be at right side of a commit with a tag in same row.
-This prevents overlapping of tag labels with commits and other labels.
-    3. Commit density should be maximized.
-
-    The algorithm requires that all parents of a commit were assigned column.
-Nodes must be traversed in generation ascend order. This guarantees that all
-parents of a commit were assigned row. So, the algorithm may operate in course
-of column assignment algorithm.
-
-   Row assignment uses frontier. A frontier is a dictionary that contains
-minimum available row index for each column. It propagates during the
-algorithm. Set of cells with tags is also maintained to meet second aim.
-
-    Initialization is performed by reset_rows method. Each new column should
-be declared using declare_column method. Getting row for a cell is implemented
-in alloc_cell method. Frontier must be propagated for any child of fork
-commit which occupies different column. This meets first aim.
-
-    Column assignment algorithm
-
-    The algorithm traverses nodes in generation ascend order. This guarantees
-that a node will be visited after all its parents.
-
-    The set of occupied columns are maintained during work. Initially it is
-empty and no node occupied a column. Empty columns are allocated on demand.
-Free index for column being allocated is searched in following way.
-    1. Start from desired column and look towards graph center (0 column).
-    2. Start from center and look in both directions simultaneously.
-Desired column is defaulted to 0. Fork node should set desired column for
-children equal to its one. This prevents branch from jumping too far from
-its fork.
-
-    Initialization is performed by reset_columns method. Column allocation is
-implemented in alloc_column method. Initialization and main loop are in
-recompute_grid method. The method also embeds row assignment algorithm by
-implementation.
-
-    Actions for each node are follow.
-    1. If the node was not assigned a column then it is assigned empty one.
-    2. Allocate row.
-    3. Allocate columns for children.
-    If a child have a column assigned then it should no be overridden. One of
-children is assigned same column as the node. If the node is a fork then the
-child is chosen in generation descent order. This is a heuristic and it only
-affects resulting appearance of the graph. Other children are assigned empty
-columns in same order. It is the heuristic too.
-    4. If no child occupies column of the node then leave it.
-    It is possible in consequent situations.
-    4.1 The node is a leaf.
-    4.2 The node is a fork and all its children are already assigned side
-column. It is possible if all the children are merges.
-    4.3 Single node child is a merge that is already assigned a column.
-    5. Propagate frontier with respect to this node.
-    Each frontier entry corresponding to column occupied by any node's child
-must be gather than node row index. This meets first aim of the row assignment
-algorithm.
-    Note that frontier of child that occupies same row was propagated during
-step 2. Hence, it must be propagated for children on side columns.
-
-    """
-
-    def reset_columns(self):
-        # Some children of displayed commits might not be accounted in
-        # 'commits' list. It is common case during loading of big graph.
-        # But, they are assigned a column that must be reseted. Hence, use
-        # depth-first traversal to reset all columns assigned.
-        for node in self.commits:
-            if node.column is None:
-                continue
-            stack = [node]
-            while stack:
-                node = stack.pop()
-                node.column = None
-                for child in node.children:
-                    if child.column is not None:
-                        stack.append(child)
-
-        self.columns = {}
-        self.max_column = 0
-        self.min_column = 0
-
-    def reset_rows(self):
-        self.frontier = {}
-        self.tagged_cells = set()
-
-    def declare_column(self, column):
-        if self.frontier:
-            # Align new column frontier by frontier of nearest column. If all
-            # columns were left then select maximum frontier value.
-            if not self.columns:
-                self.frontier[column] = max(list(self.frontier.values()))
-                return
-            # This is heuristic that mostly affects roots. Note that the
-            # frontier values for fork children will be overridden in course of
-            # propagate_frontier.
-            for offset in itertools.count(1):
-                for c in [column + offset, column - offset]:
-                    if c not in self.columns:
-                        # Column 'c' is not occupied.
-                        continue
-                    try:
-                        frontier = self.frontier[c]
-                    except KeyError:
-                        # Column 'c' was never allocated.
-                        continue
-
-                    frontier -= 1
-                    # The frontier of the column may be higher because of
-                    # tag overlapping prevention performed for previous head.
-                    try:
-                        if self.frontier[column] >= frontier:
-                            break
-                    except KeyError:
-                        pass
-
-                    self.frontier[column] = frontier
-                    break
-                else:
-                    continue
-                break
-        else:
-            # First commit must be assigned 0 row.
-            self.frontier[column] = 0
-
-    def alloc_column(self, column = 0):
-        columns = self.columns
-        # First, look for free column by moving from desired column to graph
-        # center (column 0).
-        for c in range(column, 0, -1 if column > 0 else 1):
-            if c not in columns:
-                if c > self.max_column:
-                    self.max_column = c
-                elif c < self.min_column:
-                    self.min_column = c
-                break
-        else:
-            # If no free column was found between graph center and desired
-            # column then look for free one by moving from center along both
-            # directions simultaneously.
-            for c in itertools.count(0):
-                if c not in columns:
-                    if c > self.max_column:
-                        self.max_column = c
-                    break
-                c = -c
-                if c not in columns:
-                    if c < self.min_column:
-                        self.min_column = c
-                    break
-        self.declare_column(c)
-        columns[c] = 1
-        return c
-
-    def alloc_cell(self, column, tags):
-        # Get empty cell from frontier.
-        cell_row = self.frontier[column]
-
-        if tags:
-            # Prevent overlapping of tag with cells already allocated a row.
-            if self.x_off > 0:
-                can_overlap = list(range(column + 1, self.max_column + 1))
-            else:
-                can_overlap = list(range(column - 1, self.min_column - 1, -1))
-            for c in can_overlap:
-                frontier = self.frontier[c]
-                if frontier > cell_row:
-                    cell_row = frontier
-
-        # Avoid overlapping with tags of commits at cell_row.
-        if self.x_off > 0:
-            can_overlap = list(range(self.min_column, column))
-        else:
-            can_overlap = list(range(self.max_column, column, -1))
-        for cell_row in itertools.count(cell_row):
-            for c in can_overlap:
-                if (c, cell_row) in self.tagged_cells:
-                    # Overlapping. Try next row.
-                    break
-            else:
-                # No overlapping was found.
-                break
-            # Note that all checks should be made for new cell_row value.
-
-        if tags:
-            self.tagged_cells.add((column, cell_row))
-
-        # Propagate frontier.
-        self.frontier[column] = cell_row + 1
-        return cell_row
-
-    def propagate_frontier(self, column, value):
-        current = self.frontier[column]
-        if current < value:
-            self.frontier[column] = value
-
-    def leave_column(self, column):
-        count = self.columns[column]
-        if count == 1:
-            del self.columns[column]
-        else:
-            self.columns[column] = count - 1
-
-    def recompute_grid(self):
-        self.reset_columns()
-        self.reset_rows()
-
-        for node in self.sort_by_generation(list(self.commits)):
-            if node.column is None:
-                # Node is either root or its parent is not in items. The last
-                # happens when tree loading is in progress. Allocate new
-                # columns for such nodes.
-                node.column = self.alloc_column()
-
-            node.row = self.alloc_cell(node.column, node.tags)
-
-            # Allocate columns for children which are still without one. Also
-            # propagate frontier for children.
-            if node.is_fork():
-                sorted_children = sorted(node.children,
-                                         key=lambda c: c.generation,
-                                         reverse=True)
-                citer = iter(sorted_children)
-                for child in citer:
-                    if child.column is None:
-                        # Top most child occupies column of parent.
-                        child.column = node.column
-                        # Note that frontier is propagated in course of
-                        # alloc_cell.
-                        break
-                    else:
-                        self.propagate_frontier(child.column, node.row + 1)
-                else:
-                    # No child occupies same column.
-                    self.leave_column(node.column)
-                    # Note that the loop below will pass no iteration.
-
-                # Rest children are allocated new column.
-                for child in citer:
-                    if child.column is None:
-                        child.column = self.alloc_column(node.column)
-                    self.propagate_frontier(child.column, node.row + 1)
-            elif node.children:
-                child = node.children[0]
-                if child.column is None:
-                    child.column = node.column
-                    # Note that frontier is propagated in course of alloc_cell.
-                elif child.column != node.column:
-                    # Child node have other parents and occupies column of one
-                    # of them.
-                    self.leave_column(node.column)
-                    # But frontier must be propagated with respect to this
-                    # parent.
-                    self.propagate_frontier(child.column, node.row + 1)
+            node_index.update(oid, y)
+            node_index.touch(oid)
+            try:
+                item = items[oid]
+            except KeyError:
+                pass
             else:
-                # This is a leaf node.
-                self.leave_column(node.column)
-
-    def position_nodes(self):
-        self.recompute_grid()
+                if item.pos() != (x, y):
+                    item.setPos(x, y)
+
+            commit = self.commit_map[oid]
+            for parent in commit.parents:
+                key = (parent.oid, oid)
+                if key in edges:
+                    moved_edges.add(key)
+            for child in commit.children:
+                key = (oid, child.oid)
+                if key in edges:
+                    moved_edges.add(key)
+
+        for key in moved_edges:
+            edge = edges[key]
+            edge_index.update(key, self.node_pos(edge.source)[1],
+                              self.node_pos(edge.dest)[1])
+            edge_index.touch(key)
+
+    def position_nodes(self, commits):
+        nodes = self.layout.add_commits(commits)
 
         x_start = self.x_start
         x_min = self.x_min
         x_off = self.x_off
         y_off = self.y_off
+        max_row = self.max_row
 
         positions = {}
 
-        for node in self.commits:
+        for node in nodes:
             x_pos = x_start + node.column * x_off
             y_pos = y_off + node.row * y_off
 
             positions[node.oid] = (x_pos, y_pos)
             x_min = min(x_min, x_pos)
+            max_row = max(max_row, node.row)
 
         self.x_min = x_min
+        self.max_row = max_row
 
         return positions
 
-    def sort_by_generation(self, commits):
-        if len(commits) < 2:
-            return commits
-        commits.sort(key=lambda x: x.generation)
-        return commits
+    def node_pos(self, commit):
+        """Return the scene position of a commit that has been laid out"""
+        return (self.x_start + commit.column * self.x_off,
+                self.y_off + commit.row * self.y_off)
+
+    def update_scene_rect(self):
+        """Make the scene cover every commit, materialized or not"""
+        layout = self.layout
+        x_min = self.x_start + layout.max_column * self.x_off
+        x_max = self.x_start + layout.min_column * self.x_off
+        if x_min > x_max:
+            x_min, x_max = x_max, x_min
+        y_min = self.y_off + self.max_row * self.y_off
+        y_max = self.y_off
+        radius = Commit.commit_radius
+        rect = QtCore.QRectF(QtCore.QPointF(x_min - radius, y_min - radius),
+                             QtCore.QPointF(x_max + self.label_width,
+                                            y_max + radius))
+        self.scene().setSceneRect(rect)
+
+    # Virtualized rendering
+    def item_for(self, oid):
+        """Return the item for a commit, materializing it when needed"""
+        try:
+            return self.items[oid]
+        except KeyError:
+            pass
+        try:
+            commit = self.commit_map[oid]
+        except KeyError:
+            return None
+        if commit.row is None:
+            return None
+        if self.item_pool:
+            item = self.item_pool.pop()
+            item.set_commit(commit)
+        else:
+            item = Commit(commit, self.notifier)
+        x, y = self.node_pos(commit)
+        item.setPos(x, y)
+        self.scene().addItem(item)
+        self.items[oid] = item
+        return item
+
+    def recycle_item(self, oid):
+        item = self.items.pop(oid)
+        self.scene().removeItem(item)
+        self.item_pool.append(item)
+
+    def schedule_visible_update(self):
+        if not self.visible_timer.isActive():
+            self.visible_timer.start()
+
+    def visible_scene_rect(self):
+        return self.mapToScene(self.viewport().rect()).boundingRect()
+
+    def low_detail(self):
+        """Are commits too small to be drawn as individual items?"""
+        return self.transform().m11() < self.lod_scale
+
+    def update_visible_items(self):
+        """Materialize the commits near the viewport and recycle the rest"""
+        wanted = set()
+        if not self.low_detail():
+            rect = self.visible_scene_rect()
+            # Keep a margin so that scrolling does not expose empty space
+            margin = rect.height() / 2.0
+            top = rect.top() - margin
+            bottom = rect.bottom() + margin
+            left = rect.left() - self.label_width
+            right = rect.right() + Commit.commit_radius
+            commit_map = self.commit_map
+            node_pos = self.node_pos
+            for oid in self.node_index.query(top, bottom):
+                x = node_pos(commit_map[oid])[0]
+                if left <= x <= right:
+                    wanted.add(oid)
+
+        grabber = self.scene().mouseGrabberItem()
+        for oid, item in list(self.items.items()):
+            if oid in wanted or item.isSelected() or item is grabber:
+                continue
+            self.recycle_item(oid)
+
+        for oid in wanted:
+            self.item_for(oid)
+
+        # Commits move between the items and the bands when zooming
+        low_detail = self.low_detail()
+        force = low_detail != self.drawn_low_detail
+        self.drawn_low_detail = low_detail
+        self.invalidate_tiles(force=force)
+
+    def invalidate_tiles(self, force=False):
+        """Forget the cached drawing of bands whose contents changed"""
+        dirty = self.node_index.take_dirty()
+        dirty.update(self.edge_index.take_dirty())
+        for band in dirty:
+            self.tiles.pop(band, None)
+            self.band_homes.pop(band, None)
+        if dirty or force:
+            self.viewport().update()
+
+    def homes(self, band):
+        """Return the bands that hold the paths of the edges crossing a band
+
+        Each edge is drawn by the band where it starts so that edges
+        spanning several bands are drawn exactly once.
+
+        """
+        try:
+            return self.band_homes[band]
+        except KeyError:
+            pass
+        spans = self.edge_index.spans
+        homes = set([spans[key][0] for key in self.edge_index.keys(band)])
+        self.band_homes[band] = homes
+        return homes
+
+    def tile(self, band):
+        """Return the cached paths used to draw a band"""
+        try:
+            return self.tiles[band]
+        except KeyError:
+            pass
+        node_pos = self.node_pos
+        spans = self.edge_index.spans
+        edge_paths = {}
+        for key in self.edge_index.keys(band):
+            if spans[key][0] != band:
+                continue
+            edge = self.edges[key]
+            color = edge.color
+            try:
+                pen, path = edge_paths[color.rgba()]
+            except KeyError:
+                pen = QtGui.QPen(color, 4.0, Qt.SolidLine,
+                                 Qt.SquareCap, Qt.RoundJoin)
+                path = QtGui.QPainterPath()
+                edge_paths[color.rgba()] = (pen, path)
+            source_x, source_y = node_pos(edge.source)
+            dest_x, dest_y = node_pos(edge.dest)
+            Edge.add_path(path, source_x, source_y, dest_x, dest_y)
+
+        commit_path = QtGui.QPainterPath()
+        merge_path = QtGui.QPainterPath()
+        rect = Commit.inner_rect
+        commit_map = self.commit_map
+        for oid in self.node_index.keys(band):
+            commit = commit_map[oid]
+            x, y = node_pos(commit)
+            if len(commit.parents) > 1:
+                merge_path.addEllipse(rect.translated(x, y))
+            else:
+                commit_path.addEllipse(rect.translated(x, y))
+
+        tile = (list(edge_paths.values()), commit_path, merge_path)
+        self.tiles[band] = tile
+        return tile
+
+    def drawBackground(self, painter, rect):
+        """Draw the edges, and the commits when zoomed out, band by band"""
+        QtWidgets.QGraphicsView.drawBackground(self, painter, rect)
+        # Pens and commits reach past the coordinates that are indexed
+        margin = Commit.commit_radius
+        bands = self.node_index.band_range(rect.top() - margin,
+                                           rect.bottom() + margin)
+        homes = set()
+        for band in bands:
+            homes.update(self.homes(band))
+
+        painter.setBrush(Qt.NoBrush)
+        for band in sorted(homes):
+            for pen, path in self.tile(band)[0]:
+                painter.setPen(pen)
+                painter.drawPath(path)
+
+        if self.low_detail():
+            node_bands = self.node_index.bands
+            for band in bands:
+                if band not in node_bands:
+                    continue
+                _, commit_path, merge_path = self.tile(band)
+                painter.setPen(Commit.commit_pen)
+                painter.setBrush(Commit.commit_color)
+                painter.drawPath(commit_path)
+                painter.setBrush(Commit.merge_color)
+                painter.drawPath(merge_path)
 
     # Qt overrides
     def contextMenuEvent(self, event):
@@ -2013,6 +1947,14 @@ step 2. Hence, it must be propagated for children on side columns.
         self.selection_list = []
         self.viewport().repaint()
 
+    def scrollContentsBy(self, dx, dy):
+        QtWidgets.QGraphicsView.scrollContentsBy(self, dx, dy)
+        self.schedule_visible_update()
+
+    def resizeEvent(self, event):
+        QtWidgets.QGraphicsView.resizeEvent(self, event)
+        self.schedule_visible_update()
+
     def wheelEvent(self, event):
         """Handle Qt mouse wheel events."""
         if event.modifiers() & Qt.ControlModifier:
@@ -2040,6 +1982,7 @@ step 2. Hence, it must be propagated for children on side columns.
             xratio = yratio = max(xratio, yratio)
         self.scale(xratio, yratio)
         self.centerOn(rect.center())
+        self.schedule_visible_update()
 
 
 # Glossary
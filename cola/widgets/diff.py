@@ -11,6 +11,7 @@ from qtpy.QtCore import Signal
 from ..i18n import N_
 from ..interaction import Interaction
 from ..models import main
+from ..models import prefs
 from ..models import selection
 from .. import actions
 from .. import cmds
@@ -76,13 +77,41 @@ class DiffSyntaxHighlighter(QtGui.QSyntaxHighlighter):
         self.bad_whitespace_fmt = qtutils.make_format(bg=Qt.red)
         self.setCurrentBlockState(self.INITIAL_STATE)
 
+        self.kinds = None
+        kind = diffparse.ParsedDiff
+        self.kind_formats = {
+            kind.HEADER: self.diff_header_fmt,
+            kind.HUNK: self.bold_diff_header_fmt,
+            kind.ADDITION: self.diff_add_fmt,
+            kind.DELETION: self.diff_remove_fmt,
+        }
+
     def set_enabled(self, enabled):
         self.enabled = enabled
 
+    def set_parsed_diff(self, parsed_diff):
+        """Highlight using the line kinds of a parsed diff
+
+        The parsed diff must describe the text that is displayed next.
+        None switches back to matching each block's text.
+
+        """
+        if parsed_diff is None:
+            self.kinds = None
+        else:
+            self.kinds = parsed_diff.kinds
+
     def highlightBlock(self, text):
         if not self.enabled or not text:
             return
 
+        kinds = self.kinds
+        if kinds is not None:
+            block_number = self.currentBlock().blockNumber()
+            if block_number < len(kinds):
+                self._highlight_kind(text, kinds[block_number])
+                return
+
         state = self.previousBlockState()
         if state == self.INITIAL_STATE:
             if text.startswith('Submodule '):
@@ -132,9 +161,37 @@ class DiffSyntaxHighlighter(QtGui.QSyntaxHighlighter):
 
         self.setCurrentBlockState(state)
 
+    def _highlight_kind(self, text, kind):
+        if kind == diffparse.ParsedDiff.DIFFSTAT:
+            i = text.index('|')
+            self.setFormat(0, i, self.bold_diff_header_fmt)
+            self.setFormat(i, len(text) - i, self.diff_header_fmt)
+            return
+        fmt = self.kind_formats.get(kind)
+        if fmt is None:
+            return
+        self.setFormat(0, len(text), fmt)
+        if kind == diffparse.ParsedDiff.ADDITION and self.whitespace:
+            m = self.BAD_WHITESPACE_RGX.search(text)
+            if m is not None:
+                i = m.start()
+                self.setFormat(i, len(text) - i, self.bad_whitespace_fmt)
+
+
+def _same_blocks(text):
+    """Return True when Qt splits text into blocks at newlines only"""
+    if '\u2029' in text:
+        return False
+    if '\r' in text:
+        return text.count('\r') == text.count('\r\n')
+    return True
+
 
 class DiffTextEdit(VimHintedPlainTextEdit):
 
+    # Large parsed diffs are displayed in chunks of about this many lines
+    chunk_lines = 2000
+
     def __init__(self, parent,
                  is_commit=False, whitespace=True, numbers=False):
         VimHintedPlainTextEdit.__init__(self, '', parent=parent)
@@ -148,8 +205,12 @@ class DiffTextEdit(VimHintedPlainTextEdit):
         else:
             self.numbers = None
         self.scrollvalue = None
+        self.parsed_diff = None
+        self.shown_lines = 0
+        self.total_lines = 0
 
         self.cursorPositionChanged.connect(self._cursor_changed)
+        self.verticalScrollBar().valueChanged.connect(self._scrolled)
 
     def _cursor_changed(self):
         """Update the line number display when the cursor changes"""
@@ -177,23 +238,81 @@ class DiffTextEdit(VimHintedPlainTextEdit):
         scrollbar = self.verticalScrollBar()
         scrollvalue = self.scrollvalue
         if scrollbar and scrollvalue is not None:
+            # The scrollbar counts lines, so load the lines that it needs
+            needed = scrollvalue + scrollbar.pageStep()
+            while self.shown_lines < needed and self.show_more():
+                pass
             scrollbar.setValue(scrollvalue)
         self.scrollvalue = None
 
+    def _scrolled(self, value):
+        """Display more of a large diff when scrolling near its end"""
+        if self.shown_lines >= self.total_lines:
+            return
+        scrollbar = self.verticalScrollBar()
+        if value >= scrollbar.maximum() - scrollbar.pageStep():
+            self.show_more()
+
+    def _reset_chunks(self, parsed_diff=None, total_lines=0):
+        self.parsed_diff = parsed_diff
+        self.shown_lines = 0
+        self.total_lines = total_lines
+
+    def show_more(self):
+        """Append the next chunk of a large diff, return False when done"""
+        start = self.shown_lines
+        total = self.total_lines
+        if start >= total:
+            return False
+        end = min(total, self.parsed_diff.chunk_end(start, self.chunk_lines))
+        self.shown_lines = end
+        text = '\n'.join(self.parsed_diff.lines[start:end])
+
+        doc = self.document()
+        undo = doc.isUndoRedoEnabled()
+        doc.setUndoRedoEnabled(False)
+        cursor = QtGui.QTextCursor(doc)
+        cursor.movePosition(QtGui.QTextCursor.End)
+        cursor.insertText('\n' + text)
+        doc.setUndoRedoEnabled(undo)
+        return True
 
     def set_loading_message(self):
         self.hint.set_value('+++ ' + N_('Loading...'))
+        self.highlighter.set_parsed_diff(None)
+        self._reset_chunks()
         self.set_value('')
 
-    def set_diff(self, diff):
-        """Set the diff text, but save the scrollbar"""
+    def set_diff(self, diff, parsed_diff=None):
+        """Set the diff text, but save the scrollbar
+
+        When given, the ParsedDiff for the text provides the highlighting
+        and the line numbers, and large diffs are displayed in chunks as
+        they are scrolled into view.
+
+        """
         diff = diff.rstrip('\n')  # diffs include two empty newlines
         self.save_scrollbar()
 
         self.hint.set_value('')
         if self.numbers:
-            self.numbers.set_diff(diff)
-        self.set_value(diff)
+            if parsed_diff is None:
+                self.numbers.set_diff(diff)
+            else:
+                self.numbers.set_parsed_diff(parsed_diff)
+        if parsed_diff is not None and not _same_blocks(parsed_diff.text):
+            parsed_diff = None
+        self.highlighter.set_parsed_diff(parsed_diff)
+
+        self._reset_chunks()
+        total_lines = diff.count('\n') + 1
+        if parsed_diff is not None and total_lines > self.chunk_lines:
+            end = parsed_diff.chunk_end(0, self.chunk_lines)
+            self.set_value('\n'.join(parsed_diff.lines[:end]))
+            self._reset_chunks(parsed_diff, total_lines)
+            self.shown_lines = end
+        else:
+            self.set_value(diff)
 
         self.restore_scrollbar()
 
@@ -207,6 +326,9 @@ class DiffLineNumbers(TextDecorator):
         self.lines = None
         self.parser = diffparse.DiffLines()
         self.formatter = diffparse.FormatDigits()
+        self.merge = False
+        self.valid = True
+        self.digits = self.parser.digits()
 
         self.setFont(qtutils.diff_font())
         self._char_width = self.fontMetrics().width('0')
@@ -222,29 +344,39 @@ class DiffLineNumbers(TextDecorator):
     def set_diff(self, diff):
         parser = self.parser
         lines = parser.parse(diff)
+        self.merge = parser.merge
+        self.valid = parser.valid
         if parser.valid:
             self.lines = lines
-            self.formatter.set_digits(self.parser.digits())
+            self.digits = parser.digits()
+            self.formatter.set_digits(self.digits)
         else:
             self.lines = None
 
+    def set_parsed_diff(self, parsed_diff):
+        """Use the line numbers of a ParsedDiff"""
+        self.lines = parsed_diff.numbers
+        self.merge = parsed_diff.merge
+        self.valid = True
+        self.digits = parsed_diff.digits
+        self.formatter.set_digits(self.digits)
+
     def set_lines(self, lines):
         self.lines = lines
 
     def width_hint(self):
         if not self.isVisible():
             return 0
-        parser = self.parser
 
-        if parser.merge:
+        if self.merge:
             columns = 3
             extra = 3  # one space in-between, one space after
         else:
             columns = 2
             extra = 2  # one space in-between, one space after
 
-        if parser.valid:
-            digits = parser.digits() * columns
+        if self.valid:
+            digits = self.digits * columns
         else:
             digits = 4
 
@@ -336,10 +468,18 @@ class Viewer(QtWidgets.QWidget):
         stack.addWidget(self.text)
         stack.addWidget(self.image)
 
+        self.notice = TruncatedDiffNotice(self)
+        self.notice.hide()
+
         self.main_layout = qtutils.vbox(
-            defs.no_margin, defs.no_spacing, self.stack)
+            defs.no_margin, defs.no_spacing, self.stack, self.notice)
         self.setLayout(self.main_layout)
 
+        # Offer the rest of a truncated diff
+        self.text.truncated_changed.connect(self.notice.set_truncated)
+        self.notice.show_all.clicked.connect(self.show_entire_diff)
+        self.notice.difftool.clicked.connect(self.text.launch_difftool.trigger)
+
         # Observe images
         images_msg = model.message_images_changed
         model.add_observer(images_msg, self.images_changed.emit)
@@ -373,6 +513,19 @@ class Viewer(QtWidgets.QWidget):
         self.options.zoom_mode.set_index(zoom_mode)
         return True
 
+    def show_entire_diff(self):
+        """Diff the current file again without the cola.maxdiffsize limit"""
+        model = self.model
+        filename = model.filename
+        if not filename:
+            return
+        if model.mode == model.mode_index:
+            deleted = filename in model.staged_deleted
+            cmds.do(cmds.DiffStaged, filename, deleted=deleted, max_size=0)
+        else:
+            deleted = filename in model.unstaged_deleted
+            cmds.do(cmds.Diff, filename, deleted=deleted, max_size=0)
+
     def set_diff_type(self, diff_type):
         """Manage the image and text diff views when selection changes"""
         self.options.set_diff_type(diff_type)
@@ -488,6 +641,30 @@ class Viewer(QtWidgets.QWidget):
         return self.render_comp(comp_mode)
 
 
+class TruncatedDiffNotice(QtWidgets.QFrame):
+    """Tell the user that a diff was truncated and offer the rest of it"""
+
+    def __init__(self, parent):
+        QtWidgets.QFrame.__init__(self, parent)
+        self.setFrameShape(QtWidgets.QFrame.StyledPanel)
+        self.label = qtutils.label(selectable=False)
+        self.show_all = qtutils.create_button(text=N_('Show Entire Diff'))
+        self.difftool = qtutils.create_button(
+            text=N_('Launch Diff Tool'), icon=icons.diff())
+
+        self.main_layout = qtutils.hbox(
+            defs.margin, defs.button_spacing, self.label, qtutils.STRETCH,
+            self.show_all, self.difftool)
+        self.setLayout(self.main_layout)
+
+    def set_truncated(self, truncated):
+        if truncated:
+            size = prefs.maxdiffsize() // 1024
+            self.label.setText(
+                N_('Only the first %d KiB of this diff are shown.') % size)
+        self.setVisible(truncated)
+
+
 def create_image(width, height):
     size = QtCore.QSize(width, height)
     image =  QtGui.QImage(size, QtGui.QImage.Format_ARGB32_Premultiplied)
@@ -604,6 +781,7 @@ class DiffEditor(DiffTextEdit):
     options_changed = Signal()
     updated = Signal()
     diff_text_changed = Signal(object)
+    truncated_changed = Signal(bool)
 
     def __init__(self, options, parent, context):
         DiffTextEdit.__init__(self, parent, numbers=True)
@@ -636,6 +814,16 @@ class DiffEditor(DiffTextEdit):
                                      self.updated.emit)
         self.updated.connect(self.refresh, type=Qt.QueuedConnection)
 
+    def set_diff(self, diff, parsed_diff=None):
+        """Display the model's diff using its parsed form"""
+        if parsed_diff is None:
+            parsed_diff = self.model.parsed_diff()
+            if parsed_diff.text is not diff:
+                parsed_diff = None
+        DiffTextEdit.set_diff(self, diff, parsed_diff=parsed_diff)
+        truncated = parsed_diff is not None and parsed_diff.truncated
+        self.truncated_changed.emit(truncated)
+
     def refresh(self):
         enabled = False
         s = self.selection_model.selection()
@@ -777,25 +965,15 @@ class DiffEditor(DiffTextEdit):
         selection_start = cursor.selectionStart()
         selection_end = max(selection_start, cursor.selectionEnd() - 1)
 
-        first_line_idx = -1
-        last_line_idx = -1
-        line_idx = 0
-        line_start = 0
-
-        for line_idx, line in enumerate(self.value().splitlines()):
-            line_end = line_start + len(line)
-            if line_start <= selection_start <= line_end:
-                first_line_idx = line_idx
-            if line_start <= selection_end <= line_end:
-                last_line_idx = line_idx
-                break
-            line_start = line_end + 1
-
-        if first_line_idx == -1:
-            first_line_idx = line_idx
-
-        if last_line_idx == -1:
-            last_line_idx = line_idx
+        # The document finds the blocks without splitting the whole text
+        doc = self.document()
+        first_line_idx = doc.findBlock(selection_start).blockNumber()
+        last_line_idx = doc.findBlock(selection_end).blockNumber()
+        last_block = max(0, doc.blockCount() - 1)
+        if first_line_idx < 0:
+            first_line_idx = last_block
+        if last_line_idx < 0:
+            last_line_idx = last_block
 
         return first_line_idx, last_line_idx
 
@@ -892,8 +1070,12 @@ class DiffWidget(QtWidgets.QWidget):
     def set_diff_oid(self, oid, filename=None):
         self.diff.save_scrollbar()
         self.diff.set_loading_message()
-        task = DiffInfoTask(oid, filename, self)
-        self.context.runtask.start(task, result=self.diff.set_diff)
+        task = DiffInfoTask(oid, filename, self.diff.highlighter.is_commit,
+                            self)
+        self.context.runtask.start(task, result=self.set_parsed_diff)
+
+    def set_parsed_diff(self, parsed_diff):
+        self.diff.set_diff(parsed_diff.text, parsed_diff=parsed_diff)
 
     def commits_selected(self, commits):
         if len(commits) != 1:
@@ -981,10 +1163,12 @@ class TextLabel(QtWidgets.QLabel):
 
 class DiffInfoTask(qtutils.Task):
 
-    def __init__(self, oid, filename, parent):
+    def __init__(self, oid, filename, is_commit, parent):
         qtutils.Task.__init__(self, parent)
         self.oid = oid
         self.filename = filename
+        self.is_commit = is_commit
 
     def task(self):
-        return gitcmds.diff_info(self.oid, filename=self.filename)
+        diff = gitcmds.diff_info(self.oid, filename=self.filename)
+        return diffparse.ParsedDiff(diff, is_commit=self.is_commit)
@@ -11,11 +11,11 @@ from ..i18n import N_
 from ..utils import Group
 from .. import cmds
 from .. import core
-from .. import gitcmds
 from .. import hotkeys
 from .. import icons
 from .. import utils
 from .. import qtutils
+from ..models import tracked
 from . import completion
 from . import defs
 from . import filetree
@@ -90,7 +90,7 @@ class FindFilesThread(QtCore.QThread):
             args = []
         else:
             args = [add_wildcards(arg) for arg in utils.shell_split(query)]
-        filenames = gitcmds.tracked_files(*args)
+        filenames = tracked.current().match(args)
         if query == self.query:
             self.result.emit(filenames)
         else:
@@ -662,6 +662,16 @@ class ProgressDialog(QtWidgets.QProgressDialog):
     def refresh(self, txt):
         self.setLabelText(txt)
 
+    def set_progress(self, value, maximum):
+        """Show how much of the work is done
+
+        A window-modal dialog processes events when its value changes,
+        so this also repaints it while the main thread is busy.
+
+        """
+        self.setRange(0, maximum)
+        self.setValue(value)
+
     def keyPressEvent(self, event):
         if event.key() != Qt.Key_Escape:
             super(ProgressDialog, self).keyPressEvent(event)
@@ -912,6 +922,12 @@ def async_command_result(title, cmd, result):
     Interaction.command(title, cmd_string, status, out, err)
 
 
+def progress(title, label):
+    dialog = ProgressDialog(title, label, qtutils.active_window())
+    dialog.show()
+    return dialog
+
+
 def install():
     """Install the GUI-model interaction hooks"""
     Interaction.critical = staticmethod(critical)
@@ -921,3 +937,4 @@ def install():
     Interaction.command_error = staticmethod(command_error)
     Interaction.save_as = staticmethod(save_as)
     Interaction.async_command = staticmethod(async_command)
+    Interaction.progress = staticmethod(progress)
@@ -90,6 +90,52 @@ class StatusWidget(QtWidgets.QWidget):
         self.tree.move_down()
 
 
+def _rows(items, paths):
+    """Return the sorted rows of paths within items"""
+    if len(paths) <= 64:
+        return sorted(items.index(path) for path in paths)
+    return [row for row, path in enumerate(items) if path in paths]
+
+
+def _without_rows(items, rows):
+    """Return a copy of items without the sorted rows"""
+    if len(rows) <= 64:
+        result = list(items)
+        for row in reversed(rows):
+            del result[row]
+        return result
+    rows = set(rows)
+    return [path for row, path in enumerate(items) if row not in rows]
+
+
+def subtree_delta(old_items, new_items):
+    """Return the (removed_rows, inserts) that turn old_items into new_items
+
+    removed_rows are in descending order, and inserts is a list of
+    (row, [paths]) runs in ascending order.  None is returned when the
+    paths that are in both lists were reordered.
+
+    """
+    if old_items == new_items:
+        return ([], [])
+    old_set = set(old_items)
+    new_set = set(new_items)
+    removed_rows = _rows(old_items, old_set - new_set)
+    added_rows = _rows(new_items, new_set - old_set)
+    if (_without_rows(old_items, removed_rows) !=
+            _without_rows(new_items, added_rows)):
+        return None
+
+    inserts = []
+    for row in added_rows:
+        if inserts and inserts[-1][0] + len(inserts[-1][1]) == row:
+            inserts[-1][1].append(new_items[row])
+        else:
+            inserts.append((row, [new_items[row]]))
+    removed_rows.reverse()
+    return (removed_rows, inserts)
+
+
 class StatusTreeWidget(QtWidgets.QTreeWidget):
     # Signals
     about_to_update = Signal()
@@ -136,6 +182,9 @@ class StatusTreeWidget(QtWidgets.QTreeWidget):
         self.old_contents = None
         self.old_current_item = None
         self.expanded_items = set()
+        # The paths and deleted paths displayed in each category
+        self.subtree_paths = {}
+        self.subtree_deleted = {}
 
         self.image_formats = qtutils.ImageFormats()
 
@@ -265,19 +314,32 @@ class StatusTreeWidget(QtWidgets.QTreeWidget):
         old_s = self.old_selection
         new_c = self.contents()
 
-        def mkselect(lst, widget_getter):
+        def mkselect(lst, widget_getter, count):
+            rows = {}
+
             def select(item, current=False):
-                idx = lst.index(item)
+                # Index the list when many items are reselected
+                if count > 64:
+                    if not rows:
+                        rows.update((path, row)
+                                    for row, path in enumerate(lst))
+                    idx = rows[item]
+                else:
+                    idx = lst.index(item)
                 item = widget_getter(idx)
                 if current:
                     self.setCurrentItem(item)
                 item.setSelected(True)
             return select
 
-        select_staged = mkselect(new_c.staged, self.staged_item)
-        select_unmerged = mkselect(new_c.unmerged, self.unmerged_item)
-        select_modified = mkselect(new_c.modified, self.modified_item)
-        select_untracked = mkselect(new_c.untracked, self.untracked_item)
+        select_staged = mkselect(new_c.staged, self.staged_item,
+                                 len(old_s.staged))
+        select_unmerged = mkselect(new_c.unmerged, self.unmerged_item,
+                                   len(old_s.unmerged))
+        select_modified = mkselect(new_c.modified, self.modified_item,
+                                   len(old_s.modified))
+        select_untracked = mkselect(new_c.untracked, self.untracked_item,
+                                    len(old_s.untracked))
 
         saved_selection = [
             (set(new_c.staged), old_c.staged, set(old_s.staged),
@@ -485,24 +547,50 @@ class StatusTreeWidget(QtWidgets.QTreeWidget):
                      staged=False,
                      untracked=False,
                      deleted_set=None):
-        """Add a list of items to a treewidget item."""
+        """Update a treewidget item's children to match a list of items
+
+        Only the rows that were removed or inserted are touched, so the
+        items of unchanged paths, and their selection, are kept.
+
+        """
         self.blockSignals(True)
         parent = self.topLevelItem(idx)
         hide = not bool(items)
         parent.setHidden(hide)
 
-        # sip v4.14.7 and below leak memory in parent.takeChildren()
-        # so we use this backwards-compatible construct instead
-        while parent.takeChild(0) is not None:
-            pass
-
-        for item in items:
-            deleted = (deleted_set is not None and item in deleted_set)
-            treeitem = qtutils.create_treeitem(item,
-                                               staged=staged,
-                                               deleted=deleted,
-                                               untracked=untracked)
-            parent.addChild(treeitem)
+        if deleted_set is None:
+            deleted_set = set()
+        old_items = self.subtree_paths.get(idx, [])
+        old_deleted = self.subtree_deleted.get(idx, set())
+
+        def create(path):
+            return qtutils.create_treeitem(path,
+                                           staged=staged,
+                                           deleted=path in deleted_set,
+                                           untracked=untracked)
+
+        delta = subtree_delta(old_items, items)
+        if delta is None:
+            # The paths were reordered; rebuild the subtree.
+            for row in range(parent.childCount() - 1, -1, -1):
+                parent.takeChild(row)
+            parent.addChildren([create(path) for path in items])
+        else:
+            removed_rows, inserts = delta
+            for row in removed_rows:
+                parent.takeChild(row)
+            for row, paths in inserts:
+                parent.insertChildren(row, [create(path) for path in paths])
+            # Update the icons of the paths that were deleted or restored
+            changed = (old_deleted ^ deleted_set).intersection(old_items)
+            changed.intersection_update(items)
+            if changed:
+                rows = dict((path, row) for row, path in enumerate(items))
+                for path in changed:
+                    parent.child(rows[path]).set_deleted(path in deleted_set)
+
+        self.subtree_paths[idx] = list(items)
+        self.subtree_deleted[idx] = set(deleted_set)
         self.expand_items(idx, items)
         self.blockSignals(False)
 
@@ -776,8 +864,28 @@ class StatusTreeWidget(QtWidgets.QTreeWidget):
 
     def selection(self):
         """Return the current selection in the repo status tree."""
-        return selection.State(self.staged(), self.unmerged(),
-                               self.modified(), self.untracked())
+        rows = self._selected_rows()
+        return selection.State(
+            self._subtree_selection(self.idx_staged, self.m.staged, rows),
+            self._subtree_selection(self.idx_unmerged, self.m.unmerged, rows),
+            self._subtree_selection(self.idx_modified, self.m.modified, rows),
+            self._subtree_selection(self.idx_untracked, self.m.untracked,
+                                    rows))
+
+    def _selected_rows(self):
+        """Return a dict of {category: sorted rows} for the selected files
+
+        Only the selected indexes are visited, rather than every child.
+
+        """
+        rows = {}
+        for idx in self.selectedIndexes():
+            parent_idx = idx.parent()
+            if parent_idx.isValid():
+                rows.setdefault(parent_idx.row(), []).append(idx.row())
+        for category_rows in rows.values():
+            category_rows.sort()
+        return rows
 
     def contents(self):
         return selection.State(self.m.staged, self.m.unmerged,
@@ -866,13 +974,16 @@ class StatusTreeWidget(QtWidgets.QTreeWidget):
     def untracked_items(self):
         return self._subtree_selection_items(self.idx_untracked)
 
-    def _subtree_selection(self, idx, items):
-        item = self.topLevelItem(idx)
-        return qtutils.tree_selection(item, items)
+    def _subtree_selection(self, idx, items, rows=None):
+        if rows is None:
+            rows = self._selected_rows()
+        count = len(items)
+        return [items[row] for row in rows.get(idx, []) if row < count]
 
     def _subtree_selection_items(self, idx):
         item = self.topLevelItem(idx)
-        return qtutils.tree_selection_items(item)
+        rows = self._selected_rows()
+        return [item.child(row) for row in rows.get(idx, [])]
 
     def double_clicked(self, item, idx):
         """Called when an item is double-clicked in the repo status tree."""
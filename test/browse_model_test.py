@@ -3,6 +3,7 @@ from __future__ import absolute_import, division, unicode_literals
 
 from cola import core
 from cola import gitcmds
+from cola.git import INDEX_LOCK
 from cola.models.main import MainModel
 
 from test import helper
@@ -26,6 +27,66 @@ class ClassicModelTestCase(helper.GitRepositoryTestCase):
         self.assertTrue('foo/bar/baz' not in self.model.modified)
         self.assertTrue('foo/bar/baz' not in self.model.untracked)
 
+    def test_stage_paths_deleted(self):
+        """Test stage_paths() with new, modified and deleted files."""
+        self.commit_files()
+        self.write_file('A', 'change')
+        core.unlink('B')
+        core.makedirs('foo')
+        self.touch('foo/new file')
+        self.model.update_file_status()
+        self.assertTrue('B' in self.model.unstaged_deleted)
+
+        files = set(self.model.modified + self.model.untracked)
+        gitcmds.stage_paths(['A', 'B', 'foo/'], files=files,
+                            deleted=self.model.unstaged_deleted)
+        self.model.update_file_status()
+
+        self.assertEqual(set(self.model.staged),
+                         set(['A', 'B', 'foo/new file']))
+        self.assertEqual(self.model.staged_deleted, set(['B']))
+        self.assertFalse(self.model.modified)
+        self.assertFalse(self.model.untracked)
+
+    def test_stage_paths_without_status(self):
+        """Test stage_paths() with paths that are not in the status."""
+        self.commit_files()
+        self.write_file('A', 'change')
+        core.unlink('B')
+        core.makedirs('foo')
+        self.touch('foo/new file')
+
+        gitcmds.stage_paths(['A', 'B', 'foo/'])
+        self.model.update_file_status()
+
+        self.assertEqual(set(self.model.staged),
+                         set(['A', 'B', 'foo/new file']))
+        self.assertEqual(self.model.staged_deleted, set(['B']))
+
+    def test_stage_paths_progress(self):
+        """Test the progress reported while staging many files."""
+        self.commit_files()
+        self.write_file('A', 'change')
+        core.unlink('B')
+        self.touch('C', 'D', 'E')
+        files = set(['A', 'B', 'C', 'D', 'E'])
+        progress = []
+
+        def update(done, total):
+            # The index stays locked while git reads the paths
+            self.assertTrue(INDEX_LOCK.stats()['writing'])
+            progress.append((done, total))
+
+        status, out, err = gitcmds.update_index(
+            sorted(files), chunk_size=2, progress=update)
+        self.assertEqual(status, 0)
+        self.assertEqual(progress, [(2, 5), (4, 5), (5, 5)])
+        self.assertFalse(INDEX_LOCK.stats()['writing'])
+
+        self.model.update_file_status()
+        self.assertEqual(set(self.model.staged), files)
+        self.assertEqual(self.model.staged_deleted, set(['B']))
+
     def test_unstage_paths(self):
         """Test a simple usage of unstage_paths()."""
         self.commit_files()
@@ -53,5 +53,18 @@ class CoreColaUnicodeTestCase(unittest.TestCase):
         self.assertEqual(actual.encoding, 'iso-8859-15')
 
 
+class StatStampTestCase(helper.TmpPathTestCase):
+
+    def test_stat_stamp(self):
+        self.assertEqual(core.stat_stamp(''), None)
+        self.assertEqual(core.stat_stamp('missing'), None)
+
+        self.write_file('file', 'a')
+        stamp = core.stat_stamp('file')
+        self.assertEqual(core.stat_stamp('file'), stamp)
+        self.write_file('file', 'abc')
+        self.assertNotEqual(core.stat_stamp('file'), stamp)
+
+
 if __name__ == '__main__':
     unittest.main()
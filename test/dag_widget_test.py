@@ -0,0 +1,57 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from qtpy import QtWidgets
+
+from cola import cmds
+from cola import observable
+from cola.widgets import dag
+
+from test.models_dag_test import log_entry
+from test.models_dag_test import parse
+
+
+class GraphViewTestCase(unittest.TestCase):
+    """Tests the GraphView widget"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QtWidgets.QApplication.instance()
+        if cls.app is None:
+            cls.app = QtWidgets.QApplication([])
+
+    def setUp(self):
+        self.view = dag.GraphView(observable.Observable(), None)
+        self.oids = ['%040x' % idx for idx in range(1, 4)]
+        entries = [log_entry(self.oids[0], [])]
+        entries.append(log_entry(self.oids[1], [self.oids[0]]))
+        entries.append(log_entry(self.oids[2], [self.oids[1]]))
+        self.commits = parse(entries)
+        self.view.add_commits(self.commits)
+
+    def tearDown(self):
+        self.view.deleteLater()
+
+    def test_create_patch_with_selection(self):
+        # Select the newest commit first to check the generation order
+        for oid in (self.oids[2], self.oids[0]):
+            self.view.item_for(oid).setSelected(True)
+        with patch.object(cmds, 'do') as do:
+            self.view.create_patch()
+        do.assert_called_once_with(
+            cmds.FormatPatch, [self.oids[0], self.oids[2]], self.oids)
+
+    def test_create_patch_without_selection(self):
+        with patch.object(cmds, 'do') as do:
+            self.view.create_patch()
+        self.assertFalse(do.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -131,6 +131,100 @@ class ParseDiffTestCase(unittest.TestCase):
                          '-second\n')
 
 
+class ParsedDiffTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.text = core.read(helper.fixture('diff.txt'))
+        self.diff = diffparse.ParsedDiff(self.text)
+
+    def test_hunks_match_diff_parser(self):
+        parser = diffparse.DiffParser('cola/diffparse.py', self.text)
+        self.assertEqual([h.first_line_idx for h in self.diff.hunks],
+                         [h.first_line_idx for h in parser.hunks])
+        self.assertEqual(self.diff.hunk_starts, [0, 23, 41])
+        self.assertEqual(self.diff.hunks[1].lines[0],
+                         '@@ -29,13 +40,11 @@ class DiffParser(object):\n')
+
+    def test_hunk_lookup(self):
+        self.assertEqual(self.diff.hunk_index(0), 0)
+        self.assertEqual(self.diff.hunk_index(22), 0)
+        self.assertEqual(self.diff.hunk_index(23), 1)
+        self.assertEqual(self.diff.hunk_index(40), 1)
+        self.assertEqual(self.diff.hunk_index(41), 2)
+        self.assertEqual(self.diff.hunk_index(1000), 2)
+        self.assertEqual(self.diff.hunk_at(24).old_start, 29)
+        self.assertEqual(diffparse.ParsedDiff('').hunk_at(0), None)
+
+    def test_chunk_end(self):
+        # Chunks end at the hunk that starts within the chunk
+        self.assertEqual(self.diff.chunk_end(0, 30), 23)
+        self.assertEqual(self.diff.chunk_end(0, 45), 41)
+        # Chunks within a hunk end after "size" lines
+        self.assertEqual(self.diff.chunk_end(0, 10), 10)
+        self.assertEqual(self.diff.chunk_end(41, 10), 51)
+        self.assertEqual(self.diff.chunk_end(41, 1000), len(self.diff.lines))
+
+    def test_line_numbers_match_diff_lines(self):
+        parser = diffparse.DiffLines()
+        self.assertEqual(self.diff.numbers, parser.parse(self.text))
+        self.assertEqual(self.diff.digits, parser.digits())
+        self.assertFalse(self.diff.merge)
+
+    def test_line_kinds(self):
+        kind = diffparse.ParsedDiff
+        kinds = self.diff.kinds
+        self.assertEqual(len(kinds), len(self.diff.lines))
+        self.assertEqual(kinds[0], kind.HUNK)
+        self.assertEqual(kinds[1], kind.CONTEXT)
+        self.assertEqual(kinds[4], kind.ADDITION)
+        self.assertEqual(kinds[23], kind.HUNK)
+
+    def test_commit_diff(self):
+        text = ('Author: A U Thor\n'
+                '\n'
+                '---\n'
+                ' a | 2 +-\n'
+                '\n'
+                'diff --git a/a b/a\n'
+                '--- a/a\n'
+                '+++ b/a\n'
+                '@@ -1 +1 @@\n'
+                '-a\n'
+                '+b\n'
+                'diff --git a/b b/b\n'
+                '@@ -0,0 +1 @@\n'
+                '+c\n')
+        kind = diffparse.ParsedDiff
+        diff = diffparse.ParsedDiff(text, is_commit=True)
+        self.assertEqual(diff.kinds[:9], [
+            kind.TEXT, kind.TEXT, kind.TEXT, kind.TEXT, kind.TEXT,
+            kind.HEADER, kind.HEADER, kind.HEADER, kind.HUNK])
+        self.assertEqual(diff.kinds[9:14], [
+            kind.DELETION, kind.ADDITION, kind.HEADER, kind.HUNK,
+            kind.ADDITION])
+        self.assertEqual(diff.file_starts, [5, 11])
+        self.assertEqual(diff.file_index(4), -1)
+        self.assertEqual(diff.file_index(10), 0)
+        self.assertEqual(diff.file_index(12), 1)
+        # Hunks end at the next file
+        self.assertEqual(diff.hunks[0].lines,
+                         ['@@ -1 +1 @@\n', '-a\n', '+b\n'])
+
+        diff = diffparse.ParsedDiff(text)
+        self.assertEqual(diff.kinds[0], kind.HEADER)
+        self.assertEqual(diff.kinds[3], kind.DIFFSTAT)
+
+    def test_diff_parser_uses_parsed_diff(self):
+        parser = diffparse.DiffParser('cola/diffparse.py', self.text,
+                                      parsed_diff=self.diff)
+        self.assertTrue(parser.hunks is self.diff.hunks)
+        patch = parser.generate_hunk_patch(30)
+        self.assertTrue('@@ -29,13 +29,11 @@' in patch)
+
+    def test_diff_parser_rejects_malformed_diff(self):
+        self.assertRaises(AssertionError, diffparse.DiffParser, 'a', 'a\n')
+
+
 class DiffLinesTestCase(unittest.TestCase):
 
     def setUp(self):
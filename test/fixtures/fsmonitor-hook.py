@@ -0,0 +1,32 @@
+"""A stub "core.fsmonitor" hook that reports the paths in a journal
+
+Each line of $GIT_DIR/fsmonitor-journal names a changed path.  Version 2
+tokens are line numbers in the journal.  Version 1 reports the whole
+journal and empties it.  The hook fails when $GIT_DIR/fsmonitor-fail
+exists.
+
+"""
+import os
+import sys
+
+journal = os.path.join('.git', 'fsmonitor-journal')
+if os.path.exists(os.path.join('.git', 'fsmonitor-fail')):
+    sys.exit(1)
+version, token = sys.argv[1:3]
+try:
+    with open(journal) as f:
+        paths = f.read().splitlines()
+except IOError:
+    paths = []
+
+if version == '1':
+    output = paths
+    open(journal, 'w').close()
+elif token.isdigit():
+    output = [str(len(paths))] + paths[int(token):]
+else:
+    # An unknown token means that everything may have changed
+    output = [str(len(paths)), '/']
+
+stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+stdout.write(''.join(path + '\0' for path in output).encode('utf-8'))
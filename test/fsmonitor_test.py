@@ -0,0 +1,149 @@
+from __future__ import absolute_import, division, unicode_literals
+import os
+import unittest
+
+from cola import core
+from cola import fsmonitor
+from cola.models import main
+
+from test import helper
+
+
+class ChooseWatchesTestCase(unittest.TestCase):
+
+    def test_without_budget(self):
+        dirs = set(['/a', '/a/b', '/c'])
+        watched, scanned = fsmonitor._choose_watches(dirs, [], None)
+        self.assertEqual(watched, dirs)
+        self.assertEqual(scanned, set())
+
+    def test_hot_dirs_first(self):
+        dirs = set(['/a', '/a/b', '/a/b/c', '/d'])
+        hot = ['/a/b/c', '/missing', '/a/b/c']
+        watched, scanned = fsmonitor._choose_watches(dirs, hot, 2)
+        # The rest of the budget goes to the shallowest directories
+        self.assertEqual(watched, set(['/a/b/c', '/a']))
+        self.assertEqual(scanned, set(['/a/b', '/d']))
+
+    def test_empty_budget(self):
+        dirs = set(['/a', '/b'])
+        watched, scanned = fsmonitor._choose_watches(dirs, ['/a'], 0)
+        self.assertEqual(watched, set())
+        self.assertEqual(scanned, dirs)
+
+
+class StatIndexTestCase(helper.TmpPathTestCase):
+
+    def test_scan(self):
+        os.mkdir('dir')
+        self.write_file('dir/file', 'a')
+        index = fsmonitor._StatIndex()
+        index.set_paths(['dir', 'dir/file'])
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.scan(), [])
+
+        self.write_file('dir/file', 'abc')
+        self.assertEqual(index.scan(), ['dir/file'])
+        self.assertEqual(index.scan(), [])
+
+        self.touch('dir/new')
+        os.utime('dir', (0, 0))
+        self.assertEqual(index.scan(), ['dir'])
+
+    def test_set_paths_keeps_stamps(self):
+        self.write_file('file', 'a')
+        index = fsmonitor._StatIndex()
+        index.set_paths(['file'])
+        self.write_file('file', 'abc')
+        index.set_paths(['file', 'other'])
+        self.assertEqual(index.scan(), ['file'])
+
+
+class ScannedDirectoryTestCase(helper.GitRepositoryTestCase):
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        os.makedirs(os.path.join('dir', 'sub'))
+        self.write_file('dir/sub/tracked', 'tracked')
+        self.write_file('.gitignore', 'sub\n')
+        self.git('add', '-f', '.gitignore', 'dir/sub/tracked')
+        self.git('commit', '-m', 'add dir')
+        self.write_file('dir/untracked', 'untracked')
+        self.model = main.MainModel(cwd=core.getcwd())
+
+        self.monitor = fsmonitor._Monitor(None)
+        self.thread = fsmonitor._BaseThread(self.monitor)
+        self.thread._worktree = core.getcwd()
+        self.thread._git_dir = os.path.join(core.getcwd(), '.git')
+        self.changed = []
+        self.monitor.paths_changed.connect(self.changed.append)
+
+    def test_deleted_directory(self):
+        self.model.update_status()
+        self.assertEqual(self.model.untracked, ['dir/untracked'])
+
+        index = fsmonitor._StatIndex()
+        index.set_paths([self.test_path('dir'), self.test_path('dir', 'sub')])
+        core.unlink('dir/untracked')
+        core.unlink('dir/sub/tracked')
+        os.rmdir(os.path.join('dir', 'sub'))
+        os.rmdir('dir')
+        self.thread._file_paths.update(index.scan())
+        self.thread.notify()
+        # Directories that contain tracked files are never ignored
+        self.assertEqual(self.changed, [set(['dir', 'dir/sub'])])
+
+        # A directory replaces the status of every path below it
+        paths = self.changed[0]
+        self.model.apply_path_status(
+            paths, self.model.gather_path_status(paths))
+        self.assertEqual(self.model.untracked, [])
+        self.assertEqual(self.model.modified, ['dir/sub/tracked'])
+        self.assertEqual(self.model.unstaged_deleted,
+                         set(['dir/sub/tracked']))
+
+
+class CoalescerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.coalescer = fsmonitor._Coalescer(
+            min_delay=100, burst_delay=800, max_latency=2000,
+            burst_events=10, burst_rate=100)
+
+    def test_isolated_edit(self):
+        self.coalescer.add_events(10.0, 2)
+        self.assertEqual(self.coalescer.delay(10.0, 0.0), 100)
+        self.assertEqual(self.coalescer.delay(10.05, 0.0), 50)
+        self.assertEqual(self.coalescer.delay(10.2, 0.0), 0)
+        self.assertEqual(self.coalescer.notified(10.2), (2, 100, 200, 0))
+        self.assertEqual(self.coalescer.events, 0)
+
+    def test_expensive_refresh_waits_longer(self):
+        self.coalescer.add_events(10.0)
+        self.assertEqual(self.coalescer.delay(10.0, 0.25), 600)
+
+    def test_burst_extends_window(self):
+        for i in range(20):
+            self.coalescer.add_events(10.0 + i * 0.001)
+        self.assertTrue(self.coalescer.is_burst())
+        self.assertEqual(self.coalescer.delay(10.019, 0.0), 800)
+
+    def test_slow_events_are_not_a_burst(self):
+        for i in range(20):
+            self.coalescer.add_events(10.0 + i * 0.05)
+        self.assertFalse(self.coalescer.is_burst())
+
+    def test_latency_is_bounded(self):
+        now = 10.0
+        while now < 11.9:
+            self.coalescer.add_events(now, 10)
+            now += 0.01
+        self.assertTrue(self.coalescer.delay(now, 0.0) <= 100)
+        self.assertEqual(self.coalescer.delay(12.0, 0.0), 0)
+        events, window, latency, cost = self.coalescer.notified(12.0)
+        self.assertEqual(latency, 2000)
+        self.assertEqual(window, 800)
+
+
+if __name__ == '__main__':
+    unittest.main()
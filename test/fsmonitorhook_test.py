@@ -0,0 +1,83 @@
+from __future__ import absolute_import, division, unicode_literals
+import sys
+import unittest
+
+from cola import fsmonitorhook
+from cola import gitcfg
+
+from test import helper
+
+
+class FsmonitorHookTestCase(helper.GitRepositoryTestCase):
+    """Tests the cola.fsmonitorhook module against a stub hook"""
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        self.hook = '"%s" "%s"' % (sys.executable,
+                                   helper.fixture('fsmonitor-hook.py'))
+
+    def journal(self, *paths):
+        self.append_file('.git/fsmonitor-journal',
+                         ''.join(path + '\n' for path in paths))
+
+    def test_hook_config(self):
+        cfg = gitcfg.current()
+        self.assertEqual(fsmonitorhook.hook_config(cfg), None)
+
+        self.git('config', 'core.fsmonitor', 'true')
+        cfg.reset()
+        self.assertEqual(fsmonitorhook.hook_config(cfg), None)
+
+        self.git('config', 'core.fsmonitor', self.hook)
+        cfg.reset()
+        self.assertEqual(fsmonitorhook.hook_config(cfg), (self.hook, 2))
+
+        self.git('config', 'core.fsmonitorhookversion', '1')
+        cfg.reset()
+        self.assertEqual(fsmonitorhook.hook_config(cfg), (self.hook, 1))
+
+    def test_query_version2(self):
+        hook = fsmonitorhook.FsmonitorHook(self.hook, version=2)
+        self.journal('A')
+        # The first query establishes the token
+        self.assertEqual(hook.query(), ([], True))
+        self.assertEqual(hook.token, '1')
+        self.assertEqual(hook.query(), ([], False))
+
+        self.journal('B', 'dir/')
+        self.assertEqual(hook.query(), (['B', 'dir/'], False))
+        self.assertEqual(hook.token, '3')
+        self.assertEqual(hook.query(), ([], False))
+
+    def test_query_version1(self):
+        hook = fsmonitorhook.FsmonitorHook(self.hook, version=1)
+        self.journal('A')
+        self.assertEqual(hook.query(), ([], True))
+        self.journal('B')
+        self.assertEqual(hook.query(), (['B'], False))
+        self.assertEqual(hook.query(), ([], False))
+
+    def test_query_everything(self):
+        hook = fsmonitorhook.FsmonitorHook(self.hook, version=2)
+        hook.query()
+        # An unknown token means the daemon restarted
+        hook.token = 'stale'
+        self.assertEqual(hook.query(), ([], True))
+        self.journal('A')
+        self.assertEqual(hook.query(), (['A'], False))
+
+    def test_query_failure(self):
+        hook = fsmonitorhook.FsmonitorHook(self.hook, version=2)
+        hook.query()
+        self.touch('.git/fsmonitor-fail')
+        self.assertEqual(hook.query(), ([], True))
+        self.assertEqual(hook.token, None)
+
+    def test_command(self):
+        hook = fsmonitorhook.FsmonitorHook('watchman-hook', version=2)
+        self.assertEqual(hook.command('token'),
+                         ['watchman-hook', '2', 'token'])
+
+
+if __name__ == '__main__':
+    unittest.main()
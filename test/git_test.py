@@ -4,6 +4,7 @@
 from __future__ import absolute_import, division, unicode_literals
 
 import os
+import threading
 import time
 import unittest
 
@@ -296,5 +297,110 @@ class GitCommandTest(unittest.TestCase):
         self.assertEqual(err, '\0' * (1024 * 16 + 1))
 
 
+class IndexLockTestCase(unittest.TestCase):
+    """Tests the reader/writer lock used by Git.execute()"""
+
+    def test_is_readonly(self):
+        def readonly(*args):
+            return git.is_readonly(
+                ['git', '-c', 'diff.suppressBlankEmpty=false'] + list(args))
+
+        self.assertTrue(readonly('log', '-1'))
+        self.assertTrue(readonly('rev-parse', 'HEAD'))
+        self.assertTrue(readonly('diff', '--cached', '--', 'A'))
+        self.assertFalse(readonly('diff', '--', 'A'))
+        self.assertFalse(readonly('diff', 'HEAD', '--', '--cached'))
+        self.assertTrue(readonly('config', '--get-all', 'user.name'))
+        self.assertFalse(readonly('config', 'user.name', 'value'))
+        self.assertTrue(readonly('branch'))
+        self.assertTrue(readonly('branch', '--contains', 'HEAD'))
+        self.assertFalse(readonly('branch', 'topic'))
+        self.assertFalse(readonly('branch', '--set-upstream-to=origin/a'))
+        self.assertTrue(readonly('remote', '-v'))
+        self.assertFalse(readonly('remote', 'add', 'origin', 'url'))
+        self.assertTrue(readonly('stash', 'list'))
+        self.assertFalse(readonly('stash'))
+        self.assertTrue(readonly('describe'))
+        self.assertFalse(readonly('describe', '--dirty'))
+        self.assertFalse(readonly('status'))
+        self.assertFalse(readonly('add', 'A'))
+        self.assertFalse(readonly('commit-tree-like-unknown'))
+        self.assertFalse(git.is_readonly(['python', '-c', 'pass']))
+        self.assertFalse(git.is_readonly(['git']))
+
+    def test_readers_are_concurrent(self):
+        lock = git.IndexLock()
+        lock.acquire_read()
+        acquired = threading.Event()
+
+        def read():
+            lock.acquire_read()
+            acquired.set()
+            lock.release_read()
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        self.assertTrue(acquired.wait(5.0))
+        thread.join()
+        lock.release_read()
+
+        stats = lock.stats()
+        self.assertEqual(stats['reads'], 2)
+        self.assertEqual(stats['max_readers'], 2)
+        self.assertEqual(stats['contended'], 0)
+
+    def test_held(self):
+        lock = git.IndexLock()
+        with lock.held(readonly=True):
+            self.assertEqual(lock.stats()['readers'], 1)
+        try:
+            with lock.held(readonly=False):
+                self.assertTrue(lock.stats()['writing'])
+                raise ValueError('released on errors')
+        except ValueError:
+            pass
+        stats = lock.stats()
+        self.assertEqual(stats['readers'], 0)
+        self.assertFalse(stats['writing'])
+        self.assertEqual((stats['reads'], stats['writes']), (1, 1))
+
+    def test_writers_are_exclusive(self):
+        lock = git.IndexLock()
+        lock.acquire_read()
+        events = []
+
+        def write():
+            lock.acquire_write()
+            events.append('write')
+            lock.release_write()
+
+        def read():
+            lock.acquire_read()
+            events.append('read')
+            lock.release_read()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        while not lock.stats()['writing'] and not lock._waiting_writers:
+            time.sleep(0.001)
+        # A waiting writer blocks new readers
+        reader = threading.Thread(target=read)
+        reader.start()
+        time.sleep(0.05)
+        self.assertEqual(events, [])
+
+        lock.release_read()
+        writer.join()
+        reader.join()
+        self.assertEqual(events, ['write', 'read'])
+
+        stats = lock.stats()
+        self.assertEqual(stats['writes'], 1)
+        self.assertEqual(stats['reads'], 2)
+        self.assertEqual(stats['contended'], 2)
+        self.assertFalse(stats['writing'])
+        self.assertEqual(stats['readers'], 0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,6 @@
 from __future__ import absolute_import, division, unicode_literals
 
+import os
 import unittest
 
 from cola import gitcfg
@@ -90,6 +91,63 @@ class GitConfigTestCase(helper.GitRepositoryTestCase):
         opts = self.config.get_guitool_opts('Meow Cat')
         self.assertEqual(opts['cmd'], 'cat hello')
 
+    def test_include_files(self):
+        self.write_file('.git/included', '[test]\n\tvalue = included\n')
+        self.git('config', 'include.path', 'included')
+        self.assertEqual(self.config.get('test.value'), 'included')
+        self.assertEqual(self.config.get_repo('test.value'), 'included')
+
+        # Changes to included files are noticed.  The mtime is moved
+        # forward in case the write lands within the filesystem's timestamp
+        # resolution.
+        path = os.path.join('.git', 'included')
+        mtime = os.stat(path).st_mtime
+        self.write_file(path, '[test]\n\tvalue = changed\n')
+        os.utime(path, (mtime + 2, mtime + 2))
+        self.assertEqual(self.config.get('test.value', cached=False),
+                         'changed')
+
+    def test_set_repo(self):
+        self.assertEqual(self.config.get('test.value'), None)
+        self.config.set_repo('test.value', 'abc')
+        self.assertEqual(self.config.get('test.value'), 'abc')
+        self.assertEqual(self.config.get_repo('test.value'), 'abc')
+        self.config.set_repo('test.value', None)
+        self.assertEqual(self.config.get('test.value'), None)
+
+    def test_command_line_values_are_ignored(self):
+        self.git('config', 'test.value', 'repo')
+        self.config.update()
+        self.assertEqual(self.config.get('diff.suppressblankempty'), None)
+        self.assertEqual(self.config.get('test.value'), 'repo')
+
+    def test_file_attributes(self):
+        self.write_file('.gitattributes',
+                        '*.txt encoding=iso-8859-1\n*.bin binary\n')
+        self.assertEqual(self.config.file_encoding('a.txt'), 'iso-8859-1')
+        attrs = self.config.file_attributes(['a.txt', 'b.bin', 'c'])
+        self.assertEqual(attrs[0]['encoding'], 'iso-8859-1')
+        self.assertEqual(attrs[1]['binary'], 'set')
+        self.assertEqual(attrs[1]['diff'], 'unset')
+        self.assertEqual(attrs[2]['encoding'], 'unspecified')
+        self.assertEqual(self.config.file_encodings(['a.txt', 'c']),
+                         ['iso-8859-1', None])
+
+    def test_file_attributes_are_refreshed(self):
+        self.write_file('.gitattributes', '*.txt encoding=iso-8859-1\n')
+        self.assertEqual(self.config.file_encoding('sub/a.txt'), 'iso-8859-1')
+
+        # A new .gitattributes file in a subdirectory is noticed
+        os.mkdir('sub')
+        self.write_file(os.path.join('sub', '.gitattributes'),
+                        '*.txt encoding=utf-16\n')
+        self.assertEqual(self.config.file_encoding('sub/a.txt'), 'utf-16')
+
+        # Changes to existing files are noticed
+        self.write_file('.gitattributes', '*.txt encoding=cp1252\n')
+        os.utime('.gitattributes', (0, 0))
+        self.assertEqual(self.config.file_encoding('a.txt'), 'cp1252')
+
 
 if __name__ == '__main__':
     unittest.main()
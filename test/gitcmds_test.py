@@ -1,8 +1,10 @@
 from __future__ import absolute_import, division, unicode_literals
 
+import io
 import os
 import unittest
 
+from cola import diffparse
 from cola import gitcmds
 from cola import gitcfg
 
@@ -122,6 +124,255 @@ class GitCmdsTestCase(helper.GitRepositoryTestCase):
                          ['origin/a', 'origin/b', 'origin/c', 'origin/master'])
         self.assertEqual(tags, ['f', 'e', 'd'])
 
+    def test_cat_file_batch(self):
+        self.write_file('A', 'a\n')
+        self.git('commit', '-a', '-m', 'subject\n\nbody line 1\nline 2')
+        git = gitcmds.git
+        objects = git.cat_file_batch(['HEAD:A', 'HEAD:missing', 'HEAD:B'])
+        self.assertEqual(3, len(objects))
+        self.assertEqual('blob', objects[0].objtype)
+        self.assertEqual(b'a\n', objects[0].data)
+        self.assertEqual(None, objects[1])
+        self.assertEqual(b'', objects[2].data)
+
+        info = git.cat_file_batch_check(['HEAD:A'])[0]
+        self.assertEqual(2, info.size)
+        self.assertEqual(None, info.data)
+
+        self.assertEqual('body line 1\nline 2\n',
+                         gitcmds.commit_body('HEAD'))
+
+    def test_cat_file_batch_pipelines_requests(self):
+        git = gitcmds.git
+        count = 2000
+        objects = git.cat_file_batch(['HEAD:A', 'HEAD:missing'] * count)
+        self.assertEqual(count * 2, len(objects))
+        self.assertEqual(count, len([obj for obj in objects if obj is None]))
+
+    def test_cat_file_batch_restarts(self):
+        git = gitcmds.git
+        self.assertEqual('blob', git.cat_file_batch(['HEAD:A'])[0].objtype)
+        git._cat_file_process()._proc.kill()
+        self.assertEqual('blob', git.cat_file_batch(['HEAD:A'])[0].objtype)
+
+    def test_cat_file_stream(self):
+        content = ''.join('line %d\n' % idx for idx in range(1000))
+        self.write_file('A', content)
+        self.git('commit', '-a', '-m', 'update A')
+        proc = gitcmds.git._cat_file_process()
+        out = io.BytesIO()
+        info = proc.stream('HEAD:A', out, chunk_size=100)
+        self.assertEqual(('blob', len(content)), (info.objtype, info.size))
+        self.assertEqual(None, info.data)
+        self.assertEqual(content.encode('ascii'), out.getvalue())
+
+        # Other object types are skipped and the process stays in sync
+        out = io.BytesIO()
+        self.assertEqual('tree', proc.stream('HEAD^{tree}', out).objtype)
+        self.assertEqual(None, proc.stream('HEAD:missing', out))
+        self.assertEqual(b'', out.getvalue())
+        info = proc.stream('HEAD:B', out)
+        self.assertEqual(('blob', 0), (info.objtype, info.size))
+        self.assertEqual(b'', out.getvalue())
+
+    def test_write_blob_requires_a_blob(self):
+        self.assertEqual(None, gitcmds.write_blob('HEAD^{tree}', 'A'))
+        self.assertEqual(None, gitcmds.cat_file_blob('A', 'HEAD^{tree}'))
+        self.assertEqual(None, gitcmds.cat_file_blob('A', 'HEAD:missing'))
+
+    def test_write_blob(self):
+        self.write_file('A', 'a\n')
+        self.git('commit', '-a', '-m', 'update A')
+        oid = self.git('rev-parse', 'HEAD:A').strip()
+        path = gitcmds.write_blob(oid, 'A')
+        try:
+            self.assertTrue(path.endswith('-A'))
+            with open(path) as f:
+                self.assertEqual('a\n', f.read())
+        finally:
+            os.unlink(path)
+
+    def test_parse_status_v2(self):
+        out = '\0'.join([
+            '# branch.oid 1234',
+            '# branch.head master',
+            '# branch.upstream origin/master',
+            '# branch.ab +2 -3',
+            '1 M. N... 100644 100644 100644 1234 5678 staged file',
+            '1 .D N... 100644 100644 000000 1234 1234 deleted',
+            '1 .M SC.. 160000 160000 160000 1234 1234 submodule',
+            '2 R. N... 100644 100644 100644 1234 1234 R100 new',
+            'old',
+            'u UU N... 100644 100644 100644 100644 1 2 3 conflict',
+            '? untracked file',
+            '',
+        ])
+        state = gitcmds.parse_status_v2(out)
+        self.assertEqual(['new', 'old', 'staged file'], state['staged'])
+        self.assertEqual(set(['old']), state['staged_deleted'])
+        self.assertEqual(['deleted', 'submodule'], state['modified'])
+        self.assertEqual(set(['deleted']), state['unstaged_deleted'])
+        self.assertEqual(set(['submodule']), state['submodules'])
+        self.assertEqual(['conflict'], state['unmerged'])
+        self.assertEqual(['untracked file'], state['untracked'])
+        self.assertEqual('master', state['branch'])
+        self.assertEqual('origin/master', state['upstream'])
+        self.assertEqual(2, state['ahead'])
+        self.assertEqual(3, state['behind'])
+
+    def test_status_worktree_state_matches_diff_worktree_state(self):
+        os.mkdir('dir')
+        self.touch('C', 'dir/D', 'dir/E')
+        self.git('add', 'C', 'dir')
+        self.git('commit', '-m', 'add files')
+        self.write_file('A', 'modified\n')
+        self.write_file('C', 'staged\n')
+        self.git('add', 'C')
+        self.git('rm', '-q', 'B')
+        os.unlink('dir/D')
+        self.touch('dir/untracked', 'untracked')
+
+        expect = gitcmds.diff_worktree_state()
+        actual = gitcmds.status_worktree_state()
+        for key in expect:
+            self.assertEqual(expect[key], actual[key])
+        self.assertEqual('master', actual['branch'])
+        self.assertEqual(None, actual['upstream'])
+
+        expect = gitcmds.diff_worktree_state(display_untracked=False,
+                                             paths=['dir'])
+        actual = gitcmds.status_worktree_state(display_untracked=False,
+                                               paths=['dir'])
+        for key in expect:
+            self.assertEqual(expect[key], actual[key])
+
+    def test_status_worktree_state_upstream(self):
+        self.git('remote', 'add', 'origin', '.')
+        self.git('fetch', 'origin')
+        self.git('branch', '--set-upstream-to=origin/master')
+        self.write_file('A', 'upstream\n')
+        self.git('commit', '-a', '-m', 'upstream change')
+        self.git('fetch', 'origin')
+        self.git('reset', '-q', '--hard', 'HEAD^')
+        self.config.reset()
+        gitcfg.current().reset()
+
+        state = gitcmds.status_worktree_state()
+        self.assertEqual(0, state['ahead'])
+        self.assertEqual(1, state['behind'])
+        self.assertEqual(['A'], state['upstream_changed'])
+        self.assertEqual(gitcmds.diff_worktree_state()['upstream_changed'],
+                         state['upstream_changed'])
+
+    def test_last_commits(self):
+        os.mkdir('dir')
+        self.write_file('dir/a', 'a\n')
+        self.write_file('dir/b', 'b\n')
+        self.git('add', 'dir')
+        self.git('commit', '-m', 'add dir')
+        self.write_file('A', 'change\n')
+        self.git('commit', '-a', '-m', 'change A')
+        self.write_file('untracked', 'untracked\n')
+
+        paths = ['A', 'B', 'dir', 'dir/a', 'untracked']
+        commits = gitcmds.last_commits(paths)
+        self.assertEqual(sorted(commits), ['A', 'B', 'dir', 'dir/a'])
+        self.assertEqual(commits['A'][1:], ('change A', 'Your Name'))
+        self.assertEqual(commits['B'][1:], ('initial commit', 'Your Name'))
+        self.assertEqual(commits['dir'][1:], ('add dir', 'Your Name'))
+        self.assertEqual(commits['dir/a'][1:], ('add dir', 'Your Name'))
+
+        # Records that span chunks and a walk of the whole history
+        commits = gitcmds.last_commits(paths, pathspecs=[], chunk_size=3)
+        self.assertEqual(sorted(commits), ['A', 'B', 'dir', 'dir/a'])
+        self.assertEqual(commits['dir/a'][1:], ('add dir', 'Your Name'))
+
+        # The walk is limited to the pathspecs
+        commits = gitcmds.last_commits(['dir/a', 'dir/b', 'A'],
+                                       pathspecs=['dir'])
+        self.assertEqual(sorted(commits), ['dir/a', 'dir/b'])
+
+        self.assertEqual(gitcmds.last_commits([]), {})
+
+    def test_paths_state(self):
+        self.write_file('A', 'change\n')
+        self.write_file('B', 'change\n')
+        self.git('add', 'B')
+        self.write_file('C', 'untracked\n')
+        self.write_file('D', 'untracked\n')
+        os.remove('B')
+
+        state = gitcmds.paths_state(['A', 'B', 'C'])
+        self.assertEqual(state['staged'], ['B'])
+        self.assertEqual(state['modified'], ['A', 'B'])
+        self.assertEqual(state['untracked'], ['C'])
+        self.assertEqual(state['unstaged_deleted'], set(['B']))
+        self.assertFalse('branch' in state)
+
+        # The diff-based scanner is used when amending
+        state = gitcmds.paths_state(['A', 'B', 'C'], head='HEAD^')
+        self.assertEqual(state['modified'], ['A', 'B'])
+        self.assertEqual(state['untracked'], ['C'])
+
+        # Paths are not globs
+        self.write_file('[C]', 'untracked\n')
+        self.assertEqual(gitcmds.paths_state(['[C]'])['untracked'], ['[C]'])
+
+    def test_diff_helper_max_size(self):
+        self.write_file('A', ''.join('%d\n' % i for i in range(100)))
+        self.git('commit', '-a', '-m', 'numbers')
+        self.write_file('A', ''.join(('%d\n' if i % 10 else 'x%d\n') % i
+                                     for i in range(100)))
+
+        diff = gitcmds.diff_helper(filename='A', cached=False)
+        self.assertFalse(diff.truncated)
+
+        diff = gitcmds.diff_helper(filename='A', cached=False, max_size=400)
+        self.assertTrue(diff.truncated)
+        self.assertTrue(len(diff) < 400)
+        # The partial last hunk is dropped
+        self.assertTrue(diff.startswith('@@ -1,4 +1,4 @@'))
+        hunk = diffparse.ParsedDiff(diff).hunks[-1]
+        self.assertEqual(len(hunk.lines), 1 + hunk.old_count + 1)
+
+    def test_diff_cache(self):
+        cache = gitcmds.DiffCache(size=2)
+        self.write_file('A', 'change\n')
+        key = cache.key('A')
+        self.assertEqual(cache.get(key), None)
+        diff = cache.diff(key, 'A')
+        self.assertTrue('+change' in diff.text)
+        self.assertEqual(cache.get(cache.key('A')), diff)
+
+        # Modifying the file changes the key
+        self.write_file('A', 'another change\n')
+        os.utime('A', (0, 0))
+        self.assertEqual(cache.get(cache.key('A')), None)
+
+        # Staging the file invalidates diffs of the index
+        key = cache.key('A', cached=True, ref='HEAD')
+        diff = cache.diff(key, 'A', cached=True, ref='HEAD')
+        self.assertTrue('+change' not in diff.text)
+        self.git('add', 'A')
+        self.assertEqual(cache.get(cache.key('A', cached=True, ref='HEAD')),
+                         None)
+
+        # Lookups and computed diffs are counted
+        self.assertEqual(cache.stats()['entries'], 2)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_diff_cache_key_outside_the_worktree_root(self):
+        cache = gitcmds.DiffCache()
+        self.write_file('A', 'change\n')
+        os.mkdir('sub')
+        os.chdir('sub')
+        key = cache.key('A')
+        self.assertEqual(cache.key('A'), key)
+        self.write_file(os.path.join('..', 'A'), 'another change\n')
+        os.utime(os.path.join('..', 'A'), (0, 0))
+        self.assertNotEqual(cache.key('A'), key)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,161 @@
+from __future__ import absolute_import, division, unicode_literals
+import os
+import unittest
+
+from cola import core
+from cola import gitcfg
+from cola import gitignore
+
+from test import helper
+
+
+# The patterns with trailing spaces are concatenated so that the spaces
+# are not stripped from the source
+ROOT_IGNORE = r'''# comment
+*.o
+!keep.o
+build/
+/top-only
+doc/*.html
+**/logs
+cache/**
+a/**/z
+\#hash
+''' + 'trail\\ \n' + 'spaces   \n' + r'''foo[0-9].txt
+bar[!a-c].txt
+[[:upper:]]*.up
+x?y
+deep/nested/file
+a**b
+'''
+
+SUB_IGNORE = '''!*.o
+local
+/anchored
+'''
+
+PATHS = [
+    'a.o', 'src/b.o', 'keep.o', 'build/x', 'src/build/y', 'build', 'top-only',
+    'src/top-only', 'doc/a.html', 'doc/sub/a.html', 'logs/x', 'src/logs/y',
+    'cache/x', 'cache/d/e', 'a/z', 'a/b/z', 'a/b/c/z', 'ab/z', '#hash',
+    'trail ', 'trail', 'spaces', 'foo1.txt', 'foox.txt', 'bara.txt',
+    'bard.txt', 'Hello.up', 'hello.up', 'xzy', 'x/y', 'deep/nested/file',
+    'nested/file', 'aXXb', 'inner/a.o', 'inner/local', 'inner/x/local',
+    'inner/anchored', 'inner/x/anchored', 'excluded', 'q.info', 'q.global',
+    'normal.txt',
+]
+
+DIRS = ['build', 'src/build', 'logs', 'cache/d', 'inner/x']
+
+
+class IgnoreMatcherTestCase(helper.GitRepositoryTestCase):
+    """Compare IgnoreMatcher with "git check-ignore" """
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        self.write_file('.gitignore', ROOT_IGNORE)
+        os.makedirs('inner')
+        self.write_file(os.path.join('inner', '.gitignore'), SUB_IGNORE)
+        self.write_file(os.path.join('.git', 'info', 'exclude'),
+                        'excluded\n*.info\n')
+        self.write_file('global-ignore', '*.global\n!*.info\n')
+        self.git('config', 'core.excludesfile', self.test_path('global-ignore'))
+        self.config = gitcfg.current()
+        self.config.reset()
+        for path in DIRS:
+            os.makedirs(path)
+        for path in PATHS:
+            dirname = os.path.dirname(path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            if not os.path.exists(path):
+                self.touch(path)
+
+    def matcher(self):
+        return gitignore.IgnoreMatcher(
+            self.test_path(), self.test_path('.git'), self.config)
+
+    def check_ignore(self, paths):
+        proc = core.start_command(['git', 'check-ignore', '-z', '--stdin'])
+        out, err = proc.communicate(core.encode('\0'.join(paths)))
+        return set(path for path in core.decode(out).split('\0') if path)
+
+    def test_matches_check_ignore(self):
+        expect = self.check_ignore(PATHS)
+        matcher = self.matcher()
+        actual = set(path for path in PATHS if matcher.is_ignored(path))
+        self.assertEqual(actual, expect)
+
+    def test_ignored_directory_prefix(self):
+        matcher = self.matcher()
+        self.assertTrue(matcher.is_ignored('build/a/b/c'))
+        # Files below an excluded directory cannot be re-included
+        self.write_file(os.path.join('build', '.gitignore'), '!*\n')
+        self.assertTrue(matcher.is_ignored('build/x'))
+
+    def test_refresh(self):
+        matcher = self.matcher()
+        self.assertFalse(matcher.refresh())
+        self.assertFalse(matcher.is_ignored('normal.txt'))
+
+        self.append_file('.gitignore', '*.txt\n')
+        self.assertTrue(matcher.refresh())
+        self.assertTrue(matcher.is_ignored('normal.txt'))
+        self.assertFalse(matcher.refresh())
+
+        self.assertFalse(matcher.is_ignored('inner/a.o'))
+        self.write_file(os.path.join('inner', '.gitignore'), '')
+        self.assertTrue(matcher.refresh())
+        self.assertTrue(matcher.is_ignored('inner/a.o'))
+
+    def test_ignore_case(self):
+        matcher = self.matcher()
+        self.assertFalse(matcher.is_ignored('A.O'))
+        self.git('config', 'core.ignorecase', 'true')
+        self.config.reset()
+        self.assertTrue(matcher.refresh())
+        self.assertTrue(matcher.is_ignored('A.O'))
+
+
+class TranslateTestCase(unittest.TestCase):
+
+    def match(self, pattern, path):
+        return gitignore.Pattern(pattern).regex.match(path) is not None
+
+    def test_star(self):
+        self.assertTrue(self.match('*.c', 'main.c'))
+        self.assertFalse(self.match('a*c', 'a/c'))
+
+    def test_double_star(self):
+        self.assertTrue(self.match('a/**/z', 'a/z'))
+        self.assertTrue(self.match('a/**/z', 'a/b/c/z'))
+        self.assertTrue(self.match('**/z', 'z'))
+        self.assertTrue(self.match('a/**', 'a/b/c'))
+        # "**" next to other characters is a plain "*"
+        self.assertFalse(self.match('a**z', 'a/z'))
+
+    def test_brackets(self):
+        self.assertTrue(self.match('[a-c]', 'b'))
+        self.assertFalse(self.match('[!a-c]', 'b'))
+        self.assertTrue(self.match('[]]', ']'))
+        self.assertTrue(self.match('[[:digit:]]', '7'))
+        self.assertFalse(self.match('a[/]b', 'a/b'))
+        self.assertFalse(self.match('[a-c', '[a-c'))
+
+    def test_escapes(self):
+        self.assertTrue(self.match('\\*', '*'))
+        self.assertFalse(self.match('\\*', 'x'))
+        self.assertFalse(self.match('a\\', 'a'))
+
+    def test_parse(self):
+        patterns = gitignore.parse('# comment\n\n!keep\\ \ndir/ \r\n/top\n')
+        self.assertEqual([p.text for p in patterns],
+                         ['!keep\\ ', 'dir/', '/top'])
+        self.assertTrue(patterns[0].negative)
+        self.assertTrue(patterns[1].must_be_dir)
+        self.assertTrue(patterns[1].basename)
+        self.assertFalse(patterns[2].basename)
+
+
+if __name__ == '__main__':
+    unittest.main()
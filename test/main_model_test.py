@@ -73,6 +73,253 @@ class MainModelTestCase(helper.GitRepositoryTestCase):
         self.model.update_status()
         self.assertEqual(self.model.tags, ['test'])
 
+    def test_gather_status_does_not_modify_model(self):
+        """gather_status() queries without touching the model"""
+        self.write_file('C', 'C')
+        status = self.model.gather_status()
+        self.assertEqual(self.model.untracked, [])
+
+        self.model.apply_status(status)
+        self.assertEqual(self.model.untracked, ['C'])
+        self.assertEqual(self.model.currentbranch, 'master')
+        self.assertEqual(self.model.local_branches, ['master'])
+
+
+class ManualRunner(object):
+    """Run refreshes when told to, like a thread pool would"""
+
+    def __init__(self):
+        self.queue = []
+
+    def __call__(self, fn, callback):
+        self.queue.append((fn, callback))
+
+    def run(self):
+        fn, callback = self.queue.pop(0)
+        callback(fn())
+
+
+class StatusRefresherTestCase(helper.GitRepositoryTestCase):
+    """Tests the StatusRefresher class."""
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        self.model = main.MainModel(cwd=core.getcwd())
+        self.runner = ManualRunner()
+        self.refresher = self.model.refresher
+        self.refresher.set_runner(self.runner)
+
+    def test_refresh_is_applied_when_finished(self):
+        self.write_file('C', 'C')
+        self.refresher.refresh()
+        self.assertEqual(self.model.untracked, [])
+
+        self.runner.run()
+        self.assertEqual(self.model.untracked, ['C'])
+        self.assertEqual(self.refresher.applied, 1)
+
+    def test_requests_are_coalesced(self):
+        self.refresher.refresh()
+        self.write_file('C', 'C')
+        for _ in range(5):
+            self.refresher.refresh()
+        # Only one refresh is in flight
+        self.assertEqual(len(self.runner.queue), 1)
+
+        # The result is applied and one follow-up is started
+        self.runner.run()
+        self.assertEqual(self.refresher.applied, 1)
+        self.assertEqual(len(self.runner.queue), 1)
+
+        self.runner.run()
+        self.assertEqual(self.model.untracked, ['C'])
+        self.assertEqual(self.refresher.requested, 6)
+        self.assertEqual(self.refresher.started, 2)
+        self.assertEqual(self.refresher.applied, 2)
+        self.assertEqual(self.refresher.discarded, 0)
+        self.assertFalse(self.runner.queue)
+
+    def test_continuous_requests_are_applied(self):
+        # A steady stream of requests, e.g. a build writing files
+        self.refresher.refresh()
+        for idx in range(5):
+            self.write_file('C%d' % idx, 'C')
+            self.refresher.refresh()
+            self.runner.run()
+            self.assertEqual(len(self.model.untracked), idx + 1)
+        self.runner.run()
+        self.assertEqual(self.refresher.applied, 6)
+        self.assertFalse(self.runner.queue)
+
+    def test_synchronous_update_cancels_refresh(self):
+        self.refresher.refresh()
+        self.write_file('C', 'C')
+        self.model.update_status()
+        self.assertEqual(self.model.untracked, ['C'])
+
+        # The stale result does not clobber the newer status
+        self.runner.run()
+        self.assertEqual(self.model.untracked, ['C'])
+        self.assertEqual(self.refresher.discarded, 1)
+
+    def test_staging_cancels_refresh(self):
+        self.write_file('C', 'C')
+        self.model.update_status()
+        self.refresher.refresh()
+        self.git('add', 'C')
+        self.model.update_file_status()
+        self.assertEqual(self.model.staged, ['C'])
+
+        # The refresh that started before staging is discarded
+        self.runner.run()
+        self.assertEqual(self.model.staged, ['C'])
+        self.assertEqual(self.refresher.discarded, 1)
+
+    def test_refresh_paths(self):
+        self.model.update_status()
+        self.write_file('A', 'change')
+        self.write_file('C', 'C')
+        self.write_file('D', 'D')
+        self.refresher.refresh_paths(['A', 'C'])
+        self.runner.run()
+        self.assertEqual(self.model.modified, ['A'])
+        self.assertEqual(self.model.untracked, ['C'])
+
+        # Paths that are no longer changed are removed
+        self.write_file('A', '')
+        self.refresher.refresh_paths(['A'])
+        self.runner.run()
+        self.assertEqual(self.model.modified, [])
+        self.assertEqual(self.model.untracked, ['C'])
+
+    def test_refresh_deleted_directory(self):
+        os.makedirs(os.path.join('dir', 'sub'))
+        self.write_file('dir/tracked', 'tracked')
+        self.git('add', 'dir/tracked')
+        self.git('commit', '-m', 'add dir')
+        self.write_file('dir/untracked', 'untracked')
+        self.write_file('dir/sub/untracked', 'untracked')
+        self.write_file('dir/tracked', 'change')
+        self.model.update_status()
+        self.assertEqual(self.model.modified, ['dir/tracked'])
+        self.assertEqual(self.model.untracked,
+                         ['dir/sub/untracked', 'dir/untracked'])
+
+        # A directory entry replaces the status of everything below it
+        core.unlink('dir/tracked')
+        core.unlink('dir/untracked')
+        core.unlink('dir/sub/untracked')
+        os.rmdir(os.path.join('dir', 'sub'))
+        os.rmdir('dir')
+        self.refresher.refresh_paths(['dir'])
+        self.runner.run()
+        self.assertEqual(self.model.modified, ['dir/tracked'])
+        self.assertEqual(self.model.unstaged_deleted, set(['dir/tracked']))
+        self.assertEqual(self.model.untracked, [])
+
+    def test_refresh_paths_are_merged(self):
+        self.refresher.refresh_paths(['A'])
+        self.refresher.refresh_paths(['B'])
+        self.refresher.refresh_paths(['C'])
+        self.assertEqual(self.refresher.paths, set(['B', 'C']))
+        # The running refresh is still applied
+        self.runner.run()
+        self.assertEqual(self.refresher.applied, 1)
+        self.assertEqual(self.refresher.discarded, 0)
+        self.assertEqual(len(self.runner.queue), 1)
+
+    def test_full_refresh_replaces_paths(self):
+        self.refresher.refresh_paths(['A'])
+        self.refresher.refresh_paths(['B'])
+        self.refresher.refresh()
+        self.refresher.refresh_paths(['C'])
+        self.assertEqual(self.refresher.paths, set())
+        self.runner.run()
+        self.assertEqual(self.refresher.applied, 1)
+        # The follow-up is a full refresh
+        self.assertTrue(self.refresher.full_seconds == 0.0)
+        self.runner.run()
+        self.assertTrue(self.refresher.full_seconds > 0.0)
+        self.assertFalse(self.runner.queue)
+
+    def test_refresh_costs_are_measured(self):
+        self.assertEqual(self.refresher.full_seconds, 0.0)
+        self.refresher.refresh()
+        self.runner.run()
+        self.assertTrue(self.refresher.full_seconds > 0.0)
+        self.assertEqual(self.refresher.paths_seconds, 0.0)
+
+        self.refresher.refresh_paths(['A'])
+        self.runner.run()
+        self.assertTrue(self.refresher.paths_seconds > 0.0)
+
+    def test_moving_average(self):
+        self.assertEqual(main._moving_average(0.0, 2.0), 2.0)
+        self.assertAlmostEqual(main._moving_average(1.0, 2.0), 1.3)
+
+    def test_too_many_paths_refresh_everything(self):
+        self.refresher.max_paths = 2
+        self.refresher.refresh_paths(['A', 'B', 'C'])
+        self.assertTrue(self.runner.queue)
+        self.write_file('D', 'D')
+        self.runner.run()
+        self.assertEqual(self.model.untracked, ['D'])
+
+    def test_update_index_is_merged(self):
+        self.refresher.refresh()
+        self.refresher.refresh(update_index=True)
+        self.refresher.refresh()
+        self.assertTrue(self.refresher.update_index)
+        self.runner.run()
+        self.assertFalse(self.refresher.update_index)
+
+
+class DiffLoaderTestCase(unittest.TestCase):
+    """Tests the DiffLoader class."""
+
+    def setUp(self):
+        self.runner = ManualRunner()
+        self.loader = main.DiffLoader()
+        self.loader.set_runner(self.runner)
+        self.results = []
+
+    def load(self, value):
+        self.loader.load(lambda: value, self.results.append)
+
+    def test_synchronous_without_runner(self):
+        loader = main.DiffLoader()
+        loader.load(lambda: 'a', self.results.append)
+        self.assertEqual(self.results, ['a'])
+
+    def test_superseded_requests_are_discarded(self):
+        for value in ('a', 'b', 'c', 'd'):
+            self.load(value)
+        # Only one diff is in flight and only the latest request is kept
+        self.assertEqual(len(self.runner.queue), 1)
+
+        self.runner.run()
+        self.assertEqual(self.results, [])
+        self.assertEqual(self.loader.discarded, 1)
+
+        self.runner.run()
+        self.assertEqual(self.results, ['d'])
+        self.assertEqual(self.loader.requested, 4)
+        self.assertEqual(self.loader.started, 2)
+        self.assertEqual(self.loader.applied, 1)
+        self.assertFalse(self.runner.queue)
+
+    def test_cancel(self):
+        self.load('a')
+        self.load('b')
+        self.loader.cancel()
+        self.runner.run()
+        self.assertEqual(self.results, [])
+        self.assertFalse(self.runner.queue)
+
+        self.load('c')
+        self.runner.run()
+        self.assertEqual(self.results, ['c'])
+
 
 class RemoteArgsTestCase(unittest.TestCase):
 
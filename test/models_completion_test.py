@@ -0,0 +1,54 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+from cola.models import completion
+
+
+def ref_sort_key(ref):
+    return len(ref), ref
+
+
+class CompletionIndexTestCase(unittest.TestCase):
+
+    def test_matches_are_ranked(self):
+        refs = ['origin/main', 'main', 'v1.0', 'maint']
+        index = completion.CompletionIndex(refs, sort_key=ref_sort_key)
+        self.assertEqual(index.matches('', False),
+                         ['main', 'v1.0', 'maint', 'origin/main'])
+        self.assertEqual(index.matches('ma', False),
+                         ['main', 'maint', 'origin/main'])
+        self.assertEqual(index.matches('ma', False, limit=2),
+                         ['main', 'maint'])
+
+    def test_case_sensitivity(self):
+        index = completion.CompletionIndex(['README', 'readme.txt'])
+        self.assertEqual(index.matches('read', False),
+                         ['README', 'readme.txt'])
+        self.assertEqual(index.matches('READ', True), ['README'])
+
+    def test_narrowing_and_widening(self):
+        index = completion.CompletionIndex(['abc', 'abd', 'xbc'])
+        self.assertEqual(index.matches('b', False), ['abc', 'abd', 'xbc'])
+        self.assertEqual(index.matches('bc', False), ['abc', 'xbc'])
+        self.assertEqual(index.matches('abc', False), ['abc'])
+        # Deleting characters searches all of the candidates again
+        self.assertEqual(index.matches('ab', False), ['abc', 'abd'])
+
+    def test_parents(self):
+        paths = ['a/b/c.txt', 'a/d.txt', 'e.txt']
+        index = completion.CompletionIndex(paths, parents=True)
+        self.assertEqual(index.dirs, set(['a', 'a/b']))
+        self.assertEqual(index.matches('a/', False),
+                         ['a/b', 'a/b/c.txt', 'a/d.txt'])
+
+    def test_cache(self):
+        cache = completion.CompletionIndexCache()
+        paths = ['a', 'b']
+        index = cache.index(paths)
+        self.assertTrue(cache.index(list(paths)) is index)
+        self.assertFalse(cache.index(['a', 'c']) is index)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,384 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import random
+import unittest
+
+from cola import core
+from cola.models import dag
+
+from test import helper
+
+
+def log_entry(oid, parents, tags=''):
+    """Return a `git log --pretty=<dag.logfmt>` line"""
+    return dag.logsep.join((
+        oid, ' '.join(parents), tags,
+        'Author', '2018-01-01', 'author@example.com', 'summary ' + oid))
+
+
+def synthetic_history(count, seed=0):
+    """Return log entries for a branchy history in `--reverse` topo order"""
+    rng = random.Random(seed)
+    entries = []
+    tips = []
+    for idx in range(count):
+        oid = '%040x' % (idx + 1)
+        if not tips:
+            parents = []
+        elif len(tips) > 1 and rng.random() < 0.1:
+            # merge two branches
+            first, second = rng.sample(range(len(tips)), 2)
+            parents = [tips[first], tips[second]]
+            tips.pop(max(first, second))
+        elif rng.random() < 0.1:
+            # start a new branch from an existing commit
+            parents = [entries[rng.randrange(len(entries))][:40]]
+            tips.append(oid)
+        else:
+            tip = rng.randrange(len(tips))
+            parents = [tips[tip]]
+            tips[tip] = oid
+        if not tips:
+            tips.append(oid)
+        elif parents and parents[0] in tips:
+            tips[tips.index(parents[0])] = oid
+        tags = ''
+        if rng.random() < 0.05:
+            tags = ' (tag: refs/tags/v%d)' % idx
+        entries.append(log_entry(oid, parents, tags=tags))
+    return entries
+
+
+def parse(entries):
+    dag.CommitFactory.reset()
+    return [dag.CommitFactory.new(log_entry=entry) for entry in entries]
+
+
+def cells(commits):
+    return [(c.oid, c.column, c.row) for c in commits]
+
+
+class GraphLayoutTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        dag.CommitFactory.reset()
+
+    def full_layout(self, commits):
+        layout = dag.GraphLayout()
+        layout.add_commits(commits)
+        return cells(commits)
+
+    def test_incremental_layout_matches_full_layout(self):
+        for seed in range(5):
+            commits = parse(synthetic_history(800, seed=seed))
+            expect = self.full_layout(commits)
+
+            layout = dag.GraphLayout()
+            for idx in range(0, len(commits), 37):
+                layout.add_commits(commits[idx:idx + 37])
+            self.assertEqual(expect, cells(commits))
+
+    def test_appending_tips_places_new_commits_only(self):
+        entries = [log_entry('%040x' % (idx + 1),
+                             idx and ['%040x' % idx] or [])
+                   for idx in range(100)]
+        commits = parse(entries)
+        layout = dag.GraphLayout()
+        layout.add_commits(commits[:50])
+        replayed = layout.add_commits(commits[50:])
+        # The previous tip gains a child so only it is placed again.
+        self.assertEqual(51, len(replayed))
+        self.assertEqual(51, layout.replayed)
+        self.assertEqual(0, layout.full_recomputes)
+        self.assertEqual(list(range(100)), [c.row for c in commits])
+        self.assertEqual([0] * 100, [c.column for c in commits])
+
+    def test_checkpoints_are_thinned_out(self):
+        commits = parse(synthetic_history(3000))
+        expect = self.full_layout(commits)
+
+        layout = dag.GraphLayout()
+        for idx in range(0, len(commits), 100):
+            layout.add_commits(commits[idx:idx + 100])
+        # Branches started from old commits roll back into thinned areas
+        self.assertEqual(expect, cells(commits))
+        self.assertEqual(0, layout.full_recomputes)
+
+        positions = [checkpoint[0] for checkpoint in layout.checkpoints]
+        self.assertEqual(sorted(set(positions)), positions)
+        self.assertEqual(0, positions[0])
+        self.assertTrue(len(positions) < layout.checkpoint_interval)
+
+    def test_adding_known_commits_is_a_noop(self):
+        commits = parse(synthetic_history(50))
+        layout = dag.GraphLayout()
+        layout.add_commits(commits)
+        self.assertEqual([], layout.add_commits(commits[:10]))
+        self.assertEqual(0, layout.replayed)
+
+    def test_reset(self):
+        commits = parse(synthetic_history(50))
+        layout = dag.GraphLayout()
+        layout.add_commits(commits)
+        layout.reset()
+        self.assertEqual([], layout.commits)
+        self.assertEqual(len(commits), len(layout.add_commits(commits)))
+
+    def test_authors_are_shared(self):
+        # Separate copies of the same unicode text, as read from git
+        entries = [entry.replace('Author', 'Auth' + 'or\u00e9')
+                   for entry in synthetic_history(2)]
+        first, second = parse(entries)
+        self.assertEqual(first.author, 'Author\u00e9')
+        self.assertTrue(first.author is second.author)
+        self.assertTrue(first.email is second.email)
+
+
+class GenerationOrderTestCase(unittest.TestCase):
+
+    def commits(self, generations):
+        commits = []
+        for idx, generation in enumerate(generations):
+            commit = dag.Commit(oid='%040x' % idx)
+            commit.generation = generation
+            commits.append(commit)
+        return commits
+
+    def test_order_by_generation_is_stable(self):
+        commits = self.commits([3, 1, 2, 1, 3, 0])
+        ordered = dag.order_by_generation(commits)
+        expect = sorted(commits, key=lambda x: x.generation)
+        self.assertEqual(ordered, expect)
+
+    def test_order_by_generation_sparse(self):
+        commits = self.commits([100000, 5, 70000, 5])
+        ordered = dag.order_by_generation(commits)
+        self.assertEqual([c.generation for c in ordered],
+                         [5, 5, 70000, 100000])
+        self.assertEqual(ordered[0], commits[1])
+
+    def test_merge_by_generation_prefers_first_on_ties(self):
+        first = self.commits([1, 2, 2, 5])
+        second = self.commits([0, 2, 3, 6, 7])
+        merged = dag.merge_by_generation(first, second)
+        expect = sorted(first + second, key=lambda x: x.generation)
+        self.assertEqual(merged, expect)
+
+
+class BandIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.index = dag.BandIndex(100, offset=-10)
+
+    def test_keys_are_found_by_span(self):
+        index = self.index
+        index.update('a', -5)
+        index.update('b', 250)
+        index.update('edge', -5, 250)
+        self.assertEqual(index.query(0, 50), set(['a', 'edge']))
+        self.assertEqual(index.query(100, 150), set(['edge']))
+        self.assertEqual(index.query(200, 300), set(['b', 'edge']))
+        self.assertEqual(index.query(1000, 2000), set())
+        self.assertEqual(len(index), 3)
+
+    def test_band_boundaries(self):
+        index = self.index
+        self.assertEqual(index.band(-10), 0)
+        self.assertEqual(index.band(-11), -1)
+        self.assertEqual(index.band(89), 0)
+        self.assertEqual(index.band(90), 1)
+        self.assertEqual(index.band_top(1), 90)
+
+    def test_moving_a_key_marks_old_and_new_bands_dirty(self):
+        index = self.index
+        index.update('a', 0)
+        self.assertEqual(index.take_dirty(), set([0]))
+        index.update('a', 5)
+        self.assertEqual(index.take_dirty(), set())
+        index.update('a', 300)
+        self.assertEqual(index.take_dirty(), set([0, 3]))
+        self.assertEqual(index.query(0, 50), set())
+        self.assertEqual(index.keys(3), set(['a']))
+        self.assertEqual(index.bands, {3: set(['a'])})
+
+    def test_touch_and_remove(self):
+        index = self.index
+        index.update('edge', 0, 200)
+        index.take_dirty()
+        index.touch('edge')
+        self.assertEqual(index.take_dirty(), set([0, 1, 2]))
+        index.remove('edge')
+        self.assertEqual(index.take_dirty(), set([0, 1, 2]))
+        self.assertFalse('edge' in index)
+        self.assertEqual(index.bands, {})
+
+
+class RepoReaderTestCase(helper.GitRepositoryTestCase):
+    """Tests the RepoReader class."""
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        for idx in range(20):
+            self.write_file('A', 'change %d' % idx)
+            self.git('commit', '-a', '-m', 'summary %d' % idx)
+        self.git('tag', 'v1.0', 'HEAD~10')
+        self.git('checkout', '-b', 'topic', 'HEAD~5')
+        self.write_file('B', 'topic')
+        self.git('commit', '-a', '-m', 'topic')
+        self.git('checkout', 'master')
+        self.git('merge', '--no-ff', '-m', 'merge topic', 'topic')
+
+    def read(self, chunk_size=None):
+        reader = dag.RepoReader(dag.DAG('HEAD', 1000))
+        if chunk_size:
+            reader.chunk_size = chunk_size
+        reader.reset()
+        return reader
+
+    def test_commits_are_read_in_topological_order(self):
+        commits = list(self.read())
+        self.assertEqual(len(commits), 23)
+        self.assertEqual(commits[0].summary, 'initial commit')
+        self.assertEqual(commits[-1].summary, 'merge topic')
+        self.assertEqual(commits[-1].tags, set(['HEAD', 'heads/master']))
+        self.assertTrue(commits[-1].is_merge())
+        self.assertEqual(commits[-1].email, 'you@example.com')
+        self.assertEqual(commits[-1].author, 'Your Name')
+        seen = set()
+        for commit in commits:
+            for parent in commit.parents:
+                self.assertTrue(parent.oid in seen)
+            seen.add(commit.oid)
+
+    def test_tags(self):
+        tagged = [c for c in self.read() if c.tags]
+        self.assertEqual(len(tagged), 3)
+        self.assertEqual(tagged[0].tags, set(['tags/v1.0']))
+        self.assertEqual(tagged[0].summary, 'summary 9')
+
+    def test_batches_split_records_across_chunks(self):
+        expect = [c.oid for c in self.read()]
+        reader = self.read(chunk_size=7)
+        batches = list(reader.batches())
+        self.assertTrue(len(batches) > 1)
+        actual = [c.oid for batch in batches for c in batch]
+        self.assertEqual(expect, actual)
+        self.assertTrue(reader.cached)
+        self.assertEqual(reader.returncode, 0)
+
+    def test_cached_commits_are_reused(self):
+        reader = self.read()
+        commits = list(reader)
+        self.assertEqual(commits, list(reader))
+        self.assertEqual(len(reader), len(commits))
+
+    def test_commit_graph_generations(self):
+        status, _, _ = core.run_command(
+            ['git', 'commit-graph', 'write', '--reachable'])
+        if status != 0:
+            self.skipTest('git commit-graph is not available')
+        reader = dag.RepoReader(dag.DAG('HEAD', 5))
+        reader.reset()
+        graph = dag.CommitFactory.commit_graph
+        self.assertTrue(graph is not None)
+        commits = list(reader)
+        self.assertEqual(len(commits), 5)
+        for commit in commits:
+            self.assertEqual(commit.generation, graph.generation(commit.oid))
+        # The merge is the 23rd commit and the root has level 1
+        self.assertEqual(commits[-1].generation, 22)
+        self.assertEqual(graph.generation('0' * 40), None)
+
+    def test_non_utf8_records(self):
+        tree = self.git('rev-parse', 'HEAD^{tree}').strip()
+        head = self.git('rev-parse', 'HEAD').strip()
+        commit = ('tree %s\nparent %s\n'
+                  'author Ren\xe9 <r@example.com> 1500000000 +0000\n'
+                  'committer Ren\xe9 <r@example.com> 1500000000 +0000\n'
+                  '\ncaf\xe9\n' % (tree, head)).encode('iso-8859-1')
+        proc = core.start_command(['git', 'hash-object', '-t', 'commit',
+                                   '-w', '--stdin'])
+        out, _ = proc.communicate(commit)
+        self.git('update-ref', 'refs/heads/master', core.decode(out).strip())
+
+        commits = list(self.read())
+        self.assertEqual(len(commits), 24)
+        self.assertEqual(commits[-1].author, 'Ren\xe9')
+        self.assertEqual(commits[-1].summary, 'caf\xe9')
+        self.assertEqual(commits[-2].summary, 'merge topic')
+
+
+class DAGCacheTestCase(helper.GitRepositoryTestCase):
+    """Tests the DAGCache class."""
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        for idx in range(10):
+            self.commit('summary %d' % idx)
+        self.git('tag', 'v1.0', 'HEAD~5')
+
+    def commit(self, summary):
+        self.append_file('A', summary)
+        self.git('commit', '-a', '-m', summary)
+
+    def read(self, count=1000, cmd=None):
+        reader = dag.RepoReader(dag.DAG('HEAD', count), cache=dag.DAGCache())
+        if cmd is not None:
+            reader._cmd = cmd
+        reader.reset()
+        return list(reader)
+
+    def test_unchanged_history_is_read_from_the_cache(self):
+        expect = self.read()
+        self.assertEqual(len(expect), 11)
+        # "git log" is not run when the entry is current
+        commits = self.read(cmd=['git', 'log', '--invalid-option'])
+        self.assertEqual([c.oid for c in expect], [c.oid for c in commits])
+        self.assertEqual([c.summary for c in expect],
+                         [c.summary for c in commits])
+        self.assertEqual(commits[-1].tags, set(['HEAD', 'heads/master']))
+        self.assertEqual(commits[5].tags, set(['tags/v1.0']))
+
+    def test_labels_are_not_cached(self):
+        self.read()
+        self.git('tag', 'v2.0', 'HEAD~2')
+        self.git('tag', '-d', 'v1.0')
+        commits = self.read()
+        self.assertEqual(commits[5].tags, ())
+        self.assertEqual(commits[8].tags, set(['tags/v2.0']))
+
+    def test_new_commits_extend_the_cache(self):
+        expect = self.read()
+        self.commit('new commit')
+        commits = self.read()
+        self.assertEqual(len(commits), 12)
+        self.assertEqual([c.oid for c in expect],
+                         [c.oid for c in commits[:-1]])
+        self.assertEqual(commits[-1].summary, 'new commit')
+        self.assertEqual(commits[-1].parents, [commits[-2]])
+        self.assertEqual(commits[-1].tags, set(['HEAD', 'heads/master']))
+        self.assertEqual(commits[-2].tags, ())
+        # The extended entry is current
+        commits = self.read(cmd=['git', 'log', '--invalid-option'])
+        self.assertEqual(len(commits), 12)
+
+    def test_extending_the_cache_respects_the_count(self):
+        self.read(count=5)
+        self.commit('new commit')
+        commits = self.read(count=5)
+        self.assertEqual([c.summary for c in commits],
+                         ['summary 6', 'summary 7', 'summary 8', 'summary 9',
+                          'new commit'])
+
+    def test_rewritten_history_is_read_again(self):
+        self.read()
+        self.git('reset', '--hard', 'HEAD~2')
+        self.commit('rewritten')
+        commits = self.read()
+        self.assertEqual(len(commits), 10)
+        self.assertEqual(commits[-1].summary, 'rewritten')
+        self.assertEqual(commits[-2].summary, 'summary 7')
+
+
+if __name__ == '__main__':
+    unittest.main()
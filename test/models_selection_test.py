@@ -22,6 +22,40 @@ class SelectionTestCase(unittest.TestCase):
         actual = selection.union(t)
         self.assertEqual(expect, actual)
 
+    def test_update(self):
+        model = selection.SelectionModel()
+        model.set_selection(selection.State(['a'], [], ['b', 'c', 'd'], []))
+
+        t = T()
+        t.staged = []
+        t.unmerged = []
+        t.modified = ['d', 'b']
+        t.untracked = ['a']
+        model.update(t)
+
+        self.assertEqual(model.selection(),
+                         selection.State([], [], ['b', 'd'], []))
+        self.assertTrue(model.is_selected('b'))
+        self.assertFalse(model.is_selected('a'))
+
+    def test_selection_delta(self):
+        model = selection.SelectionModel()
+        model.set_selection(selection.State([], [], ['a', 'b'], []))
+
+        deltas = []
+        model.add_observer(model.message_selection_delta,
+                           lambda added, removed: deltas.append(
+                               (added, removed)))
+        model.set_selection(selection.State(['a'], [], ['b', 'c'], []))
+        model.set_selection(selection.State(['a'], [], ['b', 'c'], []))
+
+        self.assertEqual(len(deltas), 1)
+        added, removed = deltas[0]
+        self.assertEqual(added, selection.State(
+            frozenset(['a']), frozenset(), frozenset(['c']), frozenset()))
+        self.assertEqual(removed, selection.State(
+            frozenset(), frozenset(), frozenset(['a']), frozenset()))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,66 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import unittest
+
+from cola import git
+from cola.models import tracked
+
+from test import helper
+
+
+class TrackedFilesTestCase(helper.GitRepositoryTestCase):
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        os.makedirs(os.path.join('a', 'b'))
+        self.touch('a/b/c.txt', 'a/b.txt', 'a/d.txt')
+        self.git('add', 'a')
+        self.tracked = tracked.TrackedFiles(git.current())
+
+    def test_paths(self):
+        self.assertEqual(self.tracked.paths(),
+                         ['A', 'B', 'a/b.txt', 'a/b/c.txt', 'a/d.txt'])
+        self.assertEqual(self.tracked.directories(), set(['a', 'a/b']))
+
+    def test_paths_are_shared_until_the_index_changes(self):
+        paths = self.tracked.paths()
+        self.assertTrue(self.tracked.paths() is paths)
+
+        self.touch('e.txt')
+        self.git('add', 'e.txt')
+        self.assertTrue('e.txt' in self.tracked.paths())
+
+    def test_startswith(self):
+        self.assertEqual(self.tracked.startswith('a/b'),
+                         ['a/b.txt', 'a/b/c.txt'])
+        self.assertEqual(self.tracked.startswith('z'), [])
+
+    def test_contains(self):
+        self.assertTrue(self.tracked.contains('a/b/c.txt'))
+        self.assertFalse(self.tracked.contains('a/b'))
+        self.assertFalse(self.tracked.contains('z'))
+
+    def test_select(self):
+        os.makedirs('untracked')
+        self.touch('a/untracked.txt', 'untracked/e.txt')
+        paths = ['a', 'a/b', 'a/b.txt', 'a/untracked.txt', 'untracked',
+                 'untracked/e.txt', 'A']
+        self.assertEqual(self.tracked.select(paths),
+                         ['a', 'a/b', 'a/b.txt', 'A'])
+
+    def test_listdir(self):
+        self.assertEqual(self.tracked.listdir(''), ['A', 'B', 'a'])
+        self.assertEqual(self.tracked.listdir('a'), ['b', 'b.txt', 'd.txt'])
+        self.assertEqual(self.tracked.listdir('a/b/'), ['c.txt'])
+
+    def test_match(self):
+        self.assertEqual(self.tracked.match(['*b*']),
+                         ['a/b.txt', 'a/b/c.txt'])
+        self.assertEqual(self.tracked.match(['*c.txt*', '*d*']),
+                         ['a/b/c.txt', 'a/d.txt'])
+        self.assertEqual(len(self.tracked.match([])), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
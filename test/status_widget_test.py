@@ -0,0 +1,99 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+
+from qtpy import QtWidgets
+
+from cola.widgets import status
+
+from test import helper
+
+
+class SubtreeDeltaTestCase(unittest.TestCase):
+
+    def test_no_change(self):
+        items = ['a', 'b', 'c']
+        self.assertEqual(status.subtree_delta(items, list(items)), ([], []))
+        self.assertEqual(status.subtree_delta([], []), ([], []))
+
+    def test_removals(self):
+        old = ['a', 'b', 'c', 'd', 'e']
+        delta = status.subtree_delta(old, ['b', 'd'])
+        # Rows are removed from the bottom up so that they stay valid
+        self.assertEqual(delta, ([4, 2, 0], []))
+
+    def test_insert_runs(self):
+        old = ['b', 'e']
+        new = ['a', 'b', 'c', 'd', 'e', 'f']
+        delta = status.subtree_delta(old, new)
+        self.assertEqual(delta, ([], [(0, ['a']), (2, ['c', 'd']),
+                                      (5, ['f'])]))
+
+    def test_removals_and_inserts(self):
+        old = ['a', 'b', 'c']
+        new = ['b', 'bb', 'c', 'd']
+        self.assertEqual(status.subtree_delta(old, new),
+                         ([0], [(1, ['bb']), (3, ['d'])]))
+
+    def test_many_paths(self):
+        old = ['%04d' % i for i in range(0, 400, 2)]
+        new = ['%04d' % i for i in range(0, 400)]
+        removed_rows, inserts = status.subtree_delta(old, new)
+        self.assertEqual(removed_rows, [])
+        self.assertEqual(len(inserts), 200)
+        self.assertEqual(inserts[0], (1, ['0001']))
+
+        removed_rows, inserts = status.subtree_delta(new, old)
+        self.assertEqual(removed_rows, list(range(399, 0, -2)))
+        self.assertEqual(inserts, [])
+
+    def test_reorder(self):
+        self.assertEqual(status.subtree_delta(['a', 'b'], ['b', 'a']), None)
+        self.assertEqual(
+            status.subtree_delta(['a', 'b', 'c'], ['c', 'x', 'b']), None)
+
+
+class StatusTreeWidgetTestCase(helper.GitRepositoryTestCase):
+    """Tests the StatusTreeWidget"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QtWidgets.QApplication.instance()
+        if cls.app is None:
+            cls.app = QtWidgets.QApplication([])
+
+    def setUp(self):
+        # The widget reads its preferences from the repository's config
+        helper.GitRepositoryTestCase.setUp(self)
+        self.tree = status.StatusTreeWidget(Mock())
+        self.idx = self.tree.idx_modified
+
+    def tearDown(self):
+        self.tree.deleteLater()
+        helper.GitRepositoryTestCase.tearDown(self)
+
+    def children(self):
+        parent = self.tree.topLevelItem(self.idx)
+        return [(parent.child(row).path, parent.child(row).deleted)
+                for row in range(parent.childCount())]
+
+    def test_set_subtree_updates_deleted_items(self):
+        tree = self.tree
+        tree._set_subtree(['a', 'b', 'c'], self.idx, deleted_set=set())
+        tree._set_subtree(['a', 'b', 'c', 'd'], self.idx,
+                          deleted_set=set(['b']))
+        self.assertEqual(self.children(), [('a', False), ('b', True),
+                                           ('c', False), ('d', False)])
+
+        tree._set_subtree(['b', 'c', 'd'], self.idx, deleted_set=set(['c']))
+        self.assertEqual(self.children(), [('b', False), ('c', True),
+                                           ('d', False)])
+
+
+if __name__ == '__main__':
+    unittest.main()